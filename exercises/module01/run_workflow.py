@@ -1,4 +1,5 @@
 import asyncio
+from datetime import timedelta
 
 from temporalio.client import Client, WorkflowExecutionStatus
 from temporalio.worker import Worker
@@ -17,6 +18,8 @@ async def main():
         task_queue="print-numbers-task-queue",
         workflows=[PrintNumbersWorkflow],
         activities=[print_number],
+        # How long shutdown() waits for in-flight activities before cancelling them
+        graceful_shutdown_timeout=timedelta(seconds=10),
     )
     
     print("Starting worker on task queue: print-numbers-task-queue")
@@ -64,13 +67,11 @@ async def main():
     result = await handle.result()
     print(f"\nWorkflow result: {result}")
     
-    # Shutdown the worker
+    # Shutdown the worker: stop polling and give in-flight activities up to
+    # graceful_shutdown_timeout to finish (cancelling worker_task would abandon them)
     print("\nShutting down worker...")
-    worker_task.cancel()
-    try:
-        await worker_task
-    except asyncio.CancelledError:
-        pass
+    await worker.shutdown()
+    await worker_task
     
     print("Worker stopped")
 
@@ -1,6 +1,7 @@
 import asyncio
 import sys
 import requests
+from datetime import timedelta
 
 from temporalio.client import Client, WorkflowExecutionStatus
 from temporalio.worker import Worker
@@ -31,6 +32,8 @@ async def main():
         task_queue="money-transfer-task-queue",
         workflows=[MoneyTransferWorkflow],
         activities=[check_balance, withdraw, deposit],
+        # How long shutdown() waits for in-flight activities before cancelling them
+        graceful_shutdown_timeout=timedelta(seconds=10),
     )
     
     print("Starting worker on task queue: money-transfer-task-queue")
@@ -117,13 +120,11 @@ async def main():
         print(f"Error: {e}")
         sys.exit(1)
     
-    # Shutdown the worker
+    # Shutdown the worker: stop polling and give in-flight activities up to
+    # graceful_shutdown_timeout to finish (cancelling worker_task would abandon them)
     print("\n\nShutting down worker...")
-    worker_task.cancel()
-    try:
-        await worker_task
-    except asyncio.CancelledError:
-        pass
+    await worker.shutdown()
+    await worker_task
     
     print("Worker stopped")
     print("\n✓ Money transfer completed successfully!")
@@ -1,3 +1,4 @@
+import asyncio
 from datetime import timedelta
 from dataclasses import dataclass
 
@@ -112,18 +113,28 @@ class MoneyTransferWorkflow: #todo rename to MoneyTransferWorkflowModule2
         
         # Step 5: Get final balances
         workflow.logger.info("Step 5: Retrieving final balances...")
-        final_from_balance = await workflow.execute_activity(
+        final_from_check = workflow.execute_activity(
             check_balance,
             CheckBalanceInput(account_id=input.from_account),
             start_to_close_timeout=timedelta(seconds=10),
         )
         
-        final_to_balance = await workflow.execute_activity(
+        final_to_check = workflow.execute_activity(
             check_balance,
             CheckBalanceInput(account_id=input.to_account),
             start_to_close_timeout=timedelta(seconds=10),
         )
         
+        # The two reads are independent, so run them at the same time.
+        # Workflows started before this change replay them one after the other.
+        if workflow.patched("parallel-final-balances"):
+            final_from_balance, final_to_balance = await asyncio.gather(
+                final_from_check, final_to_check
+            )
+        else:
+            final_from_balance = await final_from_check
+            final_to_balance = await final_to_check
+        
         workflow.logger.info("✓ Transfer complete!")
         
         return MoneyTransferResult(
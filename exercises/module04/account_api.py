@@ -4,10 +4,18 @@ import random
 import time
 from pathlib import Path
 from flask import Flask, jsonify, request
-from threading import Lock
 from functools import wraps
 
+from flask_metrics import instrument_app
+from metrics import REGISTRY, SHORT_LATENCY_BUCKETS_MS, TimedRLock
+from tracing import configure_tracing, span, trace_requests
+
 app = Flask(__name__)
+# Request rate/latency/errors, lock wait and storage I/O time at GET /metrics
+instrument_app(app)
+# Server span per request, joined to the caller's trace (if TRACING_EXPORTER is set)
+configure_tracing("account-api")
+trace_requests(app)
 
 # Real world mode - things randomly fail! 
 REAL_WORLD_MODE = False
@@ -15,8 +23,19 @@ REAL_WORLD_MODE = False
 # Path to our fake database
 DB_FILE = Path(__file__).parent / "accounts.json"
 
-# Lock for thread-safe file operations
-db_lock = Lock()
+# Lock for thread-safe file operations (re-entrant so a read-modify-write can
+# hold it across read_accounts() and write_accounts()). Records lock_wait_ms.
+db_lock = TimedRLock("accounts_db")
+
+# Responses of deposits, withdraws and transfers sent with an idempotency_key,
+# so a retried one (e.g. a saga compensation) is applied only once. Logged next to
+# the accounts so they survive restarts, including the debug reloader's.
+PROCESSED_DEPOSITS_FILE = Path(__file__).parent / "processed_deposits.jsonl"
+# Keys remembered (the oldest are forgotten first)
+MAX_PROCESSED_DEPOSITS = 10000
+
+# Logged in place of a response for a key voided with POST /operations/<key>/void
+VOIDED_RESULT = {"voided": True}
 
 
 def simulate_real_world_failures(f):
@@ -45,16 +64,85 @@ def simulate_real_world_failures(f):
     return decorated_function
 
 
+def load_processed_deposits():
+    """Load the deposits logged by record_processed_deposit, newest last."""
+    deposits = {}
+    try:
+        with open(PROCESSED_DEPOSITS_FILE, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Half-written last line from a crash
+                    continue
+                deposits[entry["key"]] = entry["result"]
+    except FileNotFoundError:
+        pass
+    while len(deposits) > MAX_PROCESSED_DEPOSITS:
+        deposits.pop(next(iter(deposits)))
+    return deposits
+
+
+processed_deposits = load_processed_deposits()
+# Lines in PROCESSED_DEPOSITS_FILE; rewritten without forgotten keys when it doubles
+processed_deposits_lines = len(processed_deposits)
+
+
+def record_processed_deposit(idempotency_key, result):
+    """Remember a deposit's, withdraw's or transfer's response, in memory and in PROCESSED_DEPOSITS_FILE. Call with db_lock held."""
+    global processed_deposits_lines
+    processed_deposits[idempotency_key] = result
+    if len(processed_deposits) > MAX_PROCESSED_DEPOSITS:
+        processed_deposits.pop(next(iter(processed_deposits)))
+    
+    with REGISTRY.timer("storage_io_ms", SHORT_LATENCY_BUCKETS_MS, operation="write_deposit_log"):
+        if processed_deposits_lines < 2 * MAX_PROCESSED_DEPOSITS:
+            # Appending one line keeps a deposit cheap however many are remembered
+            with open(PROCESSED_DEPOSITS_FILE, 'a') as f:
+                f.write(json.dumps({"key": idempotency_key, "result": result}) + "\n")
+            processed_deposits_lines += 1
+            return
+        
+        tmp_file = PROCESSED_DEPOSITS_FILE.with_suffix(".tmp")
+        with open(tmp_file, 'w') as f:
+            for key, logged_result in processed_deposits.items():
+                f.write(json.dumps({"key": key, "result": logged_result}) + "\n")
+        os.replace(tmp_file, PROCESSED_DEPOSITS_FILE)
+        processed_deposits_lines = len(processed_deposits)
+
+
+def processed_response(idempotency_key):
+    """
+    Response for an operation whose key was already used, or None. Call with db_lock held.
+    
+    The original response if the operation was applied, 409 if the key was voided.
+    """
+    if not idempotency_key or idempotency_key not in processed_deposits:
+        return None
+    if processed_deposits[idempotency_key] == VOIDED_RESULT:
+        return jsonify({"error": "Operation was voided", "idempotency_key": idempotency_key}), 409
+    return jsonify(processed_deposits[idempotency_key]), 200
+
+
 def read_accounts():
     """Read accounts from JSON file."""
-    with db_lock:
+    # The span covers waiting for the lock as well as the file I/O
+    with (
+        span("accounts_db.read"),
+        db_lock,
+        REGISTRY.timer("storage_io_ms", SHORT_LATENCY_BUCKETS_MS, operation="read"),
+    ):
         with open(DB_FILE, 'r') as f:
             return json.load(f)
 
 
 def write_accounts(accounts):
     """Write accounts to JSON file."""
-    with db_lock:
+    with (
+        span("accounts_db.write"),
+        db_lock,
+        REGISTRY.timer("storage_io_ms", SHORT_LATENCY_BUCKETS_MS, operation="write"),
+    ):
         with open(DB_FILE, 'w') as f:
             json.dump(accounts, f, indent=2)
 
@@ -84,34 +172,47 @@ def withdraw(account_number):
         return jsonify({"error": "Amount is required"}), 400
     
     amount = data['amount']
+    idempotency_key = data.get('idempotency_key')
     
     if amount <= 0:
         return jsonify({"error": "Amount must be positive"}), 400
     
-    accounts = read_accounts()
-    
-    if account_number not in accounts:
-        return jsonify({"error": "Account not found"}), 404
-    
-    current_balance = accounts[account_number]["balance"]
-    
-    if current_balance < amount:
-        return jsonify({
-            "error": "Insufficient funds",
-            "current_balance": current_balance,
-            "requested_amount": amount
-        }), 400
-    
-    # Perform withdrawal
-    accounts[account_number]["balance"] = current_balance - amount
-    write_accounts(accounts)
+    # Every writer holds the lock across its read-modify-write, or a
+    # concurrent deposit or transfer could be overwritten
+    with db_lock:
+        # Same key as an earlier withdrawal: return its result without withdrawing again
+        processed = processed_response(idempotency_key)
+        if processed:
+            return processed
+        
+        accounts = read_accounts()
+        
+        if account_number not in accounts:
+            return jsonify({"error": "Account not found"}), 404
+        
+        current_balance = accounts[account_number]["balance"]
+        
+        if current_balance < amount:
+            return jsonify({
+                "error": "Insufficient funds",
+                "current_balance": current_balance,
+                "requested_amount": amount
+            }), 400
+        
+        # Perform withdrawal
+        accounts[account_number]["balance"] = current_balance - amount
+        write_accounts(accounts)
+        
+        result = {
+            "account_number": account_number,
+            "previous_balance": current_balance,
+            "amount_withdrawn": amount,
+            "new_balance": accounts[account_number]["balance"]
+        }
+        if idempotency_key:
+            record_processed_deposit(idempotency_key, result)
     
-    return jsonify({
-        "account_number": account_number,
-        "previous_balance": current_balance,
-        "amount_withdrawn": amount,
-        "new_balance": accounts[account_number]["balance"]
-    }), 200
+    return jsonify(result), 200
 
 
 @app.route('/accounts/<account_number>/deposit', methods=['POST'])
@@ -124,27 +225,121 @@ def deposit(account_number):
         return jsonify({"error": "Amount is required"}), 400
     
     amount = data['amount']
+    idempotency_key = data.get('idempotency_key')
     
     if amount <= 0:
         return jsonify({"error": "Amount must be positive"}), 400
     
-    accounts = read_accounts()
+    with db_lock:
+        # Same key as an earlier deposit: return its result without depositing again
+        processed = processed_response(idempotency_key)
+        if processed:
+            return processed
+        
+        accounts = read_accounts()
+        
+        if account_number not in accounts:
+            return jsonify({"error": "Account not found"}), 404
+        
+        current_balance = accounts[account_number]["balance"]
+        
+        # Perform deposit
+        accounts[account_number]["balance"] = current_balance + amount
+        write_accounts(accounts)
+        
+        result = {
+            "account_number": account_number,
+            "previous_balance": current_balance,
+            "amount_deposited": amount,
+            "new_balance": accounts[account_number]["balance"]
+        }
+        if idempotency_key:
+            # Right after the balance is written, under the same lock. A crash
+            # between the two writes is the only way to lose a key.
+            record_processed_deposit(idempotency_key, result)
     
-    if account_number not in accounts:
-        return jsonify({"error": "Account not found"}), 404
+    return jsonify(result), 200
+
+
+@app.route('/transfers', methods=['POST'])
+@simulate_real_world_failures
+def transfer():
+    """Atomically withdraw from one account and deposit to another."""
+    data = request.get_json()
     
-    current_balance = accounts[account_number]["balance"]
+    if not data or not all(k in data for k in ('from_account', 'to_account', 'amount')):
+        return jsonify({"error": "from_account, to_account and amount are required"}), 400
     
-    # Perform deposit
-    accounts[account_number]["balance"] = current_balance + amount
-    write_accounts(accounts)
+    from_account = data['from_account']
+    to_account = data['to_account']
+    amount = data['amount']
+    idempotency_key = data.get('idempotency_key')
     
-    return jsonify({
-        "account_number": account_number,
-        "previous_balance": current_balance,
-        "amount_deposited": amount,
-        "new_balance": accounts[account_number]["balance"]
-    }), 200
+    if amount <= 0:
+        return jsonify({"error": "Amount must be positive"}), 400
+    
+    if from_account == to_account:
+        return jsonify({"error": "Cannot transfer to the same account"}), 400
+    
+    # Hold the lock for the whole read-modify-write so the debit and credit
+    # are applied together or not at all
+    with db_lock:
+        # Same key as an earlier transfer: return its result without transferring again
+        processed = processed_response(idempotency_key)
+        if processed:
+            return processed
+        
+        accounts = read_accounts()
+        
+        for account_number in (from_account, to_account):
+            if account_number not in accounts:
+                return jsonify({"error": "Account not found", "account_number": account_number}), 404
+        
+        from_balance = accounts[from_account]["balance"]
+        to_balance = accounts[to_account]["balance"]
+        
+        if from_balance < amount:
+            return jsonify({
+                "error": "Insufficient funds",
+                "current_balance": from_balance,
+                "requested_amount": amount
+            }), 400
+        
+        accounts[from_account]["balance"] = from_balance - amount
+        accounts[to_account]["balance"] = to_balance + amount
+        write_accounts(accounts)
+        
+        result = {
+            "from_account": from_account,
+            "to_account": to_account,
+            "amount": amount,
+            "from_account_previous_balance": from_balance,
+            "to_account_previous_balance": to_balance,
+            "from_account_new_balance": accounts[from_account]["balance"],
+            "to_account_new_balance": accounts[to_account]["balance"]
+        }
+        if idempotency_key:
+            record_processed_deposit(idempotency_key, result)
+    
+    return jsonify(result), 200
+
+
+@app.route('/operations/<idempotency_key>/void', methods=['POST'])
+@simulate_real_world_failures
+def void_operation(idempotency_key):
+    """
+    Make sure the operation sent with `idempotency_key` is never applied.
+    
+    Answers whether it was applied already. If it wasn't, a request with the
+    key that is still on its way is rejected with 409 when it arrives - so a
+    caller whose attempts all timed out knows for sure before compensating.
+    """
+    with db_lock:
+        applied = idempotency_key in processed_deposits and processed_deposits[idempotency_key] != VOIDED_RESULT
+        if idempotency_key not in processed_deposits:
+            record_processed_deposit(idempotency_key, VOIDED_RESULT)
+    
+    return jsonify({"idempotency_key": idempotency_key, "applied": applied}), 200
 
 
 @app.route('/health', methods=['GET'])
@@ -160,5 +355,8 @@ if __name__ == '__main__':
     print("  GET  /accounts/<account_number>")
     print("  POST /accounts/<account_number>/withdraw")
     print("  POST /accounts/<account_number>/deposit")
+    print("  POST /transfers")
+    print("  POST /operations/<idempotency_key>/void")
     print("  GET  /health")
+    print("  GET  /metrics")
     app.run(host='0.0.0.0', port=5000, debug=True)
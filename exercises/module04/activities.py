@@ -1,6 +1,15 @@
+import asyncio
 import requests
 from dataclasses import dataclass
 from temporalio import activity
+from temporalio.client import WithStartWorkflowOperation, WorkflowUpdateFailedError
+from temporalio.common import WorkflowIDConflictPolicy
+from temporalio.exceptions import ApplicationError
+
+from batch_store import read_batch
+from shared import MoneyTransferInput, workflow_task_queue
+from structured_logging import log_error, log_success
+from tracing import http_client_span
 
 # Account API base URL
 API_BASE_URL = "http://127.0.0.1:5000"
@@ -18,6 +27,8 @@ class WithdrawInput:
     """Input for withdraw activity."""
     account_id: str
     amount: float
+    # Sent to the Account API so retries of the same withdrawal are applied once
+    idempotency_key: str | None = None
 
 
 @dataclass
@@ -25,6 +36,18 @@ class DepositInput:
     """Input for deposit activity."""
     account_id: str
     amount: float
+    # Sent to the Account API so retries of the same deposit are applied once
+    idempotency_key: str | None = None
+
+
+@dataclass
+class TransferInput:
+    """Input for transfer activity."""
+    from_account: str
+    to_account: str
+    amount: float
+    # Sent to the Account API so retries of the same transfer are applied once
+    idempotency_key: str | None = None
 
 
 @dataclass
@@ -43,6 +66,130 @@ class TransactionResult:
     amount: float
 
 
+@dataclass
+class TransferResult:
+    """Result from transfer activity."""
+    from_account: str
+    to_account: str
+    amount: float
+    from_account_previous_balance: float
+    to_account_previous_balance: float
+    from_account_new_balance: float
+    to_account_new_balance: float
+
+
+@dataclass
+class AccountOperation:
+    """A debit or credit sent to an AccountWorkflow."""
+    kind: str
+    amount: float
+    # Repeats of an operation with the same ID are applied once ("" = no dedup)
+    operation_id: str = ""
+
+
+@dataclass
+class AccountOperationResult:
+    """Result of an AccountWorkflow operation."""
+    account_id: str
+    kind: str
+    amount: float
+    balance: float
+
+
+@dataclass
+class AccountOperationInput:
+    """Input for apply_account_operation activity."""
+    account_id: str
+    kind: str
+    amount: float
+    # AccountWorkflow applies an operation ID once, so retries of the activity don't apply it twice
+    operation_id: str
+
+
+@dataclass
+class VoidOperationInput:
+    """Input for void_operation activity."""
+    idempotency_key: str
+
+
+@dataclass
+class VoidAccountOperationInput:
+    """Input for void_account_operation activity."""
+    account_id: str
+    operation_id: str
+
+
+@dataclass
+class VoidOperationResult:
+    """Result from void_operation and void_account_operation activities."""
+    # Whether the operation was applied before it was voided
+    applied: bool
+
+
+@dataclass
+class LoadBatchTransfersInput:
+    """Input for load_batch_transfers activity."""
+    batch_id: str
+    offset: int
+    limit: int
+
+
+# Error type raised when the Account API has no atomic transfer endpoint
+ATOMIC_TRANSFER_UNAVAILABLE = "AtomicTransferUnavailable"
+
+# Error type raised when a debit is larger than the account's running balance
+INSUFFICIENT_FUNDS = "InsufficientFunds"
+
+# Error type of an AccountWorkflow operation whose downstream call failed.
+# Retryable: the operation isn't recorded as applied, so a retry applies it.
+ACCOUNT_OPERATION_FAILED = "AccountOperationFailed"
+
+# Error type of an operation rejected because its AccountWorkflow is about to
+# continue as new. Sent again, it lands on the new run.
+ACCOUNT_WORKFLOW_DRAINING = "AccountWorkflowDraining"
+
+# Seconds between sends of an operation rejected by a draining AccountWorkflow
+ACCOUNT_WORKFLOW_DRAINING_RETRY_SECONDS = 0.1
+
+# Seconds between heartbeats of activities that wait on an AccountWorkflow
+ACCOUNT_OPERATION_HEARTBEAT_SECONDS = 1.0
+
+# Error type of an operation sent with a key that was voided (see void_operation)
+OPERATION_VOIDED = "OperationVoided"
+
+# Error type raised when a batch's transfers aren't in the batch store
+BATCH_NOT_FOUND = "BatchNotFound"
+
+
+async def heartbeat_periodically(interval):
+    """
+    Heartbeat every `interval` seconds until cancelled.
+    
+    Run next to a long wait: the heartbeat is how a timed-out or cancelled
+    attempt finds out, so it stops and gives its slot back.
+    """
+    while True:
+        activity.heartbeat()
+        await asyncio.sleep(interval)
+
+
+def is_insufficient_funds(response):
+    """Whether an Account API response is the "Insufficient funds" rejection."""
+    return (
+        response.status_code == 400
+        and "json" in response.headers.get("Content-Type", "")
+        and response.json().get("error") == "Insufficient funds"
+    )
+
+
+def raise_if_voided(response, idempotency_key):
+    """Turn the Account API's 409 for a voided idempotency key into a non-retryable error."""
+    if response.status_code == 409:
+        raise ApplicationError(
+            f"Operation {idempotency_key} was voided", type=OPERATION_VOIDED, non_retryable=True
+        )
+
+
 @activity.defn
 async def check_balance(input: CheckBalanceInput) -> BalanceResult:
     """
@@ -57,23 +204,25 @@ async def check_balance(input: CheckBalanceInput) -> BalanceResult:
     Raises:
         Exception: If the API request fails
     """
-    activity.logger.info(f"Checking balance of {input.account_id}...")
-    
     try:
-        response = requests.get(
-            f"{API_BASE_URL}/accounts/{input.account_id}"
-        )
+        with http_client_span("GET", "/accounts/<account_number>") as headers:
+            response = requests.get(
+                f"{API_BASE_URL}/accounts/{input.account_id}",
+                headers=headers,
+            )
         response.raise_for_status()
         balance = response.json()['balance']
         
-        activity.logger.info(f"✓ {input.account_id} balance: ${balance:.2f}")
+        log_success(activity.logger, "check_balance.succeeded",
+                    account_id=input.account_id, balance=balance)
         
         return BalanceResult(
             account_id=input.account_id,
             balance=balance
         )
     except requests.exceptions.RequestException as e:
-        activity.logger.error(f"✗ Error checking {input.account_id} balance: {e}")
+        log_error(activity.logger, "check_balance.failed",
+                  account_id=input.account_id, error=e)
         raise
 
 
@@ -83,27 +232,44 @@ async def withdraw(input: WithdrawInput) -> TransactionResult:
     Withdraw money from an account.
     
     Args:
-        input: WithdrawInput containing account_id and amount
+        input: WithdrawInput containing account_id, amount and an optional idempotency_key
         
     Returns:
         TransactionResult with transaction details
         
     Raises:
-        Exception: If the API request fails or insufficient funds
+        ApplicationError: (type InsufficientFunds) if the balance is too low.
+            Retryable - list the type in non_retryable_error_types to give up
+        ApplicationError: (non-retryable, type OperationVoided) if the
+            idempotency_key was voided
+        Exception: If the API request fails
     """
-    activity.logger.info(f"Withdrawing ${input.amount:.2f} from {input.account_id}...")
-    
+    body = {"amount": input.amount}
+    if input.idempotency_key:
+        body["idempotency_key"] = input.idempotency_key
     try:
-        response = requests.post(
-            f"{API_BASE_URL_2_NEW_FROM_JERRY}/accounts/{input.account_id}/withdraw",
-            json={"amount": input.amount},
-        )
+        with http_client_span("POST", "/accounts/<account_number>/withdraw") as headers:
+            response = requests.post(
+                f"{API_BASE_URL_2_NEW_FROM_JERRY}/accounts/{input.account_id}/withdraw",
+                json=body,
+                headers=headers,
+            )
+        if is_insufficient_funds(response):
+            log_error(activity.logger, "withdraw.insufficient_funds",
+                      account_id=input.account_id, amount=input.amount,
+                      balance=response.json().get("current_balance"))
+            raise ApplicationError(
+                f"Insufficient funds in {input.account_id}: requested {input.amount:.2f}",
+                type=INSUFFICIENT_FUNDS,
+            )
+        raise_if_voided(response, input.idempotency_key)
         response.raise_for_status()
         result = response.json()
         
-        activity.logger.info(f"✓ Withdrawal successful")
-        activity.logger.info(f"  Previous balance: ${result['previous_balance']:.2f}")
-        activity.logger.info(f"  New balance: ${result['new_balance']:.2f}")
+        log_success(activity.logger, "withdraw.succeeded",
+                    account_id=input.account_id, amount=input.amount,
+                    previous_balance=result['previous_balance'],
+                    new_balance=result['new_balance'])
         
         return TransactionResult(
             account_id=input.account_id,
@@ -112,9 +278,9 @@ async def withdraw(input: WithdrawInput) -> TransactionResult:
             amount=input.amount
         )
     except requests.exceptions.RequestException as e:
-        activity.logger.error(f"✗ Error withdrawing from {input.account_id}: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            activity.logger.error(f"  Response: {e.response.text}")
+        log_error(activity.logger, "withdraw.failed",
+                  account_id=input.account_id, amount=input.amount, error=e,
+                  response=e.response.text if e.response is not None else None)
         raise
 
 
@@ -124,27 +290,34 @@ async def deposit(input: DepositInput) -> TransactionResult:
     Deposit money to an account.
     
     Args:
-        input: DepositInput containing account_id and amount
+        input: DepositInput containing account_id, amount and an optional idempotency_key
         
     Returns:
         TransactionResult with transaction details
         
     Raises:
+        ApplicationError: (non-retryable, type OperationVoided) if the
+            idempotency_key was voided
         Exception: If the API request fails
     """
-    activity.logger.info(f"Depositing ${input.amount:.2f} to {input.account_id}...")
-    
+    body = {"amount": input.amount}
+    if input.idempotency_key:
+        body["idempotency_key"] = input.idempotency_key
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/accounts/{input.account_id}/deposit",
-            json={"amount": input.amount},
-        )
+        with http_client_span("POST", "/accounts/<account_number>/deposit") as headers:
+            response = requests.post(
+                f"{API_BASE_URL}/accounts/{input.account_id}/deposit",
+                json=body,
+                headers=headers,
+            )
+        raise_if_voided(response, input.idempotency_key)
         response.raise_for_status()
         result = response.json()
         
-        activity.logger.info(f"✓ Deposit successful")
-        activity.logger.info(f"  Previous balance: ${result['previous_balance']:.2f}")
-        activity.logger.info(f"  New balance: ${result['new_balance']:.2f}")
+        log_success(activity.logger, "deposit.succeeded",
+                    account_id=input.account_id, amount=input.amount,
+                    previous_balance=result['previous_balance'],
+                    new_balance=result['new_balance'])
         
         return TransactionResult(
             account_id=input.account_id,
@@ -153,7 +326,248 @@ async def deposit(input: DepositInput) -> TransactionResult:
             amount=input.amount
         )
     except requests.exceptions.RequestException as e:
-        activity.logger.error(f"✗ Error depositing to {input.account_id}: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            activity.logger.error(f"  Response: {e.response.text}")
+        log_error(activity.logger, "deposit.failed",
+                  account_id=input.account_id, amount=input.amount, error=e,
+                  response=e.response.text if e.response is not None else None)
         raise
+
+
+@activity.defn
+async def transfer(input: TransferInput) -> TransferResult:
+    """
+    Move money between two accounts in a single atomic Account API call.
+    
+    Args:
+        input: TransferInput containing from_account, to_account, amount and an
+            optional idempotency_key
+        
+    Returns:
+        TransferResult with previous and new balances of both accounts
+        
+    Raises:
+        ApplicationError: (non-retryable, type AtomicTransferUnavailable) if the
+            Account API doesn't support atomic transfers
+        ApplicationError: (non-retryable, type OperationVoided) if the
+            idempotency_key was voided
+        Exception: If the API request fails or insufficient funds
+    """
+    body = {
+        "from_account": input.from_account,
+        "to_account": input.to_account,
+        "amount": input.amount,
+    }
+    if input.idempotency_key:
+        body["idempotency_key"] = input.idempotency_key
+    try:
+        with http_client_span("POST", "/transfers") as headers:
+            response = requests.post(
+                f"{API_BASE_URL}/transfers",
+                json=body,
+                headers=headers,
+            )
+        # Older Account APIs don't have the endpoint - the route-level 404 has
+        # no JSON error body (unlike "Account not found")
+        if response.status_code in (404, 405) and "json" not in response.headers.get("Content-Type", ""):
+            raise ApplicationError(
+                "Account API does not support atomic transfers",
+                type=ATOMIC_TRANSFER_UNAVAILABLE,
+                non_retryable=True,
+            )
+        raise_if_voided(response, input.idempotency_key)
+        response.raise_for_status()
+        result = response.json()
+        
+        log_success(activity.logger, "transfer.succeeded",
+                    from_account=input.from_account, to_account=input.to_account,
+                    amount=input.amount,
+                    from_account_new_balance=result['from_account_new_balance'],
+                    to_account_new_balance=result['to_account_new_balance'])
+        
+        return TransferResult(
+            from_account=input.from_account,
+            to_account=input.to_account,
+            amount=input.amount,
+            from_account_previous_balance=result['from_account_previous_balance'],
+            to_account_previous_balance=result['to_account_previous_balance'],
+            from_account_new_balance=result['from_account_new_balance'],
+            to_account_new_balance=result['to_account_new_balance'],
+        )
+    except requests.exceptions.RequestException as e:
+        log_error(activity.logger, "transfer.failed",
+                  from_account=input.from_account, to_account=input.to_account,
+                  amount=input.amount, error=e,
+                  response=e.response.text if e.response is not None else None)
+        raise
+
+
+@activity.defn
+async def apply_account_operation(input: AccountOperationInput) -> AccountOperationResult:
+    """
+    Debit or credit an account through its AccountWorkflow.
+    
+    Starts the account's workflow if it isn't running yet (update-with-start).
+    Every send uses a new update ID: the server keeps an update's outcome by
+    ID, so a retry with the same ID would get a failed outcome back forever.
+    AccountWorkflow deduplicates by operation_id instead. Heartbeats while it
+    waits, so schedule it with a heartbeat_timeout.
+    
+    Args:
+        input: AccountOperationInput containing account_id, kind, amount and operation_id
+        
+    Returns:
+        AccountOperationResult with the account's running balance after the operation
+        
+    Raises:
+        ApplicationError: (non-retryable, type InsufficientFunds) if the debit
+            is larger than the account's balance
+        ApplicationError: (non-retryable, type OperationVoided) if the
+            operation was voided with void_account_operation
+    """
+    # Imported here because workflow.py imports this module
+    from workflow import AccountWorkflow, AccountWorkflowInput, account_workflow_id
+    
+    heartbeats = asyncio.create_task(heartbeat_periodically(ACCOUNT_OPERATION_HEARTBEAT_SECONDS))
+    sends = 0
+    try:
+        while True:
+            sends += 1
+            try:
+                result = await activity.client().execute_update_with_start_workflow(
+                    AccountWorkflow.apply_operation,
+                    AccountOperation(kind=input.kind, amount=input.amount, operation_id=input.operation_id),
+                    id=f"{input.operation_id}-{activity.info().attempt}-{sends}",
+                    start_workflow_operation=WithStartWorkflowOperation(
+                        AccountWorkflow.run,
+                        AccountWorkflowInput(account_id=input.account_id),
+                        id=account_workflow_id(input.account_id),
+                        # This activity may run on the lane's activity task queue
+                        task_queue=workflow_task_queue(activity.info().task_queue),
+                        id_conflict_policy=WorkflowIDConflictPolicy.USE_EXISTING,
+                    ),
+                )
+                break
+            except WorkflowUpdateFailedError as e:
+                if isinstance(e.cause, ApplicationError) and e.cause.type == ACCOUNT_WORKFLOW_DRAINING:
+                    # The next run of the account's workflow takes it
+                    await asyncio.sleep(ACCOUNT_WORKFLOW_DRAINING_RETRY_SECONDS)
+                    continue
+                log_error(activity.logger, "account_operation.failed",
+                          account_id=input.account_id, kind=input.kind, amount=input.amount,
+                          error=e.cause)
+                if isinstance(e.cause, ApplicationError) and e.cause.type in (INSUFFICIENT_FUNDS, OPERATION_VOIDED):
+                    raise ApplicationError(str(e.cause), type=e.cause.type, non_retryable=True)
+                raise
+    finally:
+        heartbeats.cancel()
+    
+    log_success(activity.logger, "account_operation.succeeded",
+                account_id=input.account_id, kind=input.kind, amount=input.amount,
+                balance=result.balance)
+    return result
+
+
+@activity.defn
+async def void_operation(input: VoidOperationInput) -> VoidOperationResult:
+    """
+    Make sure the Account API never applies the operation sent with an idempotency key.
+    
+    Run before compensating a step whose attempts failed: the last attempt
+    may only have timed out, and its request can still arrive. Once voided it
+    is rejected, so compensating can't leave the money in both places.
+    
+    Args:
+        input: VoidOperationInput containing the idempotency_key
+        
+    Returns:
+        VoidOperationResult saying whether the operation was applied before
+        it was voided - then it stays applied and shouldn't be compensated
+        
+    Raises:
+        Exception: If the API request fails
+    """
+    try:
+        with http_client_span("POST", "/operations/<idempotency_key>/void") as headers:
+            response = requests.post(
+                f"{API_BASE_URL}/operations/{input.idempotency_key}/void",
+                headers=headers,
+            )
+        response.raise_for_status()
+        applied = response.json()['applied']
+        
+        log_success(activity.logger, "void_operation.succeeded",
+                    idempotency_key=input.idempotency_key, applied=applied)
+        
+        return VoidOperationResult(applied=applied)
+    except requests.exceptions.RequestException as e:
+        log_error(activity.logger, "void_operation.failed",
+                  idempotency_key=input.idempotency_key, error=e)
+        raise
+
+
+@activity.defn
+async def void_account_operation(input: VoidAccountOperationInput) -> VoidOperationResult:
+    """
+    Make sure an account's AccountWorkflow never applies an operation.
+    
+    The AccountWorkflow counterpart of void_operation: drops the operation if
+    it's still queued, waits for it if it's in flight, and rejects it if it's
+    sent later.
+    
+    Args:
+        input: VoidAccountOperationInput containing account_id and operation_id
+        
+    Returns:
+        VoidOperationResult saying whether the operation was applied before
+        it was voided
+    """
+    # Imported here because workflow.py imports this module
+    from workflow import AccountWorkflow, AccountWorkflowInput, account_workflow_id
+    
+    heartbeats = asyncio.create_task(heartbeat_periodically(ACCOUNT_OPERATION_HEARTBEAT_SECONDS))
+    try:
+        applied = await activity.client().execute_update_with_start_workflow(
+            AccountWorkflow.void_operation,
+            input.operation_id,
+            id=f"{input.operation_id}-void-{activity.info().attempt}",
+            start_workflow_operation=WithStartWorkflowOperation(
+                AccountWorkflow.run,
+                AccountWorkflowInput(account_id=input.account_id),
+                id=account_workflow_id(input.account_id),
+                task_queue=workflow_task_queue(activity.info().task_queue),
+                id_conflict_policy=WorkflowIDConflictPolicy.USE_EXISTING,
+            ),
+        )
+    finally:
+        heartbeats.cancel()
+    
+    log_success(activity.logger, "void_account_operation.succeeded",
+                account_id=input.account_id, operation_id=input.operation_id, applied=applied)
+    return VoidOperationResult(applied=applied)
+
+
+@activity.defn
+async def load_batch_transfers(input: LoadBatchTransfersInput) -> list[MoneyTransferInput]:
+    """
+    Load one run's slice of a batch from the batch store (see batch_store.py).
+    
+    Args:
+        input: LoadBatchTransfersInput containing batch_id, offset and limit
+        
+    Returns:
+        Up to `limit` transfers starting at `offset`
+        
+    Raises:
+        ApplicationError: (non-retryable, type BatchNotFound) if the batch
+            isn't stored, e.g. BATCH_STORE_DIR isn't shared with the API
+    """
+    try:
+        # File I/O off the event loop, other activities keep running
+        transfers = await asyncio.to_thread(read_batch, input.batch_id, input.offset, input.limit)
+    except FileNotFoundError as e:
+        log_error(activity.logger, "load_batch_transfers.failed",
+                  batch_id=input.batch_id, offset=input.offset, error=e)
+        raise ApplicationError(f"Batch {input.batch_id} not found", type=BATCH_NOT_FOUND, non_retryable=True)
+    
+    log_success(activity.logger, "load_batch_transfers.succeeded",
+                batch_id=input.batch_id, offset=input.offset, transfers=len(transfers))
+    return transfers
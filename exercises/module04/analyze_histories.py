@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Break down what workflow histories cost, and check them against budgets.
+
+Reads histories saved with `replay_histories.py export` and reports, per step
+(activity type, child workflow, update, timer, workflow task, ...), the
+average number of history events and bytes per workflow. It also flags:
+- redundant activities: the same activity scheduled with the same input more
+  than once in one workflow (e.g. re-reading a balance that's already known)
+- oversized payloads
+- search attribute upserts beyond the budget
+- workflows over the event or byte budget
+
+Exit code is 1 if any workflow is over a budget.
+
+Usage:
+    python analyze_histories.py --dir histories [--workflow-type MoneyTransferWorkflow]
+        [--max-events 40] [--max-bytes 16384] [--max-payload-bytes 2048] [--max-upserts 1]
+"""
+
+import argparse
+import sys
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from temporalio.api.common.v1 import Payload
+
+from replay_histories import load_histories
+
+# Default budgets per workflow execution
+DEFAULT_MAX_EVENTS = 40
+DEFAULT_MAX_BYTES = 16 * 1024
+DEFAULT_MAX_PAYLOAD_BYTES = 2 * 1024
+DEFAULT_MAX_UPSERTS = 1
+
+# Events that belong to the activity scheduled in `scheduled_event_id`
+ACTIVITY_FOLLOW_UP_ATTRIBUTES = (
+    "activity_task_started_event_attributes",
+    "activity_task_completed_event_attributes",
+    "activity_task_failed_event_attributes",
+    "activity_task_timed_out_event_attributes",
+    "activity_task_cancel_requested_event_attributes",
+    "activity_task_canceled_event_attributes",
+)
+
+
+def iter_payloads(message):
+    """Yield every Payload nested anywhere in a protobuf message."""
+    if isinstance(message, Payload):
+        yield message
+        return
+    for descriptor, value in message.ListFields():
+        if descriptor.message_type is None:
+            continue
+        if descriptor.message_type.GetOptions().map_entry:
+            values = value.values()
+        elif hasattr(value, "ListFields"):
+            values = [value]
+        else:
+            # Repeated message field
+            values = value
+        for item in values:
+            if hasattr(item, "ListFields"):
+                yield from iter_payloads(item)
+
+
+def event_step(attributes_name, attributes, activity_types):
+    """Name of the step an event belongs to."""
+    if attributes_name == "activity_task_scheduled_event_attributes":
+        return f"activity:{attributes.activity_type.name}"
+    if attributes_name in ACTIVITY_FOLLOW_UP_ATTRIBUTES:
+        return f"activity:{activity_types.get(attributes.scheduled_event_id, '?')}"
+    if attributes_name.startswith("workflow_task_"):
+        return "workflow_task"
+    if attributes_name.startswith(("start_child_workflow", "child_workflow")):
+        return f"child:{attributes.workflow_type.name}"
+    if attributes_name.startswith("workflow_execution_update_"):
+        return "update"
+    if attributes_name.startswith(("timer_", "workflow_execution_signaled")):
+        return attributes_name.split("_event_attributes")[0]
+    if attributes_name == "upsert_workflow_search_attributes_event_attributes":
+        return "search_attributes"
+    return "workflow"
+
+
+def analyze(history, budgets):
+    """
+    Break one history down by step and collect problems.
+
+    Returns:
+        (steps, problems, over_budget) - steps maps step name to
+        [events, bytes, payload bytes]
+    """
+    steps = defaultdict(lambda: [0, 0, 0])
+    problems = []
+    activity_types = {}
+    activity_inputs = Counter()
+    upserts = 0
+    total_bytes = 0
+
+    for event in history.events:
+        attributes_name = event.WhichOneof("attributes")
+        attributes = getattr(event, attributes_name)
+        step = event_step(attributes_name, attributes, activity_types)
+
+        size = event.ByteSize()
+        payload_bytes = 0
+        for payload in iter_payloads(attributes):
+            payload_size = payload.ByteSize()
+            payload_bytes += payload_size
+            if payload_size > budgets.max_payload_bytes:
+                problems.append(f"oversized payload in {step} (> {budgets.max_payload_bytes} bytes)")
+        steps[step][0] += 1
+        steps[step][1] += size
+        steps[step][2] += payload_bytes
+        total_bytes += size
+
+        if attributes_name == "activity_task_scheduled_event_attributes":
+            activity_types[event.event_id] = attributes.activity_type.name
+            activity_inputs[(attributes.activity_type.name, attributes.input.SerializeToString())] += 1
+        elif attributes_name == "upsert_workflow_search_attributes_event_attributes":
+            upserts += 1
+
+    # One finding per kind per workflow, so the summary counts workflows
+    problems = list(dict.fromkeys(problems))
+    for (activity_type, _), count in activity_inputs.items():
+        if count > 1:
+            problems.append(f"redundant activity: {activity_type} scheduled {count} times with the same input")
+    if upserts > budgets.max_upserts:
+        problems.append(f"search attribute upserts: {upserts} (budget {budgets.max_upserts})")
+
+    over_budget = []
+    if len(history.events) > budgets.max_events:
+        over_budget.append(f"{len(history.events)} events (budget {budgets.max_events})")
+    if total_bytes > budgets.max_bytes:
+        over_budget.append(f"{total_bytes} bytes (budget {budgets.max_bytes})")
+    return steps, problems, over_budget
+
+
+def workflow_type(history):
+    """Workflow type from the history's first (started) event."""
+    return history.events[0].workflow_execution_started_event_attributes.workflow_type.name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", type=Path, default=Path("histories"), help="Directory of history files")
+    parser.add_argument("--workflow-type", help="Only analyze workflows of this type")
+    parser.add_argument("--max-events", type=int, default=DEFAULT_MAX_EVENTS, help="Event budget per workflow")
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES, help="Byte budget per workflow")
+    parser.add_argument("--max-payload-bytes", type=int, default=DEFAULT_MAX_PAYLOAD_BYTES,
+                        help="Largest allowed single payload")
+    parser.add_argument("--max-upserts", type=int, default=DEFAULT_MAX_UPSERTS,
+                        help="Search attribute upserts allowed per workflow")
+    budgets = parser.parse_args()
+
+    histories = [
+        history for history in load_histories(budgets.dir)
+        if history.events and (not budgets.workflow_type or workflow_type(history) == budgets.workflow_type)
+    ]
+    if not histories:
+        print("No histories to analyze")
+        return
+
+    totals = defaultdict(lambda: [0, 0, 0])
+    problem_counts = Counter()
+    over_budget = {}
+    for history in histories:
+        steps, problems, exceeded = analyze(history, budgets)
+        for step, (events, size, payload_bytes) in steps.items():
+            totals[step][0] += events
+            totals[step][1] += size
+            totals[step][2] += payload_bytes
+        problem_counts.update(problems)
+        if exceeded:
+            over_budget[history.workflow_id] = exceeded
+
+    count = len(histories)
+    print(f"Analyzed {count} workflows")
+    print(f"  {'step':<40} {'events/wf':>10} {'bytes/wf':>10} {'payload bytes/wf':>17}")
+    for step, (events, size, payload_bytes) in sorted(totals.items(), key=lambda s: s[1][1], reverse=True):
+        print(f"  {step:<40} {events / count:>10.1f} {size / count:>10.0f} {payload_bytes / count:>17.0f}")
+    all_events = sum(t[0] for t in totals.values())
+    all_bytes = sum(t[1] for t in totals.values())
+    print(f"  {'total':<40} {all_events / count:>10.1f} {all_bytes / count:>10.0f}")
+
+    if problem_counts:
+        print("\nFindings (number of workflows):")
+        for problem, occurrences in problem_counts.most_common():
+            print(f"  {occurrences:>5}  {problem}")
+
+    if over_budget:
+        print(f"\n❌ {len(over_budget)} workflows over budget:")
+        for workflow_id, exceeded in list(over_budget.items())[:20]:
+            print(f"  {workflow_id}: {', '.join(exceeded)}")
+        sys.exit(1)
+    print("\n✅ All workflows within budget")
+
+
+if __name__ == "__main__":
+    main()
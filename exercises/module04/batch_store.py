@@ -0,0 +1,65 @@
+"""
+Storage for the transfers of a batch, outside of workflow payloads.
+
+A 100k-transfer batch is 5-10 MB of payload, well over Temporal's 2 MB payload
+limit, so BatchTransferWorkflow can't take the transfers as its input. The
+Money Transfer API writes them here instead and starts the workflow with just
+the batch ID. Each run of the workflow then loads only its own slice with the
+load_batch_transfers activity.
+
+Batches are JSON-lines files in BATCH_STORE_DIR, one transfer per line, named
+after the batch ID. Files are kept after the batch completes, as its record.
+"""
+
+import itertools
+import json
+import os
+from dataclasses import asdict
+from pathlib import Path
+
+from config import BATCH_STORE_DIR
+from shared import MoneyTransferInput
+
+
+def batch_path(batch_id):
+    return Path(BATCH_STORE_DIR) / f"{batch_id}.jsonl"
+
+
+def write_batch(batch_id, transfers):
+    """
+    Store the transfers of a batch.
+
+    Args:
+        batch_id: ID of the batch (and of its BatchTransferWorkflow)
+        transfers: List of MoneyTransferInput
+    """
+    path = batch_path(batch_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename, so a reader never sees a half-written batch
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        for transfer in transfers:
+            f.write(json.dumps(asdict(transfer), separators=(",", ":")) + "\n")
+    os.replace(tmp_path, path)
+
+
+def read_batch(batch_id, offset, limit):
+    """
+    Load a slice of a stored batch.
+
+    Args:
+        batch_id: ID of the batch
+        offset: Index of the first transfer to load
+        limit: Maximum number of transfers to load
+
+    Returns:
+        List of MoneyTransferInput (shorter than `limit` at the end of the batch)
+
+    Raises:
+        FileNotFoundError: If the batch isn't stored
+    """
+    with open(batch_path(batch_id)) as f:
+        return [
+            MoneyTransferInput(**json.loads(line))
+            for line in itertools.islice(f, offset, offset + limit)
+        ]
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark the payload converters used for workflow/activity payloads.
+
+Builds every payload a single money transfer writes to its history (workflow
+input/result, activity inputs/results, a get_state query result) and reports,
+for each converter configuration:
+- bytes per transfer history
+- encode and decode time per transfer history
+
+Also reports a large batch-style payload to show the effect of compression.
+
+Usage:
+    python benchmark_payloads.py [--iterations 2000]
+"""
+
+import argparse
+import asyncio
+import time
+
+from activities import (
+    BalanceResult,
+    CheckBalanceInput,
+    DepositInput,
+    TransactionResult,
+    WithdrawInput,
+)
+from data_converter import build_data_converter
+from workflow import (
+    WORKFLOW_STEPS,
+    MoneyTransferInput,
+    MoneyTransferResult,
+)
+
+CONFIGURATIONS = [
+    ("json (SDK default)", "json", 0),
+    ("json + zlib > 256B", "json", 256),
+    ("compact", "compact", 0),
+    ("compact + zlib > 256B", "compact", 256),
+]
+
+
+def transfer_history_values():
+    """(value, type hint) pairs for every payload in one transfer history."""
+    transfer = MoneyTransferInput(from_account="account_A", to_account="account_B", amount=100.0)
+    state = {
+        "input": {"from_account": "account_A", "to_account": "account_B", "amount": 100.0},
+        "status": "COMPLETED",
+        "result": None,
+        "from_account_starting_balance": 1000.0,
+        "to_account_starting_balance": 500.0,
+        "steps": WORKFLOW_STEPS,
+        "current_step": "deposit",
+        "completed_steps": WORKFLOW_STEPS,
+    }
+    return [
+        (transfer, MoneyTransferInput),
+        (CheckBalanceInput(account_id="account_A"), CheckBalanceInput),
+        (BalanceResult(account_id="account_A", balance=1000.0), BalanceResult),
+        (CheckBalanceInput(account_id="account_B"), CheckBalanceInput),
+        (BalanceResult(account_id="account_B", balance=500.0), BalanceResult),
+        (WithdrawInput(account_id="account_A", amount=100.0), WithdrawInput),
+        (TransactionResult("account_A", previous_balance=1000.0, new_balance=900.0, amount=100.0), TransactionResult),
+        (DepositInput(account_id="account_B", amount=100.0), DepositInput),
+        (TransactionResult("account_B", previous_balance=500.0, new_balance=600.0, amount=100.0), TransactionResult),
+        (MoneyTransferResult(True, "account_A", "account_B", 100.0, 1000.0, 500.0), MoneyTransferResult),
+        (state, dict),
+    ]
+
+
+def batch_values(size=1000):
+    """A single large payload: one BatchTransferWorkflow run's transfers (load_batch_transfers result)."""
+    return [(
+        [
+            MoneyTransferInput(f"account_{'ABCDE'[i % 5]}", f"account_{'FGHIJ'[i % 5]}", 100.0)
+            for i in range(size)
+        ],
+        list[MoneyTransferInput],
+    )]
+
+
+async def measure(converter, values, iterations):
+    """Return (total bytes, encode seconds, decode seconds) for one pass over values."""
+    payloads = [await converter.encode([value]) for value, _ in values]
+    size = sum(p.ByteSize() for encoded in payloads for p in encoded)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for value, _ in values:
+            await converter.encode([value])
+    encode_time = (time.perf_counter() - start) / iterations
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for encoded, (_, hint) in zip(payloads, values):
+            await converter.decode(encoded, [hint])
+    decode_time = (time.perf_counter() - start) / iterations
+
+    return size, encode_time, decode_time
+
+
+async def run(iterations):
+    for title, values, n in [
+        ("Single transfer history", transfer_history_values(), iterations),
+        ("Batch run's transfers (1000)", batch_values(), max(1, iterations // 100)),
+    ]:
+        print(f"\n{title}")
+        print(f"  {'converter':<24} {'bytes':>9} {'encode (us)':>12} {'decode (us)':>12}")
+        baseline = None
+        for name, converter_name, threshold in CONFIGURATIONS:
+            converter = build_data_converter(converter_name, threshold)
+            size, encode_time, decode_time = await measure(converter, values, n)
+            baseline = baseline or size
+            print(
+                f"  {name:<24} {size:>9} {encode_time * 1e6:>12.1f} {decode_time * 1e6:>12.1f}"
+                f"   ({size / baseline:.0%} of default)"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000, help="Encode/decode passes per measurement")
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Money Transfer API's workflow list (GET /api/workflows).
+
+Runs `list_workflow_states_async` against a fake Temporal client, so no server
+is needed. Each fake RPC (listing page, describe, query) waits a fixed
+latency. Reports page latency per workflow count and concurrency, with
+concurrency 1 being the old one-workflow-at-a-time behaviour.
+
+The fake server answers every call in the same time however many are in
+flight. The numbers show the round-trip bound, not a loaded server's
+limits. Raise WORKFLOW_LIST_CONCURRENCY only as far as your server keeps up.
+
+Usage:
+    python benchmark_workflow_list.py [--workflows 1000 10000] [--concurrency 1 50] [--rpc-latency-ms 2]
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import money_transfer_api
+from config import WORKFLOW_LIST_CONCURRENCY
+from workflow import WORKFLOW_STEPS
+
+# Workflows per listing page (the SDK's default page size)
+PAGE_SIZE = 1000
+
+
+class FakeHandle:
+    def __init__(self, client, workflow_id):
+        self.client = client
+        self.id = workflow_id
+
+    async def describe(self):
+        await asyncio.sleep(self.client.rpc_latency)
+        return SimpleNamespace(
+            run_id=f"{self.id}-run",
+            status=SimpleNamespace(name="COMPLETED"),
+            start_time=self.client.start_time,
+            close_time=self.client.start_time,
+        )
+
+    async def query(self, query, *args):
+        await asyncio.sleep(self.client.rpc_latency)
+        if args:
+            # get_state_since(version) of a cached state
+            return {"unchanged": True}
+        return {
+            "version": 1,
+            "input": {"from_account": "account_A", "to_account": "account_B", "amount": 100.0},
+            "result": None,
+            "steps": WORKFLOW_STEPS,
+            "current_step": None,
+            "completed_steps": WORKFLOW_STEPS,
+        }
+
+
+class FakeClient:
+    """Just enough of temporalio.client.Client for list_workflow_states_async."""
+
+    def __init__(self, workflows, rpc_latency):
+        self.workflows = workflows
+        self.rpc_latency = rpc_latency
+        self.start_time = datetime.now(timezone.utc)
+
+    async def list_workflows(self, query):
+        for i in range(self.workflows):
+            if i % PAGE_SIZE == 0:
+                await asyncio.sleep(self.rpc_latency)
+            yield SimpleNamespace(id=f"transfer-{i}")
+
+    def get_workflow_handle(self, workflow_id, result_type=None):
+        return FakeHandle(self, workflow_id)
+
+
+async def measure(workflows, concurrency, rpc_latency):
+    """Seconds to build the workflow list, with a cold state cache."""
+    client = FakeClient(workflows, rpc_latency)
+    money_transfer_api.temporal_client = client
+    money_transfer_api.workflow_state_cache.clear()
+    start = time.perf_counter()
+    states = await money_transfer_api.list_workflow_states_async(
+        client, 'WorkflowType="MoneyTransferWorkflowMod04"', concurrency=concurrency
+    )
+    elapsed = time.perf_counter() - start
+    assert len(states) == workflows, f"got {len(states)} of {workflows} workflows"
+    return elapsed
+
+
+async def run(workflow_counts, concurrencies, rpc_latency):
+    print(f"Fake RPC latency: {rpc_latency * 1000:g} ms")
+    print(f"{'workflows':>10} {'concurrency':>12} {'page latency':>14} {'speedup':>9}")
+    for workflows in workflow_counts:
+        baseline = None
+        for concurrency in concurrencies:
+            elapsed = await measure(workflows, concurrency, rpc_latency)
+            baseline = baseline or elapsed
+            print(f"{workflows:>10} {concurrency:>12} {elapsed * 1000:>11.0f} ms {baseline / elapsed:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workflows", type=int, nargs="+", default=[1000, 10000], help="Workflow counts to list")
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, WORKFLOW_LIST_CONCURRENCY],
+        help="Concurrent state fetches to compare (1 = sequential)",
+    )
+    parser.add_argument("--rpc-latency-ms", type=float, default=2.0, help="Latency of every fake Temporal call")
+    args = parser.parse_args()
+    asyncio.run(run(args.workflows, args.concurrency, args.rpc_latency_ms / 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Runtime configuration for the Module 4 services.
+
+Every setting can be overridden with an environment variable, so the same code
+runs unchanged on a laptop during the workshop and on a bigger box under load.
+"""
+
+import os
+
+# Logging level for the worker and the services (DEBUG, INFO, WARNING, ...)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# Only log 1 out of every N success events (1 = log every success).
+# Errors and warnings are never sampled.
+LOG_SUCCESS_SAMPLE_EVERY = max(1, int(os.environ.get("LOG_SUCCESS_SAMPLE_EVERY", "1")))
+
+# Payload converter for workflow/activity inputs and results: "json" is the
+# Temporal SDK default (readable in the Temporal UI and CLI), "compact" encodes
+# dataclasses as positional JSON arrays. Clients and workers must use the same
+# setting, and compact payloads only decode with a type hint.
+PAYLOAD_CONVERTER = os.environ.get("PAYLOAD_CONVERTER", "json")
+
+# Compress payloads larger than this many bytes (0 = compression disabled)
+PAYLOAD_COMPRESSION_THRESHOLD = int(os.environ.get("PAYLOAD_COMPRESSION_THRESHOLD", "0"))
+
+# Log a summary of the worker's latency histograms every N seconds (0 = never)
+METRICS_DUMP_INTERVAL = float(os.environ.get("METRICS_DUMP_INTERVAL", "60"))
+
+# Port of the worker's Prometheus /metrics endpoint (0 = disabled)
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "9464"))
+
+# Let the Temporal runtime serve its own metrics for Prometheus at this address
+# (e.g. "0.0.0.0:9465") instead of folding them into our histograms. One
+# process per address, so not for launch_workers.py.
+TEMPORAL_PROMETHEUS_ADDRESS = os.environ.get("TEMPORAL_PROMETHEUS_ADDRESS", "")
+
+# Task queues of the priority lanes. Interactive transfers keep the original
+# queue; batch transfers get their own so they can't starve interactive ones.
+TASK_QUEUE = os.environ.get("TASK_QUEUE", "money-transfer-task-queue")
+BATCH_TASK_QUEUE = os.environ.get("BATCH_TASK_QUEUE", f"{TASK_QUEUE}-batch")
+
+# Task queue for the Account API calls of AccountWorkflows. A transfer in
+# account_workflows mode holds an activity slot on its lane while it waits for
+# an AccountWorkflow, so the calls that let it finish need slots of their own.
+ACCOUNT_ACTIVITY_TASK_QUEUE = os.environ.get("ACCOUNT_ACTIVITY_TASK_QUEUE", f"{TASK_QUEUE}-accounts")
+
+# Directory holding the transfers of every batch (see batch_store.py). The
+# Money Transfer API writes it and the workers read it, so they must share it.
+BATCH_STORE_DIR = os.environ.get("BATCH_STORE_DIR", os.path.join(os.path.dirname(__file__), "batches"))
+
+# Schedule each lane's activities on their own task queue ("<lane queue>-activities")
+# instead of the workflow's, so activity and workflow workers can be scaled
+# separately. Workflow workers decide where activities go; activity workers
+# must use the same setting.
+SEPARATE_ACTIVITY_TASK_QUEUES = os.environ.get("SEPARATE_ACTIVITY_TASK_QUEUES", "false").lower() in ("1", "true", "yes")
+
+# What a worker process runs: "workflows", "activities" or "both"
+WORKER_ROLE = os.environ.get("WORKER_ROLE", "both")
+
+# Slots per worker process, split between the lanes
+WORKER_MAX_CONCURRENT_ACTIVITIES = int(os.environ.get("WORKER_MAX_CONCURRENT_ACTIVITIES", "100"))
+WORKER_MAX_CONCURRENT_WORKFLOW_TASKS = int(os.environ.get("WORKER_MAX_CONCURRENT_WORKFLOW_TASKS", "100"))
+
+# Activity slots per worker process for ACCOUNT_ACTIVITY_TASK_QUEUE
+WORKER_ACCOUNT_ACTIVITY_SLOTS = int(os.environ.get("WORKER_ACCOUNT_ACTIVITY_SLOTS", "20"))
+
+# Share of the slots and cache each lane's worker gets. Every lane has its own
+# pool, so an idle lane's slots sit unused; the shares may add up to more than
+# 1 to let the batch lane use the whole process while interactive slots stay
+# reserved. By default the batch lane gets what the interactive lane doesn't.
+LANE_INTERACTIVE_SLOT_SHARE = float(os.environ.get("LANE_INTERACTIVE_SLOT_SHARE", "0.3"))
+LANE_BATCH_SLOT_SHARE = float(os.environ.get("LANE_BATCH_SLOT_SHARE", str(1 - LANE_INTERACTIVE_SLOT_SHARE)))
+
+# Concurrent pollers per task queue (0 = let the SDK scale them with the backlog)
+WORKER_WORKFLOW_TASK_POLLERS = int(os.environ.get("WORKER_WORKFLOW_TASK_POLLERS", "5"))
+WORKER_ACTIVITY_TASK_POLLERS = int(os.environ.get("WORKER_ACTIVITY_TASK_POLLERS", "5"))
+
+# Workflows kept in the sticky cache per worker process, split between the lanes
+WORKER_MAX_CACHED_WORKFLOWS = int(os.environ.get("WORKER_MAX_CACHED_WORKFLOWS", "1000"))
+
+# How slots are sized: "fixed" uses the maximums above, "resource-based" lets
+# the SDK add slots while the box stays under the CPU/memory targets
+WORKER_TUNER = os.environ.get("WORKER_TUNER", "fixed")
+
+# Targets for the resource-based tuner, as a fraction of the whole machine
+WORKER_TARGET_CPU_USAGE = float(os.environ.get("WORKER_TARGET_CPU_USAGE", "0.8"))
+WORKER_TARGET_MEMORY_USAGE = float(os.environ.get("WORKER_TARGET_MEMORY_USAGE", "0.8"))
+
+# Slots the resource-based tuner always keeps per worker process. The maximums
+# are WORKER_MAX_CONCURRENT_ACTIVITIES and WORKER_MAX_CONCURRENT_WORKFLOW_TASKS.
+WORKER_MIN_ACTIVITY_SLOTS = int(os.environ.get("WORKER_MIN_ACTIVITY_SLOTS", "4"))
+WORKER_MIN_WORKFLOW_TASK_SLOTS = int(os.environ.get("WORKER_MIN_WORKFLOW_TASK_SLOTS", "4"))
+
+# Seconds a stopping worker lets in-flight activities finish before cancelling them
+WORKER_SHUTDOWN_GRACE_SECONDS = float(os.environ.get("WORKER_SHUTDOWN_GRACE_SECONDS", "30"))
+
+# Worker processes started by launch_workers.py (0 = one per CPU core)
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "0"))
+
+# File the worker writes its metrics snapshot to, so launch_workers.py can
+# aggregate the metrics of every process (empty = don't write)
+WORKER_METRICS_FILE = os.environ.get("WORKER_METRICS_FILE", "")
+
+# OpenTelemetry tracing (needs the "tracing" extra): "" = off, "console",
+# "file" (JSON lines in TRACING_FILE) or "otlp" (to TRACING_OTLP_ENDPOINT)
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "")
+TRACING_FILE = os.environ.get("TRACING_FILE", "traces.jsonl")
+TRACING_OTLP_ENDPOINT = os.environ.get("TRACING_OTLP_ENDPOINT", "")
+
+# Fraction of traces to keep (the decision is made once per trace, at its root)
+TRACING_SAMPLE_RATIO = float(os.environ.get("TRACING_SAMPLE_RATIO", "1.0"))
+
+# Money Transfer API workflow lists: states fetched at once, and seconds
+# allowed per workflow (one that takes longer is left out of the list)
+WORKFLOW_LIST_CONCURRENCY = int(os.environ.get("WORKFLOW_LIST_CONCURRENCY", "50"))
+WORKFLOW_STATE_TIMEOUT_SECONDS = float(os.environ.get("WORKFLOW_STATE_TIMEOUT_SECONDS", "5"))
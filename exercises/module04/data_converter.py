@@ -0,0 +1,182 @@
+"""
+Compact payload converter and compression codec.
+
+The default Temporal converter stores every dataclass as a JSON object, so each
+history event repeats every field name (`from_account_starting_balance`, ...).
+The compact converter encodes dataclasses as JSON arrays keyed by field index
+instead:
+
+    MoneyTransferInput("account_A", "account_B", 100.0)
+    json/plain:             {"amount":100.0,"from_account":"account_A","to_account":"account_B"}
+    json/compact-dataclass: ["account_A","account_B",100.0]
+
+Payloads are decoded by field position using the type hint, so new dataclass
+fields must be appended at the end with a default value - older payloads then
+simply decode with the default.
+
+Lists of dataclasses are encoded the same way, element by element, and decode
+with a `list[...]` type hint. Everything else (dicts from queries, strings,
+empty or mixed lists, ...) falls through to the default converters. The optional CompressionCodec zlib-compresses
+any payload bigger than a threshold.
+
+The benchmark in benchmark_payloads.py reports the size and speed difference.
+"""
+
+import dataclasses
+import functools
+import json
+import types
+import typing
+import zlib
+
+import temporalio.converter
+from temporalio.api.common.v1 import Payload
+from temporalio.converter import (
+    AdvancedJSONEncoder,
+    CompositePayloadConverter,
+    DataConverter,
+    DefaultPayloadConverter,
+    EncodingPayloadConverter,
+    JSONPlainPayloadConverter,
+    PayloadCodec,
+)
+
+from config import PAYLOAD_COMPRESSION_THRESHOLD, PAYLOAD_CONVERTER
+
+COMPACT_ENCODING = "json/compact-dataclass"
+ZLIB_ENCODING = b"binary/zlib"
+
+
+def _is_dataclass_instance(value):
+    return dataclasses.is_dataclass(value) and not isinstance(value, type)
+
+
+def _init_fields(cls):
+    return [f for f in dataclasses.fields(cls) if f.init]
+
+
+@functools.lru_cache(maxsize=None)
+def _field_hints(cls):
+    """(name, type hint) for each constructor field, in declaration order."""
+    hints = typing.get_type_hints(cls)
+    return [(f.name, hints.get(f.name)) for f in _init_fields(cls)]
+
+
+def _to_compact(value):
+    """Replace dataclasses (at any depth) with a list of their field values."""
+    if _is_dataclass_instance(value):
+        return [_to_compact(getattr(value, f.name)) for f in _init_fields(value)]
+    if isinstance(value, (list, tuple)):
+        return [_to_compact(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _to_compact(v) for k, v in value.items()}
+    return value
+
+
+def _from_compact(hint, value):
+    """Rebuild a value produced by `_to_compact` using its type hint."""
+    if value is None or hint is None or hint is typing.Any:
+        return value
+    if dataclasses.is_dataclass(hint) and isinstance(value, list):
+        return hint(**{
+            name: _from_compact(field_hint, v)
+            for (name, field_hint), v in zip(_field_hints(hint), value)
+        })
+    origin = typing.get_origin(hint)
+    args = typing.get_args(hint)
+    if origin in (typing.Union, types.UnionType):
+        # Optional[X] and friends - use the first non-None type
+        return _from_compact(next(a for a in args if a is not type(None)), value)
+    if origin in (list, tuple, typing.Sequence) and args and isinstance(value, list):
+        return [_from_compact(args[0], v) for v in value]
+    if origin is dict and len(args) == 2 and isinstance(value, dict):
+        return {k: _from_compact(args[1], v) for k, v in value.items()}
+    return temporalio.converter.value_to_type(hint, value)
+
+
+class CompactDataclassPayloadConverter(EncodingPayloadConverter):
+    """
+    Encodes dataclasses, and lists of them, as positional JSON arrays (field
+    index instead of name).
+    """
+
+    @property
+    def encoding(self):
+        return COMPACT_ENCODING
+
+    def to_payload(self, value):
+        if isinstance(value, (list, tuple)):
+            # e.g. the transfers load_batch_transfers returns - the biggest payload there is
+            if not value or not all(_is_dataclass_instance(v) for v in value):
+                return None
+        elif not _is_dataclass_instance(value):
+            return None
+        return Payload(
+            metadata={"encoding": COMPACT_ENCODING.encode()},
+            data=json.dumps(
+                _to_compact(value), cls=AdvancedJSONEncoder, separators=(",", ":")
+            ).encode(),
+        )
+
+    def from_payload(self, payload, type_hint=None):
+        # Without a dataclass type hint the raw list of field values is returned
+        return _from_compact(type_hint, json.loads(payload.data))
+
+
+class CompactPayloadConverter(CompositePayloadConverter):
+    """Default converters with the compact dataclass converter in front of JSON."""
+
+    def __init__(self):
+        converters = [
+            c for c in DefaultPayloadConverter.default_encoding_payload_converters
+            if not isinstance(c, JSONPlainPayloadConverter)
+        ]
+        # JSON plain must stay last because it accepts (almost) anything
+        super().__init__(*converters, CompactDataclassPayloadConverter(), JSONPlainPayloadConverter())
+
+
+class CompressionCodec(PayloadCodec):
+    """zlib-compresses payloads whose serialized size is above `threshold` bytes."""
+
+    def __init__(self, threshold=1024, level=6):
+        self.threshold = threshold
+        self.level = level
+
+    async def encode(self, payloads):
+        encoded = []
+        for payload in payloads:
+            if payload.ByteSize() <= self.threshold:
+                encoded.append(payload)
+                continue
+            encoded.append(Payload(
+                metadata={"encoding": ZLIB_ENCODING},
+                data=zlib.compress(payload.SerializeToString(), self.level),
+            ))
+        return encoded
+
+    async def decode(self, payloads):
+        decoded = []
+        for payload in payloads:
+            if payload.metadata.get("encoding") != ZLIB_ENCODING:
+                decoded.append(payload)
+                continue
+            decoded.append(Payload.FromString(zlib.decompress(payload.data)))
+        return decoded
+
+
+def build_data_converter(converter=PAYLOAD_CONVERTER, compression_threshold=PAYLOAD_COMPRESSION_THRESHOLD):
+    """
+    Build the data converter used by the worker and the clients.
+
+    Args:
+        converter: "compact" for CompactPayloadConverter, "json" for the SDK default
+        compression_threshold: Compress payloads above this many bytes (0 = off)
+    """
+    if converter not in ("compact", "json"):
+        raise ValueError(f"Unknown payload converter: {converter}")
+    return DataConverter(
+        payload_converter_class=(
+            CompactPayloadConverter if converter == "compact" else DefaultPayloadConverter
+        ),
+        payload_codec=CompressionCodec(compression_threshold) if compression_threshold > 0 else None,
+    )
@@ -0,0 +1,64 @@
+"""
+Request metrics and a Prometheus /metrics route for the Flask services.
+
+    app = Flask(__name__)
+    instrument_app(app)
+
+records, per route (the URL rule, e.g. /accounts/<account_number>), method
+and status code:
+- http_requests_total - request count (rate() of it is the request rate)
+- http_request_duration_ms - latency histogram
+- http_request_errors_total - 5xx responses and unhandled exceptions
+
+and serves everything in metrics.REGISTRY - including whatever else the
+service records, like lock wait or storage I/O time - at GET /metrics.
+"""
+
+import time
+
+from flask import Response, g, request
+
+from metrics import PROMETHEUS_CONTENT_TYPE, REGISTRY, render_prometheus
+
+
+def _route():
+    # The URL rule keeps label cardinality bounded (no account numbers or IDs)
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def _record(status, registry):
+    if getattr(g, "_metrics_recorded", True):
+        return
+    g._metrics_recorded = True
+    labels = {"route": _route(), "method": request.method, "status": str(status)}
+    registry.observe("http_request_duration_ms", (time.perf_counter() - g._metrics_start) * 1000, **labels)
+    registry.increment("http_requests_total", **labels)
+    if status >= 500:
+        registry.increment("http_request_errors_total", **labels)
+
+
+def instrument_app(app, registry=REGISTRY):
+    """Record request metrics for every route of `app` and add GET /metrics."""
+
+    @app.before_request
+    def start_request_timer():
+        g._metrics_start = time.perf_counter()
+        g._metrics_recorded = False
+
+    @app.after_request
+    def record_response(response):
+        _record(response.status_code, registry)
+        return response
+
+    @app.teardown_request
+    def record_exception(exc):
+        # Unhandled exceptions skip after_request in debug mode
+        if exc is not None:
+            _record(500, registry)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus metrics."""
+        return Response(render_prometheus(registry.snapshot()), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    return app
@@ -0,0 +1,157 @@
+"""
+Worker health and saturation, for load balancers and autoscalers.
+
+`WorkerHealth.report()` answers "how busy is this worker?" from the metrics
+registry (the Temporal runtime's slot/cache gauges and failure counters, and
+TimingInterceptor's activity counts) and from the workers' own state:
+- status: starting, ready, draining (graceful shutdown) or stopped
+- used/available workflow task and activity slots, and the saturation
+  (used share of the busiest slot type)
+- sticky cache occupancy
+- workflow task and activity failure rates over the last WINDOW_SECONDS
+
+worker.py serves it next to /metrics: GET /health always answers 200 while the
+process is up, GET /ready answers 503 unless the worker is polling.
+Autoscale on `saturation` rather than CPU: a worker can be out of slots (and
+schedule-to-start latency climbing) while its CPU is idle waiting on HTTP calls.
+"""
+
+import asyncio
+import collections
+import time
+
+from metrics import REGISTRY
+
+# Failure rates are computed over this many seconds of samples
+WINDOW_SECONDS = 60.0
+SAMPLE_INTERVAL_SECONDS = 5.0
+
+# Temporal runtime metrics (see RuntimeMetricsCollector)
+SLOTS_USED = "temporal_worker_task_slots_used"
+SLOTS_AVAILABLE = "temporal_worker_task_slots_available"
+STICKY_CACHE_SIZE = "temporal_sticky_cache_size"
+WORKFLOW_TASK_FAILED = "temporal_workflow_task_execution_failed"
+WORKFLOW_TASK_LATENCY = "temporal_workflow_task_execution_latency"
+
+# worker_type label of the slot gauges
+SLOT_TYPES = {"WorkflowWorker": "workflow_task", "ActivityWorker": "activity"}
+
+STATUS_STARTING = "starting"
+STATUS_READY = "ready"
+STATUS_DRAINING = "draining"
+STATUS_STOPPED = "stopped"
+
+
+def _totals(snapshot):
+    """Cumulative task and failure counts from a registry snapshot."""
+    totals = collections.Counter()
+    for counter in snapshot["counters"]:
+        if counter["name"] == WORKFLOW_TASK_FAILED:
+            totals["workflow_task_failed"] += counter["value"]
+        elif counter["name"] == "activity_outcomes_total":
+            totals["activity"] += counter["value"]
+            if counter["labels"].get("outcome") == "failed":
+                totals["activity_failed"] += counter["value"]
+        elif counter["name"] == "activities_started_total":
+            totals["activity_started"] += counter["value"]
+    for histogram in snapshot["histograms"]:
+        if histogram["name"] == WORKFLOW_TASK_LATENCY:
+            totals["workflow_task"] += histogram["count"]
+    return totals
+
+
+class WorkerHealth:
+    """Health and saturation of the Worker objects in this process."""
+
+    def __init__(self, workers, max_cached_workflows, max_activities, registry=REGISTRY):
+        """
+        Args:
+            workers: The process's temporalio Worker objects
+            max_cached_workflows: Sticky cache capacity across all workers
+            max_activities: Activity slots across all workers, used when the
+                runtime's slot gauges aren't available
+        """
+        self.workers = workers
+        self.max_cached_workflows = max_cached_workflows
+        self.max_activities = max_activities
+        self.registry = registry
+        self.draining = False
+        self._samples = collections.deque()
+
+    def sample(self):
+        """Record the current task/failure totals for the failure-rate window."""
+        now = time.monotonic()
+        self._samples.append((now, _totals(self.registry.snapshot())))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= WINDOW_SECONDS:
+            self._samples.popleft()
+
+    async def run_sampler(self, interval=SAMPLE_INTERVAL_SECONDS):
+        while True:
+            self.sample()
+            await asyncio.sleep(interval)
+
+    def status(self):
+        if self.draining:
+            return STATUS_DRAINING
+        if any(worker.is_shutdown for worker in self.workers):
+            return STATUS_STOPPED
+        if all(worker.is_running for worker in self.workers):
+            return STATUS_READY
+        return STATUS_STARTING
+
+    def _failure_rates(self, totals):
+        if not self._samples:
+            return {"workflow_task": 0.0, "activity": 0.0}
+        _, oldest = self._samples[0]
+        rates = {}
+        for kind in ("workflow_task", "activity"):
+            done = totals[kind] - oldest[kind]
+            failed = totals[f"{kind}_failed"] - oldest[f"{kind}_failed"]
+            rates[kind] = round(failed / done, 4) if done else 0.0
+        return rates
+
+    def report(self):
+        """JSON-serializable health and saturation of this process."""
+        snapshot = self.registry.snapshot()
+        totals = _totals(snapshot)
+
+        slots = {kind: {"used": 0, "available": 0} for kind in SLOT_TYPES.values()}
+        sticky_cache_size = 0
+        runtime_slots = False
+        for gauge in snapshot["gauges"]:
+            kind = SLOT_TYPES.get(gauge["labels"].get("worker_type"))
+            if gauge["name"] in (SLOTS_USED, SLOTS_AVAILABLE) and kind:
+                runtime_slots = True
+                slots[kind]["used" if gauge["name"] == SLOTS_USED else "available"] += int(gauge["value"])
+            elif gauge["name"] == STICKY_CACHE_SIZE:
+                sticky_cache_size += int(gauge["value"])
+        if not runtime_slots:
+            # The runtime exports its metrics itself (TEMPORAL_PROMETHEUS_ADDRESS):
+            # fall back to the activities TimingInterceptor saw start and finish
+            in_flight = max(0, totals["activity_started"] - totals["activity"])
+            slots["activity"] = {"used": in_flight, "available": max(0, self.max_activities - in_flight)}
+
+        saturation = max(
+            (s["used"] / (s["used"] + s["available"]) for s in slots.values() if s["used"] + s["available"]),
+            default=0.0,
+        )
+        return {
+            "status": self.status(),
+            "task_queues": sorted({worker.task_queue for worker in self.workers}),
+            "slots": slots,
+            "saturation": round(saturation, 3),
+            "sticky_cache": {"size": sticky_cache_size, "max": self.max_cached_workflows},
+            "failure_rates": self._failure_rates(totals),
+            "failure_rate_window_seconds": WINDOW_SECONDS,
+        }
+
+    def routes(self):
+        """JSON routes for metrics.start_metrics_server: {path: () -> (status code, body)}."""
+        def health():
+            return 200, self.report()
+
+        def ready():
+            report = self.report()
+            return (200 if report["status"] == STATUS_READY else 503), report
+
+        return {"/health": health, "/ready": ready}
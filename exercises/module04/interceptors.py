@@ -0,0 +1,148 @@
+"""
+Worker interceptors and collectors that record where the time per transfer goes.
+
+- TimingInterceptor records, per activity type: schedule-to-start latency,
+  execution time, attempt number and outcome.
+- RuntimeMetricsCollector drains the Temporal runtime's metric buffer, which
+  includes workflow task schedule-to-start/execution/replay latency per
+  workflow type.
+
+Both write to metrics.REGISTRY. `report_metrics` periodically drains the
+runtime buffer and logs a summary of every histogram, and can also write the
+registry to a file for launch_workers.py to aggregate.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from temporalio import activity
+from temporalio.runtime import (
+    BUFFERED_METRIC_KIND_COUNTER,
+    BUFFERED_METRIC_KIND_HISTOGRAM,
+)
+from temporalio.worker import ActivityInboundInterceptor, Interceptor
+
+from metrics import ATTEMPT_BUCKETS, REGISTRY
+from structured_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+# Runtime metric attributes worth keeping as labels (the rest are dropped)
+RUNTIME_METRIC_LABELS = ("workflow_type", "activity_type", "worker_type", "task_queue", "poller_type")
+
+
+class TimingInterceptor(Interceptor):
+    """Records activity timings in the metrics registry."""
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+
+    def intercept_activity(self, next):
+        return _ActivityTimingInboundInterceptor(next, self.registry)
+
+
+class _ActivityTimingInboundInterceptor(ActivityInboundInterceptor):
+    def __init__(self, next, registry):
+        super().__init__(next)
+        self.registry = registry
+
+    async def execute_activity(self, input):
+        info = activity.info()
+        activity_type = info.activity_type
+        schedule_to_start = info.started_time - info.current_attempt_scheduled_time
+        self.registry.observe(
+            "activity_schedule_to_start_ms",
+            schedule_to_start.total_seconds() * 1000,
+            activity_type=activity_type,
+        )
+        self.registry.observe(
+            "activity_attempt", info.attempt, buckets=ATTEMPT_BUCKETS, activity_type=activity_type
+        )
+        # With activity_outcomes_total, gives the activities in flight (see health.py)
+        self.registry.increment("activities_started_total", activity_type=activity_type)
+
+        outcome = "failed"
+        start = time.perf_counter()
+        try:
+            result = await super().execute_activity(input)
+            outcome = "succeeded"
+            return result
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            self.registry.observe(
+                "activity_execution_ms",
+                (time.perf_counter() - start) * 1000,
+                activity_type=activity_type,
+                outcome=outcome,
+            )
+            self.registry.increment("activity_outcomes_total", activity_type=activity_type, outcome=outcome)
+
+
+class RuntimeMetricsCollector:
+    """Drains a temporalio.runtime.MetricBuffer into the metrics registry."""
+
+    def __init__(self, buffer, registry=REGISTRY):
+        self.buffer = buffer
+        self.registry = registry
+
+    def collect(self):
+        for update in self.buffer.retrieve_updates():
+            metric = update.metric
+            labels = {
+                key: value for key, value in update.attributes.items()
+                if key in RUNTIME_METRIC_LABELS
+            }
+            if metric.kind == BUFFERED_METRIC_KIND_HISTOGRAM:
+                self.registry.observe(metric.name, update.value, **labels)
+            elif metric.kind == BUFFERED_METRIC_KIND_COUNTER:
+                self.registry.increment(metric.name, update.value, **labels)
+            else:
+                self.registry.set_gauge(metric.name, update.value, **labels)
+
+
+def log_histograms(registry=REGISTRY):
+    """Log one summary event per histogram."""
+    for histogram in registry.snapshot()["histograms"]:
+        log_event(
+            logger, "metrics.histogram",
+            name=histogram["name"], **histogram["labels"],
+            count=histogram["count"], p50=histogram["p50"], p90=histogram["p90"],
+            p99=histogram["p99"], max=round(histogram["max"], 2),
+        )
+
+
+def write_snapshot(path, registry=REGISTRY):
+    """Atomically write the registry's snapshot to `path` as JSON."""
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(temporary, path)
+
+
+async def report_metrics(collector, dump_interval, collect_interval=1.0, snapshot_path=None):
+    """
+    Drain the runtime buffer every `collect_interval` seconds and log every `dump_interval`.
+
+    If `snapshot_path` is set, the registry is also written there after every
+    collection. `collector` may be None when the runtime exports its metrics
+    itself; then only REGISTRY is logged and written.
+    """
+    registry = collector.registry if collector else REGISTRY
+    last_dump = time.monotonic()
+    while True:
+        await asyncio.sleep(collect_interval)
+        if collector:
+            collector.collect()
+        if snapshot_path:
+            try:
+                write_snapshot(snapshot_path, registry)
+            except OSError as e:
+                log_event(logger, "metrics.snapshot_failed", logging.WARNING, path=snapshot_path, error=str(e))
+        if dump_interval and time.monotonic() - last_dump >= dump_interval:
+            log_histograms(registry)
+            last_dump = time.monotonic()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Run several worker processes on the same task queues.
+
+One `worker.py` process runs every workflow task (including the sandbox's
+per-workflow imports) on a single asyncio event loop, so it can use at most
+one CPU core. This launcher starts N copies of it - one per core by default -
+so a single box scales with its cores:
+- every process gets the same configuration (the launcher's environment,
+  see config.py), so they all poll the same task queues with the same slots
+- SIGINT/SIGTERM are forwarded to every process, and the launcher waits for
+  them to drain their in-flight activities and exit
+- a process that exits on its own is restarted, with a growing delay if it
+  keeps crashing right after starting
+- each process writes its metrics to a file, and the launcher logs one
+  summary of every histogram across all processes and serves them at
+  /metrics on WORKER_METRICS_PORT
+
+`WORKER_MAX_CONCURRENT_ACTIVITIES` and `WORKER_MAX_CONCURRENT_WORKFLOW_TASKS`
+are per process, so N processes have N times the slots.
+
+Usage:
+    python launch_workers.py [--processes 8] [--metrics-dir worker-metrics]
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from config import (
+    METRICS_DUMP_INTERVAL,
+    WORKER_METRICS_PORT,
+    WORKER_PROCESSES,
+    WORKER_SHUTDOWN_GRACE_SECONDS,
+)
+from interceptors import log_histograms
+from metrics import MetricsRegistry, start_metrics_server
+from structured_logging import configure_logging, log_event
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = Path(__file__).with_name("worker.py")
+
+# Restart delay after a crash, doubled for every crash within MIN_UPTIME_SECONDS
+RESTART_DELAY_SECONDS = 1.0
+MAX_RESTART_DELAY_SECONDS = 30.0
+MIN_UPTIME_SECONDS = 10.0
+
+# Seconds to wait for the workers to exit after forwarding a shutdown signal:
+# their grace period for in-flight activities, plus time to wrap up
+SHUTDOWN_TIMEOUT_SECONDS = WORKER_SHUTDOWN_GRACE_SECONDS + 10.0
+
+POLL_INTERVAL_SECONDS = 0.5
+
+
+class WorkerProcess:
+    """One worker.py child process, restarted when it exits unexpectedly."""
+
+    def __init__(self, index, metrics_file):
+        self.index = index
+        self.metrics_file = metrics_file
+        self.process = None
+        self.started_at = 0.0
+        self.restart_delay = RESTART_DELAY_SECONDS
+        self.restart_at = 0.0
+        self.restarts = 0
+
+    def start(self):
+        env = dict(
+            os.environ,
+            WORKER_METRICS_FILE=str(self.metrics_file),
+            # Only the launcher logs and serves the aggregated metrics
+            METRICS_DUMP_INTERVAL="0",
+            WORKER_METRICS_PORT="0",
+        )
+        # A new session keeps Ctrl+C from reaching the workers directly, so
+        # each one gets exactly one forwarded signal
+        self.process = subprocess.Popen(
+            [sys.executable, str(WORKER_SCRIPT)], env=env, start_new_session=True
+        )
+        self.started_at = time.monotonic()
+        log_event(logger, "launcher.worker_started", index=self.index, pid=self.process.pid)
+
+    def check(self, registry):
+        """
+        Restart the process if it has exited.
+
+        Args:
+            registry: Registry that keeps the histograms and counters of
+                exited processes, so restarts don't lose observations
+        """
+        now = time.monotonic()
+        if self.process is None:
+            if now >= self.restart_at:
+                self.start()
+            return
+        returncode = self.process.poll()
+        if returncode is None:
+            return
+
+        uptime = now - self.started_at
+        self.restart_delay = (
+            min(self.restart_delay * 2, MAX_RESTART_DELAY_SECONDS)
+            if uptime < MIN_UPTIME_SECONDS else RESTART_DELAY_SECONDS
+        )
+        self.restart_at = now + self.restart_delay
+        self.restarts += 1
+        log_event(
+            logger, "launcher.worker_exited", logging.ERROR,
+            index=self.index, pid=self.process.pid, returncode=returncode,
+            uptime=round(uptime, 1), restart_in=self.restart_delay,
+        )
+        self.process = None
+
+        snapshot = read_snapshot(self.metrics_file)
+        if snapshot:
+            # Gauges describe a live process, so only keep the totals
+            registry.merge({**snapshot, "gauges": []})
+        self.metrics_file.unlink(missing_ok=True)
+
+    def signal(self, signum):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signum)
+
+
+def read_snapshot(path):
+    """Load a metrics snapshot written by a worker, or None if there isn't one yet."""
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def aggregate_metrics(workers, exited):
+    """Registry with the metrics of every live process plus those of exited ones."""
+    registry = MetricsRegistry()
+    registry.merge(exited.snapshot())
+    for worker in workers:
+        snapshot = read_snapshot(worker.metrics_file)
+        if snapshot:
+            registry.merge(snapshot)
+    return registry
+
+
+def shutdown(workers, signum):
+    """Forward `signum` to every worker and wait for them, killing stragglers."""
+    log_event(logger, "launcher.stopping", signal=signal.Signals(signum).name, workers=len(workers))
+    for worker in workers:
+        worker.signal(signum)
+
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT_SECONDS
+    for worker in workers:
+        if worker.process is None:
+            continue
+        try:
+            worker.process.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            log_event(logger, "launcher.worker_killed", logging.WARNING, index=worker.index, pid=worker.process.pid)
+            worker.process.kill()
+            worker.process.wait()
+
+
+def run(processes, metrics_dir):
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    workers = [WorkerProcess(i, metrics_dir / f"worker-{i}.json") for i in range(processes)]
+    exited = MetricsRegistry()
+
+    received = []
+
+    def on_signal(signum, frame):
+        received.append(signum)
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    for worker in workers:
+        worker.metrics_file.unlink(missing_ok=True)
+        worker.start()
+    print(f"Started {processes} worker processes, metrics in {metrics_dir}")
+    metrics_server = None
+    if WORKER_METRICS_PORT:
+        metrics_server = start_metrics_server(
+            WORKER_METRICS_PORT, lambda: aggregate_metrics(workers, exited).snapshot()
+        )
+        print(f"Aggregated metrics at http://localhost:{WORKER_METRICS_PORT}/metrics")
+
+    last_dump = time.monotonic()
+    while not received:
+        time.sleep(POLL_INTERVAL_SECONDS)
+        if received:
+            break
+        for worker in workers:
+            worker.check(exited)
+        if METRICS_DUMP_INTERVAL and time.monotonic() - last_dump >= METRICS_DUMP_INTERVAL:
+            log_histograms(aggregate_metrics(workers, exited))
+            last_dump = time.monotonic()
+
+    shutdown(workers, received[0])
+    if metrics_server:
+        metrics_server.shutdown()
+    restarts = sum(worker.restarts for worker in workers)
+    print(f"All worker processes stopped ({restarts} restarts)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--processes", type=int, default=WORKER_PROCESSES or os.cpu_count() or 1,
+        help="Worker processes to run (default WORKER_PROCESSES, or one per CPU core)",
+    )
+    parser.add_argument(
+        "--metrics-dir", type=Path, default=Path("worker-metrics"),
+        help="Directory for the per-process metrics files",
+    )
+    args = parser.parse_args()
+
+    log_listener = configure_logging()
+    try:
+        run(max(1, args.processes), args.metrics_dir)
+    finally:
+        log_listener.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+In-process metrics: latency histograms, counters and gauges.
+
+The worker records activity timings (see interceptors.py) and the Temporal
+runtime's own metrics (workflow task latency, slots, ...) into the shared
+REGISTRY, which can be dumped periodically or scraped. The Flask services
+keep their own REGISTRY (request latency, lock wait and storage I/O time).
+
+`render_prometheus` turns a snapshot into the Prometheus text format, served
+by the Flask apps' /metrics routes and by `start_metrics_server` in the worker.
+"""
+
+import bisect
+import contextlib
+import http.server
+import json
+import math
+import re
+import threading
+import time
+
+# Bucket upper bounds in milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# Bucket upper bounds in milliseconds for operations that usually take well
+# under a millisecond (lock waits, local file I/O)
+SHORT_LATENCY_BUCKETS_MS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 100, 1000)
+
+# Bucket upper bounds for attempt numbers
+ATTEMPT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """Fixed-bucket histogram. The last bucket catches everything above the highest bound."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile (0 < q <= 1)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+        }
+
+    def merge(self, snapshot):
+        """Add the observations of a `snapshot()` taken with the same buckets."""
+        for i, count in enumerate(snapshot["counts"]):
+            self.counts[i] += count
+        self.count += snapshot["count"]
+        self.sum += snapshot["sum"]
+        self.max = max(self.max, snapshot["max"])
+
+
+class MetricsRegistry:
+    """Thread-safe collection of metrics, keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS_MS, **labels):
+        """Record a value in the histogram for `name` and `labels`."""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    @contextlib.contextmanager
+    def timer(self, name, buckets=LATENCY_BUCKETS_MS, **labels):
+        """Observe the time spent in the `with` block, in milliseconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000, buckets, **labels)
+
+    def merge(self, snapshot):
+        """
+        Fold another registry's `snapshot()` into this one.
+
+        Histograms and counters are added up, and so are gauges (e.g. slots
+        used across several worker processes).
+        """
+        with self._lock:
+            for entry in snapshot["histograms"]:
+                key = self._key(entry["name"], entry["labels"])
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(entry["buckets"])
+                histogram.merge(entry)
+            for entry in snapshot["counters"]:
+                key = self._key(entry["name"], entry["labels"])
+                self._counters[key] = self._counters.get(key, 0) + entry["value"]
+            for entry in snapshot["gauges"]:
+                key = self._key(entry["name"], entry["labels"])
+                self._gauges[key] = self._gauges.get(key, 0) + entry["value"]
+
+    def snapshot(self):
+        """Return a JSON-serializable copy of every metric."""
+        with self._lock:
+            return {
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **histogram.snapshot()}
+                    for (name, labels), histogram in self._histograms.items()
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self._counters.items()
+                ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self._gauges.items()
+                ],
+            }
+
+
+# Registry shared by the interceptors, the runtime collector and the dump/scrape code
+REGISTRY = MetricsRegistry()
+
+
+class TimedRLock:
+    """
+    Re-entrant lock that records how long threads wait to acquire it.
+
+    Only the outermost acquisition per thread is timed - re-entering a lock
+    the thread already holds never waits.
+    """
+
+    def __init__(self, name, registry=REGISTRY):
+        self.name = name
+        self.registry = registry
+        self._lock = threading.RLock()
+        self._owner = threading.local()
+
+    def __enter__(self):
+        depth = getattr(self._owner, "depth", 0)
+        if depth:
+            self._lock.acquire()
+        else:
+            start = time.perf_counter()
+            self._lock.acquire()
+            self.registry.observe(
+                "lock_wait_ms", (time.perf_counter() - start) * 1000, SHORT_LATENCY_BUCKETS_MS, lock=self.name
+            )
+        self._owner.depth = depth + 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._owner.depth -= 1
+        self._lock.release()
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        f'{_metric_name(key)}="{_escape_label_value(value)}"' for key, value in sorted(labels.items())
+    ) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(snapshot):
+    """Render a registry snapshot in the Prometheus text exposition format."""
+    lines = []
+    declared = set()
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for histogram in sorted(snapshot["histograms"], key=lambda h: h["name"]):
+        name = _metric_name(histogram["name"])
+        declare(name, "histogram")
+        cumulative = 0
+        for bound, count in zip([*histogram["buckets"], math.inf], histogram["counts"]):
+            cumulative += count
+            le = "+Inf" if math.isinf(bound) else _format_value(bound)
+            lines.append(f"{name}_bucket{_format_labels(histogram['labels'], le=le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(histogram['labels'])} {_format_value(histogram['sum'])}")
+        lines.append(f"{name}_count{_format_labels(histogram['labels'])} {histogram['count']}")
+
+    for kind, entries in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+        for entry in sorted(entries, key=lambda e: e["name"]):
+            name = _metric_name(entry["name"])
+            declare(name, kind)
+            lines.append(f"{name}{_format_labels(entry['labels'])} {_format_value(entry['value'])}")
+
+    return "\n".join(lines) + "\n"
+
+
+# Content type of the Prometheus text format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def start_metrics_server(port, snapshot=REGISTRY.snapshot, host="0.0.0.0", json_routes=None):
+    """
+    Serve `render_prometheus(snapshot())` at /metrics on a background thread.
+
+    Args:
+        port: Port to listen on
+        snapshot: Callable returning the snapshot to serve on every scrape
+        json_routes: Extra routes, {path: callable returning (status code, JSON-serializable body)}
+
+    Returns:
+        The started server; call `shutdown()` on it to stop serving
+    """
+    json_routes = json_routes or {}
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/metrics":
+                self._respond(200, PROMETHEUS_CONTENT_TYPE, render_prometheus(snapshot()))
+            elif path in json_routes:
+                status, body = json_routes[path]()
+                self._respond(status, "application/json", json.dumps(body))
+            else:
+                self.send_error(404)
+
+        def _respond(self, status, content_type, text):
+            body = text.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would flood the worker's output
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
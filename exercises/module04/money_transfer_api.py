@@ -10,6 +10,8 @@ This Flask application provides:
 """
 
 import asyncio
+import contextvars
+import threading
 import time
 import uuid
 from pathlib import Path
@@ -17,19 +19,62 @@ from flask import Flask, render_template, jsonify, request
 import requests
 
 # Temporal imports
-from temporalio.client import Client, WorkflowExecutionStatus
-from workflow import MoneyTransferWorkflowMod04, MoneyTransferInput
+from temporalio.client import (
+    Client,
+    WithStartWorkflowOperation,
+    WorkflowExecutionStatus,
+    WorkflowUpdateFailedError,
+    WorkflowUpdateStage,
+)
+from temporalio.common import WorkflowIDConflictPolicy
+from temporalio.service import RPCError, RPCStatusCode
+from batch_store import write_batch
+from config import WORKFLOW_LIST_CONCURRENCY, WORKFLOW_STATE_TIMEOUT_SECONDS
+from data_converter import build_data_converter
+from flask_metrics import instrument_app
+from metrics import REGISTRY
+from shared import PRIORITIES, PRIORITY_BATCH, PRIORITY_INTERACTIVE, PRIORITY_TASK_QUEUES
+from tracing import configure_tracing, temporal_interceptors, trace_requests
+from workflow import (
+    BatchTransferInput,
+    BatchTransferWorkflow,
+    MoneyTransferInput,
+    MoneyTransferResult,
+    MoneyTransferWorkflowMod04,
+    MAX_PROGRESS_WAIT_SECONDS,
+    MILESTONES,
+    WaitForProgressInput,
+    TRANSFER_MODE_SAGA,
+    TRANSFER_MODES,
+)
 
 app = Flask(__name__)
+# Request rate/latency/errors and time spent in Temporal calls at GET /metrics
+instrument_app(app)
+# Server span per request, continued through Temporal (if TRACING_EXPORTER is set)
+configure_tracing("money-transfer-api")
+trace_requests(app)
 
 # Configuration
 TEMPORAL_SERVER = "localhost:7233"
-TASK_QUEUE = "money-transfer-task-queue"
 ACCOUNT_API_URL = "http://127.0.0.1:5000"
 ACCOUNT_API_FILE = Path(__file__).parent / "account_api.py"
+# Default and maximum seconds a synchronous transfer request waits for its milestone
+SYNC_TRANSFER_TIMEOUT = 10
+SYNC_TRANSFER_MAX_TIMEOUT = 60
+
+# Maximum number of workflow states kept for incremental (get_state_since) queries
+WORKFLOW_STATE_CACHE_SIZE = 1000
 
 # State management
 temporal_client = None
+# Serializes the first connect; only used on the event loop thread
+temporal_client_lock = asyncio.Lock()
+# One event loop for every request, on a background thread (see get_event_loop)
+event_loop = None
+event_loop_lock = threading.Lock()
+# Last state seen per workflow ID
+workflow_state_cache = {}
 
 
 # ============================================================================
@@ -37,32 +82,64 @@ temporal_client = None
 # ============================================================================
 
 async def get_temporal_client():
-    """Get or create Temporal client connection."""
+    """Get or create the Temporal client connection, shared by every request."""
     global temporal_client
-    if temporal_client is None:
-        try:
-            temporal_client = await Client.connect(TEMPORAL_SERVER)
-        except Exception as e:
-            print(f"Error connecting to Temporal: {e}")
-            raise
+    async with temporal_client_lock:
+        if temporal_client is None:
+            try:
+                temporal_client = await Client.connect(
+                    TEMPORAL_SERVER,
+                    data_converter=build_data_converter(),
+                    interceptors=temporal_interceptors(),
+                )
+            except Exception as e:
+                print(f"Error connecting to Temporal: {e}")
+                raise
     return temporal_client
 
 
+def get_event_loop():
+    """
+    Get the background event loop, starting it on first use.
+    
+    The Temporal client and its gRPC connection belong to the loop they were
+    created on, so every request runs its Temporal calls on this one
+    long-lived loop instead of a new loop per request.
+    """
+    global event_loop
+    with event_loop_lock:
+        if event_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="temporal-event-loop", daemon=True).start()
+            event_loop = loop
+    return event_loop
+
+
+async def run_in_context(coro, context):
+    # The task would otherwise get the loop thread's context, losing the
+    # request's contextvars (such as its trace span)
+    return await asyncio.create_task(coro, context=context)
+
+
 def run_async(coro):
-    """Helper to run async code in sync context."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        return loop.run_until_complete(coro)
-    finally:
-        loop.close()
+    """
+    Run a coroutine on the shared event loop and wait for its result.
+    
+    Safe to call from any request thread. Records temporal_call_ms per coroutine.
+    """
+    with REGISTRY.timer("temporal_call_ms", operation=coro.__name__):
+        future = asyncio.run_coroutine_threadsafe(
+            run_in_context(coro, contextvars.copy_context()), get_event_loop()
+        )
+        return future.result()
 
 
 # ============================================================================
 # Workflow Management
 # ============================================================================
 
-async def start_workflow_async(from_account, to_account, amount):
+async def start_workflow_async(from_account, to_account, amount, mode=TRANSFER_MODE_SAGA,
+                               priority=PRIORITY_INTERACTIVE):
     """Start a money transfer workflow."""
     client = await get_temporal_client()
     
@@ -73,25 +150,152 @@ async def start_workflow_async(from_account, to_account, amount):
     workflow_input = MoneyTransferInput(
         from_account=from_account,
         to_account=to_account,
-        amount=amount
+        amount=amount,
+        mode=mode,
+        priority=priority
     )
     
-    # Start workflow
+    # Start workflow on its priority lane's task queue
     handle = await client.start_workflow(
         MoneyTransferWorkflowMod04.run,
         workflow_input,
         id=workflow_id,
-        task_queue=TASK_QUEUE,
+        task_queue=PRIORITY_TASK_QUEUES[priority],
     )
     
     return workflow_id, handle
 
 
+async def start_workflow_and_wait_async(transfer, milestone, timeout):
+    """
+    Start a money transfer workflow and wait until it reaches a milestone.
+    
+    Uses update-with-start, so starting the workflow and registering the
+    wait_for_milestone update is a single call to Temporal.
+    
+    Returns:
+        (workflow_id, state) - state is None if the milestone wasn't reached
+        within `timeout` seconds (the workflow keeps running)
+    """
+    client = await get_temporal_client()
+    
+    workflow_id = f"transfer-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    
+    start_operation = WithStartWorkflowOperation(
+        MoneyTransferWorkflowMod04.run,
+        transfer,
+        id=workflow_id,
+        task_queue=PRIORITY_TASK_QUEUES[transfer.priority],
+        id_conflict_policy=WorkflowIDConflictPolicy.FAIL,
+    )
+    # Returns once the workflow has started and accepted the update
+    update_handle = await client.start_update_with_start_workflow(
+        MoneyTransferWorkflowMod04.wait_for_milestone,
+        milestone,
+        start_workflow_operation=start_operation,
+        wait_for_stage=WorkflowUpdateStage.ACCEPTED,
+    )
+    
+    try:
+        state = await asyncio.wait_for(update_handle.result(), timeout)
+    except asyncio.TimeoutError:
+        return workflow_id, None
+    
+    return workflow_id, state
+
+
+async def start_batch_async(transfers, max_concurrency, netting=False):
+    """Start a batch transfer workflow."""
+    client = await get_temporal_client()
+    
+    batch_id = f"batch-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    
+    # The workflow input only references the transfers: a big batch would
+    # exceed Temporal's payload size limit. File I/O off the event loop.
+    await asyncio.to_thread(write_batch, batch_id, transfers)
+    
+    handle = await client.start_workflow(
+        BatchTransferWorkflow.run,
+        BatchTransferInput(
+            batch_id=batch_id, total=len(transfers), max_concurrency=max_concurrency, netting=netting
+        ),
+        id=batch_id,
+        task_queue=PRIORITY_TASK_QUEUES[PRIORITY_BATCH],
+    )
+    
+    return batch_id, handle
+
+
+async def get_batch_progress_async(batch_id):
+    """Get batch progress from Temporal using query."""
+    client = await get_temporal_client()
+    handle = client.get_workflow_handle(batch_id)
+    
+    desc = await handle.describe()
+    progress = await handle.query(BatchTransferWorkflow.get_progress)
+    
+    return {
+        **progress,
+        'batch_id': batch_id,
+        # Temporal's status of the current run rather than the workflow's own
+        'status': desc.status.name,
+        'start_time': desc.start_time.timestamp() if desc.start_time else None,
+        'close_time': desc.close_time.timestamp() if desc.close_time else None,
+    }
+
+
+async def query_workflow_state(handle):
+    """
+    Query a transfer workflow's state, fetching only what changed since the last call.
+    
+    The previous state is kept in workflow_state_cache, so repeated polling
+    of an unchanged workflow costs a tiny "unchanged" response.
+    """
+    cached = workflow_state_cache.get(handle.id)
+    if cached is None:
+        state = await handle.query(MoneyTransferWorkflowMod04.get_state)
+    else:
+        delta = await handle.query(MoneyTransferWorkflowMod04.get_state_since, cached['version'])
+        if delta.get('unchanged'):
+            return cached
+        state = {**cached, **delta['changes'], 'version': delta['version']}
+    
+    if handle.id not in workflow_state_cache and len(workflow_state_cache) >= WORKFLOW_STATE_CACHE_SIZE:
+        # Forget the oldest entry
+        workflow_state_cache.pop(next(iter(workflow_state_cache)), None)
+    workflow_state_cache[handle.id] = state
+    return state
+
+
+async def wait_for_progress_async(workflow_id, after_version, timeout):
+    """
+    Long-poll a transfer workflow until its state changes after `after_version`.
+    
+    Returns:
+        get_state_since-style dict, or None if the workflow is no longer
+        running (callers should fetch the final state instead)
+    """
+    client = await get_temporal_client()
+    handle = client.get_workflow_handle(workflow_id)
+    
+    try:
+        return await handle.execute_update(
+            MoneyTransferWorkflowMod04.wait_for_progress,
+            WaitForProgressInput(after_version=after_version, timeout_seconds=timeout),
+        )
+    except RPCError as e:
+        # Updates can't be sent to closed workflows
+        if e.status in (RPCStatusCode.NOT_FOUND, RPCStatusCode.FAILED_PRECONDITION):
+            return None
+        raise
+
+
 async def get_workflow_state_async(workflow_id):
     """Get workflow state from Temporal using query."""
     try:
         client = await get_temporal_client()
-        handle = client.get_workflow_handle(workflow_id)
+        # Typed so the fallback handle.result() below decodes a MoneyTransferResult
+        handle = client.get_workflow_handle(workflow_id, result_type=MoneyTransferResult)
         
         # Get workflow description for metadata
         desc = await handle.describe()
@@ -114,7 +318,7 @@ async def get_workflow_state_async(workflow_id):
         # Query workflow state if it's still running or just completed
         if status in ['RUNNING', 'COMPLETED']:
             try:
-                state = await handle.query(MoneyTransferWorkflowMod04.get_state)
+                state = await query_workflow_state(handle)
                 workflow_data['input'] = state.get('input', {})
                 workflow_data['result'] = state.get('result')
                 # Include step progress data
@@ -139,8 +343,6 @@ async def get_workflow_state_async(workflow_id):
                             'amount': result.amount,
                             'from_account_starting_balance': result.from_account_starting_balance,
                             'to_account_starting_balance': result.to_account_starting_balance,
-                            'from_account_final_balance': result.from_account_final_balance,
-                            'to_account_final_balance': result.to_account_final_balance,
                             'error_message': result.error_message
                         }
                     except:
@@ -153,6 +355,43 @@ async def get_workflow_state_async(workflow_id):
         return None
 
 
+async def list_workflow_states_async(client, query, concurrency=WORKFLOW_LIST_CONCURRENCY,
+                                     timeout=WORKFLOW_STATE_TIMEOUT_SECONDS):
+    """
+    List the workflows matching `query` and get their states concurrently.
+    
+    Each state takes a describe and a query call, so fetching them one by one
+    made a page load 2N+1 sequential round trips. States are now fetched as
+    the listing pages arrive, at most `concurrency` at a time.
+    
+    Results are partial rather than failing the page: a workflow whose state
+    takes longer than `timeout` seconds or can't be fetched is left out, and
+    if the listing fails the workflows listed so far are still returned.
+    
+    Returns:
+        Workflow states (see get_workflow_state_async), in listing order
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def fetch(workflow_id):
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(get_workflow_state_async(workflow_id), timeout)
+            except asyncio.TimeoutError:
+                print(f"Timed out getting workflow state for {workflow_id}")
+                return None
+    
+    tasks = []
+    try:
+        async for workflow_execution in client.list_workflows(query):
+            tasks.append(asyncio.create_task(fetch(workflow_execution.id)))
+    except Exception as e:
+        print(f"Error listing workflows ({len(tasks)} listed): {e}")
+    
+    states = await asyncio.gather(*tasks)
+    return [state for state in states if state]
+
+
 async def get_all_workflows_async():
     """Get all workflows from Temporal using queries."""
     workflows = []
@@ -160,15 +399,7 @@ async def get_all_workflows_async():
         client = await get_temporal_client()
         
         # Query recent workflows
-        async for workflow_execution in client.list_workflows(
-            f'WorkflowType="MoneyTransferWorkflowMod04"'
-        ):
-            workflow_id = workflow_execution.id
-            
-            # Get workflow state using query
-            workflow_data = await get_workflow_state_async(workflow_id)
-            if workflow_data:
-                workflows.append(workflow_data)
+        workflows = await list_workflow_states_async(client, 'WorkflowType="MoneyTransferWorkflowMod04"')
                 
     except Exception as e:
         print(f"Error listing workflows: {e}")
@@ -185,12 +416,8 @@ async def get_account_workflows_async(account_id):
         # Query workflows where the account is sender OR receiver
         query = f'from_account = "{account_id}" OR to_account = "{account_id}"'
         
-        async for workflow_execution in client.list_workflows(query):
-            workflow_id = workflow_execution.id
-            
-            # Get workflow state using query
-            workflow_data = await get_workflow_state_async(workflow_id)
-            if workflow_data and workflow_data.get('input'):
+        for workflow_data in await list_workflow_states_async(client, query):
+            if workflow_data.get('input'):
                 # Add direction indicator for easier UI rendering
                 input_data = workflow_data['input']
                 if input_data.get('from_account') == account_id:
@@ -211,6 +438,38 @@ async def get_account_workflows_async(account_id):
     return workflows
 
 
+def parse_transfer(data, default_priority=PRIORITY_INTERACTIVE):
+    """Validate a transfer from a request body. Returns (MoneyTransferInput, error)."""
+    from_account = data.get('from_account')
+    to_account = data.get('to_account')
+    amount = data.get('amount')
+    # "saga" (default), "fast_path" for a single atomic transfer activity, or
+    # "account_workflows" to debit and credit through each account's AccountWorkflow
+    mode = data.get('mode', TRANSFER_MODE_SAGA)
+    # "interactive" (default for single transfers) or "batch"
+    priority = data.get('priority', default_priority)
+    
+    if not all([from_account, to_account, amount]):
+        return None, "Missing required fields"
+    
+    if amount <= 0:
+        return None, "Amount must be positive"
+    
+    if mode not in TRANSFER_MODES:
+        return None, f"Mode must be one of {TRANSFER_MODES}"
+    
+    if priority not in PRIORITIES:
+        return None, f"Priority must be one of {PRIORITIES}"
+    
+    return MoneyTransferInput(
+        from_account=from_account,
+        to_account=to_account,
+        amount=amount,
+        mode=mode,
+        priority=priority
+    ), None
+
+
 def calculate_account_summary(account_id, workflows):
     """Calculate summary statistics for an account's workflows."""
     summary = {
@@ -291,22 +550,54 @@ def get_accounts():
 
 @app.route('/api/transfer', methods=['POST'])
 def start_transfer():
-    """Start a new money transfer workflow."""
+    """
+    Start a new money transfer workflow.
+    
+    With "wait_for": "withdrawn" or "completed" the request returns the
+    workflow state once that milestone is reached (200), or the workflow ID
+    if it isn't reached within "timeout" seconds (202).
+    """
     try:
         data = request.get_json()
         
-        from_account = data.get('from_account')
-        to_account = data.get('to_account')
-        amount = data.get('amount')
+        transfer, error = parse_transfer(data)
+        if error:
+            return jsonify({"error": error}), 400
         
-        if not all([from_account, to_account, amount]):
-            return jsonify({"error": "Missing required fields"}), 400
-        
-        if amount <= 0:
-            return jsonify({"error": "Amount must be positive"}), 400
+        wait_for = data.get('wait_for')
+        if wait_for is not None:
+            if wait_for not in MILESTONES:
+                return jsonify({"error": f"wait_for must be one of {MILESTONES}"}), 400
+            timeout = min(data.get('timeout', SYNC_TRANSFER_TIMEOUT), SYNC_TRANSFER_MAX_TIMEOUT)
+            if timeout <= 0:
+                return jsonify({"error": "timeout must be positive"}), 400
+            
+            try:
+                workflow_id, state = run_async(start_workflow_and_wait_async(transfer, wait_for, timeout))
+            except WorkflowUpdateFailedError as e:
+                # The workflow failed before reaching the milestone
+                return jsonify({
+                    "error": str(e.cause or e),
+                    "status": "failed"
+                }), 422
+            
+            if state is None:
+                return jsonify({
+                    "workflow_id": workflow_id,
+                    "status": "running",
+                    "message": f"Milestone '{wait_for}' not reached within {timeout}s"
+                }), 202
+            
+            return jsonify({
+                "workflow_id": workflow_id,
+                "status": "completed" if state['status'] == "COMPLETED" else wait_for,
+                "state": state
+            }), 200
         
         # Start workflow
-        workflow_id, handle = run_async(start_workflow_async(from_account, to_account, amount))
+        workflow_id, handle = run_async(start_workflow_async(
+            transfer.from_account, transfer.to_account, transfer.amount, transfer.mode, transfer.priority
+        ))
         
         return jsonify({
             "workflow_id": workflow_id,
@@ -318,6 +609,54 @@ def start_transfer():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/batches', methods=['POST'])
+def start_batch():
+    """Start a batch of transfers as one BatchTransferWorkflow."""
+    try:
+        data = request.get_json()
+        
+        transfers = []
+        for index, transfer_data in enumerate(data.get('transfers') or []):
+            # Batch transfers run on the batch lane unless they ask otherwise
+            transfer, error = parse_transfer(transfer_data, default_priority=PRIORITY_BATCH)
+            if error:
+                return jsonify({"error": f"Transfer {index}: {error}"}), 400
+            transfers.append(transfer)
+        
+        if not transfers:
+            return jsonify({"error": "At least one transfer is required"}), 400
+        
+        max_concurrency = data.get('max_concurrency', 10)
+        if max_concurrency < 1:
+            return jsonify({"error": "max_concurrency must be at least 1"}), 400
+        
+        # Settle the batch with net debits/credits per account instead of per transfer
+        netting = bool(data.get('netting', False))
+        
+        batch_id, handle = run_async(start_batch_async(transfers, max_concurrency, netting))
+        
+        return jsonify({
+            "batch_id": batch_id,
+            "transfer_count": len(transfers),
+            "netting": netting,
+            "status": "started"
+        }), 200
+        
+    except Exception as e:
+        print(f"Error starting batch: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/batches/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """Get the progress of a batch."""
+    try:
+        return jsonify(run_async(get_batch_progress_async(batch_id))), 200
+    except Exception as e:
+        print(f"Error getting batch {batch_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/api/workflows', methods=['GET'])
 def get_workflows():
     """Get all workflows."""
@@ -346,6 +685,34 @@ def get_workflow(workflow_id):
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/workflows/<workflow_id>/progress', methods=['GET'])
+def wait_for_workflow_progress(workflow_id):
+    """
+    Long-poll for progress of a workflow.
+    
+    Blocks until the workflow's state changes after ?after_version= (or
+    ?timeout= seconds pass) and returns the changes. Once the workflow has
+    closed, returns its final state with "closed": true.
+    """
+    try:
+        after_version = request.args.get('after_version', 0, type=int)
+        timeout = request.args.get('timeout', 30, type=float)
+        if not 0 < timeout <= MAX_PROGRESS_WAIT_SECONDS:
+            return jsonify({"error": f"timeout must be between 0 and {MAX_PROGRESS_WAIT_SECONDS}"}), 400
+        
+        progress = run_async(wait_for_progress_async(workflow_id, after_version, timeout))
+        if progress is None:
+            workflow = run_async(get_workflow_state_async(workflow_id))
+            if workflow is None:
+                return jsonify({"error": "Workflow not found"}), 404
+            return jsonify({**workflow, "closed": True}), 200
+        
+        return jsonify(progress), 200
+    except Exception as e:
+        print(f"Error waiting for workflow progress: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/api/accounts/<account_id>/workflows', methods=['GET'])
 def get_account_workflows(account_id):
     """Get all workflows for a specific account (as sender or receiver)."""
@@ -455,6 +822,7 @@ if __name__ == '__main__':
     print("  2. Account API running on http://127.0.0.1:5000")
     print("  3. Worker running (python worker.py)")
     print("\n🌐 Access the UI at: http://localhost:5001/")
+    print("📈 Prometheus metrics at: http://localhost:5001/metrics")
     print("\n⚠️  Note: The worker must be running for workflows to execute!")
     print("=" * 70)
     print()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Profile what the workflow sandbox costs per workflow run.
+
+Every time the worker creates a workflow instance (a new workflow, or one
+that was evicted from the cache) the sandbox imports every module that isn't
+passed through again. This replays a one-task history of each workflow in
+worker.WORKFLOWS many times - each replay creates a fresh instance - and
+reports, for the sandbox with and without a bytecode cache, and for the
+unsandboxed runner as a baseline:
+- time to create and run the first workflow task of one instance (the extra
+  latency of a cold workflow task is the difference to the baseline)
+- peak memory allocated while doing so
+- the modules imported inside the sandbox for one instance, with the time
+  spent executing each - the candidates for passing through
+
+"No bytecode cache" is measured with sys.dont_write_bytecode set, as under
+PYTHONDONTWRITEBYTECODE: otherwise the first import writes the cache and
+every later instance uses it.
+
+Only public APIs are used (Replayer, the history protos and an importlib
+meta path finder), and no Temporal server is needed.
+
+Usage:
+    python profile_sandbox.py [--instances 50] [--top 10]
+"""
+
+import argparse
+import asyncio
+import collections
+import importlib.abc
+import importlib.util
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from temporalio.api.enums.v1 import EventType
+from temporalio.api.history.v1 import HistoryEvent
+from temporalio.client import WorkflowHistory
+from temporalio.worker import Replayer, UnsandboxedWorkflowRunner
+from temporalio.worker.workflow_sandbox import SandboxedWorkflowRunner
+
+from data_converter import build_data_converter
+from shared import AccountWorkflowInput, BatchTransferInput, MoneyTransferInput, NettingInput
+from worker import WORKFLOWS, precompile_workflow_modules
+from workflow import AccountWorkflow, BatchTransferWorkflow, MoneyTransferWorkflowMod04, NettingTransferWorkflow
+
+# Input each workflow is started with in its profiling history
+SAMPLE_INPUTS = {
+    MoneyTransferWorkflowMod04: MoneyTransferInput(from_account="account_A", to_account="account_B", amount=100.0),
+    BatchTransferWorkflow: BatchTransferInput(batch_id="profile-batch", total=1),
+    AccountWorkflow: AccountWorkflowInput(account_id="account_A"),
+    NettingTransferWorkflow: NettingInput(),
+}
+
+TASK_QUEUE = "profile-sandbox"
+
+
+async def first_task_history(workflow_cls, data_converter):
+    """History of a workflow that was started and is running its first workflow task."""
+    started = HistoryEvent(event_id=1, event_type=EventType.EVENT_TYPE_WORKFLOW_EXECUTION_STARTED)
+    attributes = started.workflow_execution_started_event_attributes
+    attributes.workflow_type.name = workflow_cls.__name__
+    attributes.task_queue.name = TASK_QUEUE
+    attributes.input.payloads.extend(await data_converter.encode([SAMPLE_INPUTS[workflow_cls]]))
+    attributes.workflow_task_timeout.seconds = 10
+
+    scheduled = HistoryEvent(event_id=2, event_type=EventType.EVENT_TYPE_WORKFLOW_TASK_SCHEDULED)
+    scheduled.workflow_task_scheduled_event_attributes.task_queue.name = TASK_QUEUE
+
+    task_started = HistoryEvent(event_id=3, event_type=EventType.EVENT_TYPE_WORKFLOW_TASK_STARTED)
+    task_started.workflow_task_started_event_attributes.scheduled_event_id = 2
+
+    events = [started, scheduled, task_started]
+    for event in events:
+        event.event_time.GetCurrentTime()
+    return events
+
+
+async def replay_instances(replayer, events, instances):
+    """Replay `events` as `instances` separate workflows (one fresh instance each)."""
+    async def histories():
+        for i in range(instances):
+            yield WorkflowHistory(f"profile-{i}", events)
+
+    async with replayer.workflow_replay_iterator(histories()) as results:
+        async for result in results:
+            if result.replay_failure:
+                raise result.replay_failure
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Wraps a module's loader to time its exec_module."""
+    
+    def __init__(self, loader, timer):
+        self._loader = loader
+        self._timer = timer
+    
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+    
+    def exec_module(self, module):
+        self._timer.children.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._timer.children.pop()
+            if self._timer.children:
+                self._timer.children[-1] += elapsed
+            self._timer.self_times[module.__name__] += elapsed - children
+    
+    def __getattr__(self, name):
+        # get_resource_reader, get_source, ... of the real loader
+        return getattr(self._loader, name)
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """
+    Meta path finder that records how long each newly imported module takes to execute.
+    
+    Modules already in sys.modules (and so everything the sandbox passes
+    through) are never looked up, so inside the sandbox only its re-imports
+    show up.
+    """
+    
+    def __init__(self):
+        # Module name -> seconds executing its own code (not its imports)
+        self.self_times = collections.Counter()
+        self.children = []
+    
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+
+async def import_times(replayer, events):
+    """Self time per module imported inside the sandbox while creating one instance."""
+    timer = ImportTimer()
+    sys.meta_path.insert(0, timer)
+    try:
+        await replay_instances(replayer, events, 1)
+    finally:
+        sys.meta_path.remove(timer)
+    return timer.self_times
+
+
+async def measure(replayer, events, instances):
+    """Return (seconds per instance, peak bytes allocated for one instance)."""
+    # Warm up: imports everything that is passed through or loaded outside the sandbox
+    await replay_instances(replayer, events, 1)
+
+    start = time.perf_counter()
+    await replay_instances(replayer, events, instances)
+    per_instance = (time.perf_counter() - start) / instances
+
+    tracemalloc.start()
+    await replay_instances(replayer, events, 1)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return per_instance, peak
+
+
+def remove_bytecode_cache(workflow_cls):
+    """Delete the .pyc of the workflow's module, like a fresh PYTHONDONTWRITEBYTECODE deploy."""
+    path = Path(importlib.util.cache_from_source(sys.modules[workflow_cls.__module__].__file__))
+    path.unlink(missing_ok=True)
+
+
+async def run(instances, top):
+    data_converter = build_data_converter()
+    missing = [cls.__name__ for cls in WORKFLOWS if cls not in SAMPLE_INPUTS]
+    if missing:
+        raise SystemExit(f"No sample input for {', '.join(missing)} - add one to SAMPLE_INPUTS")
+
+    for workflow_cls in WORKFLOWS:
+        events = await first_task_history(workflow_cls, data_converter)
+        print(f"\n{workflow_cls.__name__}")
+        print(f"  {'runner':<14} {'bytecode':<10} {'ms/instance':>12} {'peak KB/instance':>17}")
+        for name, runner in [("sandboxed", SandboxedWorkflowRunner()), ("unsandboxed", UnsandboxedWorkflowRunner())]:
+            replayer = Replayer(workflows=[workflow_cls], data_converter=data_converter, workflow_runner=runner)
+            # The unsandboxed runner never imports the module again
+            for cached in (False, True) if name == "sandboxed" else (True,):
+                dont_write_bytecode = sys.dont_write_bytecode
+                if cached:
+                    precompile_workflow_modules([workflow_cls])
+                else:
+                    sys.dont_write_bytecode = True
+                    remove_bytecode_cache(workflow_cls)
+                try:
+                    per_instance, peak = await measure(replayer, events, instances)
+                finally:
+                    sys.dont_write_bytecode = dont_write_bytecode
+                print(
+                    f"  {name:<14} {'cached' if cached else 'none':<10} "
+                    f"{per_instance * 1000:>12.2f} {peak / 1024:>17.1f}"
+                )
+            if name == "sandboxed":
+                # Bytecode is cached again at this point, like on the worker
+                times = await import_times(replayer, events)
+        
+        print(f"  Imported inside the sandbox per instance ({len(times)} modules, "
+              f"{sum(times.values()) * 1000:.2f} ms):")
+        for module, seconds in times.most_common(top):
+            print(f"    {module:<40} {seconds * 1000:>8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--instances", type=int, default=50, help="Workflow instances to create per measurement")
+    parser.add_argument("--top", type=int, default=10, help="Modules to list per workflow, by import time")
+    args = parser.parse_args()
+    asyncio.run(run(args.instances, args.top))
+
+
+if __name__ == "__main__":
+    main()
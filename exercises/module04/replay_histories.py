@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Export workflow histories and replay them offline.
+
+Replaying recorded histories against the current workflow code answers two
+questions before a deploy:
+- is the change deterministic? (a replay failure means running workflows
+  would get stuck - like the `/0` in step 1.5)
+- how expensive is a workflow to replay? (time per event and per workflow)
+
+Replay needs no Temporal server, so a corpus of exported histories can be
+checked on a laptop or in CI. Exit code is 1 if any history fails to replay.
+
+Usage:
+    # Needs the Temporal server - save histories as JSON files
+    python replay_histories.py export --dir histories [--query '...'] [--limit 500]
+
+    # Offline - replay every history in the directory
+    python replay_histories.py replay --dir histories [--repeat 3]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from temporalio.client import Client, WorkflowHistory
+from temporalio.worker import Replayer
+
+from data_converter import build_data_converter
+# Every workflow the worker runs, so any exported history can be replayed
+from worker import WORKFLOWS
+
+TEMPORAL_SERVER = "localhost:7233"
+
+DEFAULT_QUERY = 'WorkflowType="MoneyTransferWorkflowMod04" AND ExecutionStatus!="Running"'
+
+# History files are named <workflow_id>__<run_id>.json
+FILE_SEPARATOR = "__"
+
+
+async def export_histories(directory, query, limit):
+    """Fetch the history of every workflow matching `query` and write it to `directory`."""
+    client = await Client.connect(TEMPORAL_SERVER, data_converter=build_data_converter())
+    directory.mkdir(parents=True, exist_ok=True)
+
+    count = 0
+    async for execution in client.list_workflows(query, limit=limit):
+        handle = client.get_workflow_handle(execution.id, run_id=execution.run_id)
+        history = await handle.fetch_history()
+        path = directory / f"{execution.id}{FILE_SEPARATOR}{execution.run_id}.json"
+        path.write_text(history.to_json())
+        count += 1
+
+    print(f"Exported {count} histories to {directory}")
+
+
+def load_histories(directory):
+    """Load every exported history in `directory`, sorted by file name."""
+    histories = []
+    for path in sorted(directory.glob("*.json")):
+        workflow_id = path.stem.split(FILE_SEPARATOR)[0]
+        histories.append(WorkflowHistory.from_json(workflow_id, path.read_text()))
+    return histories
+
+
+async def replay_histories(histories, repeat):
+    """
+    Replay every history `repeat` times.
+
+    Returns:
+        (timings, failures) - timings is a list of (workflow_id, events,
+        fastest seconds), failures a list of (workflow_id, error)
+    """
+    replayer = Replayer(workflows=WORKFLOWS, data_converter=build_data_converter())
+
+    timings = []
+    failures = []
+    for history in histories:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = await replayer.replay_workflow(history, raise_on_replay_failure=False)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            if result.replay_failure:
+                failures.append((history.workflow_id, result.replay_failure))
+                break
+        timings.append((history.workflow_id, len(history.events), best))
+    return timings, failures
+
+
+def print_report(timings, failures):
+    """Print replay cost per workflow and per event, and every failure."""
+    if not timings:
+        print("No histories to replay")
+        return
+
+    total_events = sum(events for _, events, _ in timings)
+    total_time = sum(seconds for _, _, seconds in timings)
+    per_workflow_ms = sorted(seconds * 1000 for _, _, seconds in timings)
+
+    print(f"Replayed {len(timings)} workflows ({total_events} events) in {total_time:.2f}s")
+    print(f"  per event:    {total_time / total_events * 1e6:.1f} us")
+    print(f"  per workflow: mean {statistics.mean(per_workflow_ms):.1f} ms, "
+          f"p50 {per_workflow_ms[len(per_workflow_ms) // 2]:.1f} ms, "
+          f"max {per_workflow_ms[-1]:.1f} ms")
+
+    slowest = sorted(timings, key=lambda t: t[2], reverse=True)[:5]
+    print("  slowest:")
+    for workflow_id, events, seconds in slowest:
+        print(f"    {workflow_id:<50} {events:>6} events {seconds * 1000:>9.1f} ms")
+
+    if failures:
+        print(f"\n❌ {len(failures)} histories failed to replay (nondeterminism or workflow task errors):")
+        for workflow_id, error in failures:
+            print(f"  {workflow_id}: {error}")
+    else:
+        print("\n✅ All histories replayed deterministically")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Save workflow histories from the Temporal server")
+    export_parser.add_argument("--dir", type=Path, default=Path("histories"), help="Directory for history files")
+    export_parser.add_argument("--query", default=DEFAULT_QUERY, help="Visibility query selecting workflows")
+    export_parser.add_argument("--limit", type=int, default=500, help="Maximum number of histories")
+
+    replay_parser = subparsers.add_parser("replay", help="Replay saved histories offline")
+    replay_parser.add_argument("--dir", type=Path, default=Path("histories"), help="Directory of history files")
+    replay_parser.add_argument("--repeat", type=int, default=1, help="Replays per history (fastest is reported)")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        asyncio.run(export_histories(args.dir, args.query, args.limit))
+        return
+
+    timings, failures = asyncio.run(replay_histories(load_histories(args.dir), max(1, args.repeat)))
+    print_report(timings, failures)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
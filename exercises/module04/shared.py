@@ -0,0 +1,150 @@
+"""
+Workflow inputs and results shared by the workflows, the worker and the clients.
+
+Kept out of workflow.py so they're built once: the sandbox re-imports
+workflow.py for every workflow instance, but workflow.py imports this module
+through imports_passed_through(). Import them from workflow.py or from here -
+they're the same classes.
+"""
+
+from dataclasses import dataclass, field
+
+from config import BATCH_TASK_QUEUE, SEPARATE_ACTIVITY_TASK_QUEUES, TASK_QUEUE
+
+
+# Transfer modes
+# - saga: check balances, withdraw, then deposit (one activity per step)
+# - fast_path: a single atomic transfer activity, for trusted internal
+#   transfers. Falls back to the saga if the Account API can't do it.
+# - account_workflows: debit and credit through each account's AccountWorkflow,
+#   which serializes (and batches) all operations on that account
+TRANSFER_MODE_SAGA = "saga"
+TRANSFER_MODE_FAST_PATH = "fast_path"
+TRANSFER_MODE_ACCOUNT_WORKFLOWS = "account_workflows"
+TRANSFER_MODES = [TRANSFER_MODE_SAGA, TRANSFER_MODE_FAST_PATH, TRANSFER_MODE_ACCOUNT_WORKFLOWS]
+
+# Priority classes. Each one runs on its own task queue, with its own share
+# of the worker's slots (see worker.py).
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITY_TASK_QUEUES = {
+    PRIORITY_INTERACTIVE: TASK_QUEUE,
+    PRIORITY_BATCH: BATCH_TASK_QUEUE,
+}
+PRIORITIES = list(PRIORITY_TASK_QUEUES)
+
+# Appended to a lane's task queue to get its activity task queue
+ACTIVITY_TASK_QUEUE_SUFFIX = "-activities"
+
+
+def activity_task_queue(workflow_task_queue):
+    """
+    Task queue for the activities of workflows running on `workflow_task_queue`.
+
+    The workflow's own queue, unless SEPARATE_ACTIVITY_TASK_QUEUES is set.
+    """
+    if not SEPARATE_ACTIVITY_TASK_QUEUES:
+        return workflow_task_queue
+    return f"{workflow_task_queue}{ACTIVITY_TASK_QUEUE_SUFFIX}"
+
+
+def workflow_task_queue(task_queue):
+    """The lane's workflow task queue, given its workflow or activity task queue."""
+    return task_queue.removesuffix(ACTIVITY_TASK_QUEUE_SUFFIX)
+
+
+@dataclass
+class MoneyTransferInput:
+    """Input for MoneyTransferWorkflowMod04."""
+    from_account: str
+    to_account: str
+    amount: float
+    mode: str = TRANSFER_MODE_SAGA
+    priority: str = PRIORITY_INTERACTIVE
+
+
+@dataclass
+class WaitForProgressInput:
+    """Input for the wait_for_progress update."""
+    # Version of the last state the caller has seen (0 = none)
+    after_version: int
+    timeout_seconds: float = 30.0
+
+
+@dataclass
+class MoneyTransferResult:
+    """Result from MoneyTransferWorkflowMod04."""
+    success: bool
+    from_account: str
+    to_account: str
+    amount: float
+    from_account_starting_balance: float
+    to_account_starting_balance: float
+    error_message: str = ""
+
+
+@dataclass
+class BatchSummary:
+    """Running totals for BatchTransferWorkflow, carried across continue-as-new."""
+    total: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    amount_transferred: float = 0.0
+    # "<index>: <error>" for the first failures (see MAX_BATCH_FAILURES_REPORTED in workflow.py)
+    failures: list[str] = field(default_factory=list)
+
+
+@dataclass
+class BatchTransferInput:
+    """Input for BatchTransferWorkflow."""
+    # Batch store ID of the transfers (see batch_store.py). Each run loads only
+    # its own slice, so no payload ever holds the whole batch.
+    batch_id: str
+    # Number of transfers in the whole batch
+    total: int
+    # How many transfers run at the same time
+    max_concurrency: int = 10
+    # Continue as new after this many transfers to keep each run's history small
+    transfers_per_run: int = 1000
+    # Index of this run's first transfer in the batch (set when continuing as new)
+    offset: int = 0
+    summary: BatchSummary | None = None
+    # Settle each run's transfers together through a NettingTransferWorkflow
+    netting: bool = False
+
+
+@dataclass
+class NettingInput:
+    """Input for NettingTransferWorkflow."""
+    # Transfers known up front (more can be submitted while the window is open)
+    transfers: list[MoneyTransferInput] = field(default_factory=list)
+    # How long to collect submitted transfers before settling (0 = settle right away)
+    window_seconds: float = 0.0
+    # Settle early once this many transfers have been collected
+    max_transfers: int = 1000
+
+
+@dataclass
+class NettingResult:
+    """Result from NettingTransferWorkflow."""
+    # One result per transfer, in submission order
+    results: list[MoneyTransferResult]
+    # Withdraw/deposit calls made against the Account API (vs. 2 per transfer without netting)
+    account_mutations: int = 0
+
+
+@dataclass
+class AccountWorkflowInput:
+    """Input for AccountWorkflow."""
+    account_id: str
+    # Running balance carried across continue-as-new (None = read it from the Account API)
+    balance: float | None = None
+    # Continue as new once the history has this many events
+    history_event_budget: int = 2000
+    # Maximum number of queued operations applied in one Account API call
+    max_batch_size: int = 100
+    # Balance after each recently applied operation, by operation_id. Carried
+    # across continue-as-new so a retried operation is never applied twice.
+    applied_operations: dict[str, float] = field(default_factory=dict)
+    # Recently voided operation IDs, rejected if they're sent again
+    voided_operations: list[str] = field(default_factory=list)
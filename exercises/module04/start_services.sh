@@ -21,25 +21,44 @@ ACCOUNT_API_PID=""
 MONEY_TRANSFER_PID=""
 WORKER_PID=""
 
+# Seconds to wait for a service to exit after SIGTERM before killing it. The
+# worker uses this time to let in-flight activities finish (WORKER_SHUTDOWN_GRACE_SECONDS).
+SHUTDOWN_TIMEOUT=${SHUTDOWN_TIMEOUT:-40}
+
+# Send SIGTERM and wait for the process to exit, killing it after SHUTDOWN_TIMEOUT
+stop_service() {
+    local name=$1
+    local pid=$2
+    
+    if [ -z "$pid" ] || ! kill -0 $pid 2>/dev/null; then
+        return
+    fi
+    
+    echo -e "  Stopping $name (PID: $pid)..."
+    kill -TERM $pid 2>/dev/null
+    for _ in $(seq 1 $SHUTDOWN_TIMEOUT); do
+        if ! kill -0 $pid 2>/dev/null; then
+            return
+        fi
+        sleep 1
+    done
+    
+    echo -e "${YELLOW}  $name did not stop within ${SHUTDOWN_TIMEOUT}s, killing it${NC}"
+    kill -KILL $pid 2>/dev/null
+}
+
 # Cleanup function
 cleanup() {
+    # Ignore further signals while stopping (e.g. a second Ctrl+C)
+    trap '' SIGINT SIGTERM
+    
     echo ""
     echo -e "${YELLOW}Shutting down services...${NC}"
     
-    if [ ! -z "$ACCOUNT_API_PID" ]; then
-        echo -e "  Stopping Account API (PID: $ACCOUNT_API_PID)..."
-        kill $ACCOUNT_API_PID 2>/dev/null
-    fi
-    
-    if [ ! -z "$MONEY_TRANSFER_PID" ]; then
-        echo -e "  Stopping Money Transfer API (PID: $MONEY_TRANSFER_PID)..."
-        kill $MONEY_TRANSFER_PID 2>/dev/null
-    fi
-    
-    if [ ! -z "$WORKER_PID" ]; then
-        echo -e "  Stopping Worker (PID: $WORKER_PID)..."
-        kill $WORKER_PID 2>/dev/null
-    fi
+    # Worker first: its in-flight activities still need the Account API
+    stop_service "Worker" "$WORKER_PID"
+    stop_service "Money Transfer API" "$MONEY_TRANSFER_PID"
+    stop_service "Account API" "$ACCOUNT_API_PID"
     
     echo -e "${GREEN}✓ All services stopped${NC}"
     exit 0
@@ -125,8 +144,11 @@ echo -e "${YELLOW}Press Ctrl+C to stop all services${NC}"
 echo -e "${GREEN}================================================${NC}"
 echo ""
 
-# Run Worker in foreground (this will show logs)
-uv run python worker.py
+# Run Worker in the background (its logs still show here) and wait for it, so a
+# SIGTERM sent to this script reaches the cleanup trap right away
+uv run python worker.py &
+WORKER_PID=$!
+wait $WORKER_PID
 
 # If Worker exits, cleanup
 cleanup
@@ -261,6 +261,12 @@ function getStepLabel(step, input) {
             return 'Withdraw';
         case 'deposit':
             return 'Deposit';
+        case 'transfer':
+            return `Atomic Transfer (${fromAccount} → ${toAccount})`;
+        case 'debit':
+            return `Debit (${fromAccount})`;
+        case 'credit':
+            return `Credit (${toAccount})`;
         default:
             return step;
     }
@@ -271,13 +277,15 @@ function renderStepProgress(workflow, allCompleted = false) {
     const steps = workflow.steps || ['check_balance_from', 'check_balance_to', 'withdraw', 'deposit'];
     const completedSteps = allCompleted ? steps : (workflow.completed_steps || []);
     const currentStep = workflow.current_step;
+    // Independent steps (e.g. both balance checks) can be in flight at once
+    const runningSteps = workflow.running_steps || (currentStep ? [currentStep] : []);
     const input = workflow.input || {};
     
     return `
         <div class="step-progress">
             ${steps.map((step, index) => {
                 const isCompleted = completedSteps.includes(step);
-                const isCurrent = step === currentStep && !isCompleted;
+                const isCurrent = runningSteps.includes(step) && !isCompleted;
                 const stepClass = isCompleted ? 'completed' : (isCurrent ? 'current' : 'pending');
                 const icon = isCompleted ? '✓' : (isCurrent ? '●' : '○');
                 const label = getStepLabel(step, input);
@@ -442,47 +450,30 @@ async function handleStartDailyBatch() {
     btn.disabled = true;
     btn.textContent = '⏳ Starting batch...';
     
-    let successCount = 0;
-    let failCount = 0;
-    const workflowIds = [];
-    
     try {
-        for (const transfer of batchTransfers) {
-            try {
-                const response = await fetch('/api/transfer', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify(transfer)
-                });
-                
-                if (!response.ok) {
-                    const error = await response.json();
-                    throw new Error(error.error || 'Transfer failed');
-                }
-                
-                const result = await response.json();
-                workflowIds.push(result.workflow_id);
-                successCount++;
-            } catch (error) {
-                console.error(`Error starting transfer ${transfer.from_account} -> ${transfer.to_account}:`, error);
-                failCount++;
-            }
-        }
+        // The whole batch runs server-side as one BatchTransferWorkflow
+        const response = await fetch('/api/batches', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ transfers: batchTransfers })
+        });
         
-        // Show results
-        if (successCount === batchTransfers.length) {
-            showMessage('success', `Daily batch started! ${successCount} workflows initiated.`);
-        } else if (successCount > 0) {
-            showMessage('error', `Batch partially started: ${successCount} succeeded, ${failCount} failed.`);
-        } else {
-            showMessage('error', 'Failed to start daily batch. Check if services are running.');
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.error || 'Batch failed');
         }
         
+        const result = await response.json();
+        showMessage('success', `Daily batch started! ${result.transfer_count} transfers in ${result.batch_id}.`);
+        
         // Refresh workflows to show the new batch
         await loadWorkflows();
         
+    } catch (error) {
+        console.error('Error starting daily batch:', error);
+        showMessage('error', 'Failed to start daily batch. Check if services are running.');
     } finally {
         btn.disabled = false;
         btn.textContent = '🚀 Start Daily Batch';
@@ -0,0 +1,109 @@
+"""
+Low-overhead structured logging for activities and workflows.
+
+Each step emits a single event with key/value fields instead of several
+pre-formatted f-string lines:
+
+    log_success(activity.logger, "withdraw.succeeded", account_id="account_A",
+                previous_balance=1000.0, new_balance=900.0)
+
+Nothing is formatted unless the logger is enabled for the level, success
+events can be sampled (see LOG_SUCCESS_SAMPLE_EVERY in config.py), and the
+actual formatting and I/O happens on a background thread fed by a queue, so
+log output never runs on the worker's event loop.
+"""
+
+import itertools
+import logging
+import logging.handlers
+import queue
+import sys
+from collections import defaultdict
+
+from temporalio import activity, workflow
+
+from config import LOG_LEVEL, LOG_SUCCESS_SAMPLE_EVERY
+
+# One counter per event name, used to sample success events
+_success_counters = defaultdict(itertools.count)
+
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """Log a structured event. Fields are only rendered if the event is emitted."""
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, event, extra={"fields": fields})
+
+
+def log_success(logger, event, **fields):
+    """Log a success event at INFO, keeping only 1 out of every N per event name."""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    if LOG_SUCCESS_SAMPLE_EVERY > 1 and next(_success_counters[event]) % LOG_SUCCESS_SAMPLE_EVERY:
+        return
+    logger.log(logging.INFO, event, extra={"fields": fields})
+
+
+def log_error(logger, event, **fields):
+    """Log a failure event at ERROR. Errors are never sampled."""
+    log_event(logger, event, level=logging.ERROR, **fields)
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Render records as `<time> <level> <event> key=value ...`."""
+
+    def format(self, record):
+        parts = [self.formatTime(record), record.levelname, record.getMessage()]
+        # Temporal adds workflow/activity details to `extra` - keep the useful ids
+        context = getattr(record, "temporal_workflow", None) or getattr(record, "temporal_activity", None)
+        if context:
+            parts.extend(
+                f"{key}={context[key]}"
+                for key in ("workflow_id", "workflow_type", "activity_type", "attempt")
+                if key in context
+            )
+        fields = getattr(record, "fields", None)
+        if fields:
+            parts.extend(f"{key}={value}" for key, value in fields.items())
+        line = " ".join(parts)
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers all formatting to the listener thread.
+
+    The stock QueueHandler formats the message in the calling thread (the
+    event loop). Records never leave this process, so they can be queued
+    as-is and formatted by the QueueListener instead.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(level=LOG_LEVEL):
+    """
+    Route all logging through a non-blocking queue.
+
+    Returns the started QueueListener; call `stop()` on it at shutdown to flush
+    any queued records.
+    """
+    log_queue = queue.SimpleQueue()
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(KeyValueFormatter())
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers[:] = [_DeferredQueueHandler(log_queue)]
+    root.setLevel(level)
+
+    # Workflow/activity ids are rendered from `extra` by the formatter, so skip
+    # the SDK's per-call `msg (dict)` string building.
+    workflow.logger.workflow_info_on_message = False
+    activity.logger.activity_info_on_message = False
+
+    listener.start()
+    return listener
@@ -0,0 +1,176 @@
+"""
+Optional OpenTelemetry tracing from the Money Transfer API down to the Account API's file I/O.
+
+One trace per request follows a transfer through every hop:
+
+    POST /api/transfer                      (money_transfer_api.py, server span)
+      StartWorkflow / RunWorkflow / ...     (Temporal client and worker interceptors)
+        RunActivity:withdraw                (worker)
+          HTTP POST /accounts/.../withdraw  (activities.py, client span + traceparent header)
+            POST /accounts/.../withdraw     (account_api.py, server span)
+              accounts_db.read / .write     (storage spans)
+
+Tracing is off unless TRACING_EXPORTER is set (see config.py) and needs the
+`tracing` extra (`uv sync --extra tracing`). Without the OpenTelemetry
+packages every helper here is a no-op. Spans go to a local JSON-lines file or
+the console by default, so no collector is needed.
+"""
+
+import contextlib
+
+from config import TRACING_EXPORTER, TRACING_FILE, TRACING_OTLP_ENDPOINT, TRACING_SAMPLE_RATIO
+
+try:
+    from opentelemetry import context, propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+except ImportError:
+    trace = None
+
+TRACING_EXPORTERS = ("console", "file", "otlp")
+
+# Set by configure_tracing
+_tracer = None
+
+
+def tracing_enabled():
+    return _tracer is not None
+
+
+def _span_exporter():
+    if TRACING_EXPORTER == "console":
+        return ConsoleSpanExporter()
+    if TRACING_EXPORTER == "file":
+        # One JSON span per line, appended by every service to the same file
+        return ConsoleSpanExporter(
+            out=open(TRACING_FILE, "a"),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    return OTLPSpanExporter(endpoint=TRACING_OTLP_ENDPOINT or None)
+
+
+def configure_tracing(service_name):
+    """
+    Install the global tracer provider for this process.
+
+    Args:
+        service_name: service.name of every span the process emits
+
+    Returns:
+        True if tracing is on
+
+    Raises:
+        ValueError: If TRACING_EXPORTER is unknown
+    """
+    global _tracer
+    if _tracer is not None:
+        return True
+    if not TRACING_EXPORTER:
+        return False
+    if TRACING_EXPORTER not in TRACING_EXPORTERS:
+        raise ValueError(f"Unknown tracing exporter: {TRACING_EXPORTER}")
+    if trace is None:
+        print(f"TRACING_EXPORTER={TRACING_EXPORTER} but OpenTelemetry isn't installed "
+              f"(uv sync --extra tracing) - tracing disabled")
+        return False
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        # Keep whole traces: a sampled-out caller means sampled-out callees
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO)),
+    )
+    # Exports on a background thread, in batches
+    provider.add_span_processor(BatchSpanProcessor(_span_exporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer(__name__)
+    return True
+
+
+def temporal_interceptors():
+    """
+    Temporal client interceptors for tracing (empty when tracing is off).
+
+    Workers created from a client with these interceptors trace workflows and
+    activities too.
+    """
+    if not tracing_enabled():
+        return []
+    from temporalio.contrib.opentelemetry import TracingInterceptor
+    return [TracingInterceptor()]
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Child span of the current span (no-op when tracing is off)."""
+    if not tracing_enabled():
+        yield None
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+@contextlib.contextmanager
+def http_client_span(method, route):
+    """
+    Client span for an outbound HTTP call.
+
+    Yields the headers to send with the request, carrying the trace context
+    (`traceparent`) so the server's span joins the same trace.
+
+        with http_client_span("POST", "/accounts/<account_number>/withdraw") as headers:
+            requests.post(url, json=body, headers=headers)
+    """
+    if not tracing_enabled():
+        yield {}
+        return
+    with _tracer.start_as_current_span(
+        f"HTTP {method} {route}", kind=SpanKind.CLIENT,
+        attributes={"http.request.method": method, "http.route": route},
+    ):
+        headers = {}
+        propagate.inject(headers)
+        yield headers
+
+
+def trace_requests(app):
+    """Wrap every request of a Flask app in a server span that continues the caller's trace."""
+    if not tracing_enabled():
+        return app
+    from flask import g, request
+
+    @app.before_request
+    def start_server_span():
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        g._trace_span = _tracer.start_span(
+            f"{request.method} {route}",
+            context=propagate.extract(request.headers),
+            kind=SpanKind.SERVER,
+            attributes={"http.request.method": request.method, "http.route": route},
+        )
+        g._trace_token = context.attach(trace.set_span_in_context(g._trace_span))
+
+    @app.after_request
+    def record_status(response):
+        current = g.get("_trace_span")
+        if current is not None:
+            current.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code >= 500:
+                current.set_status(Status(StatusCode.ERROR))
+        return response
+
+    @app.teardown_request
+    def end_server_span(exc):
+        current = g.pop("_trace_span", None)
+        if current is None:
+            return
+        if exc is not None:
+            current.record_exception(exc)
+            current.set_status(Status(StatusCode.ERROR, str(exc)))
+        current.end()
+        context.detach(g.pop("_trace_token"))
+
+    return app
@@ -1,28 +1,341 @@
 import asyncio
+import py_compile
+import signal
+import sys
+from datetime import timedelta
 
 from temporalio.client import Client
-from temporalio.worker import Worker
+from temporalio.runtime import MetricBuffer, PrometheusConfig, Runtime, TelemetryConfig
+from temporalio.worker import (
+    PollerBehaviorAutoscaling,
+    PollerBehaviorSimpleMaximum,
+    ResourceBasedSlotConfig,
+    Worker,
+    WorkerTuner,
+)
 
-from activities import check_balance, withdraw, deposit
-from workflow import MoneyTransferWorkflowMod04
+from activities import (
+    check_balance,
+    withdraw,
+    deposit,
+    transfer,
+    apply_account_operation,
+    load_batch_transfers,
+    void_operation,
+    void_account_operation,
+)
+from config import (
+    ACCOUNT_ACTIVITY_TASK_QUEUE,
+    LANE_BATCH_SLOT_SHARE,
+    LANE_INTERACTIVE_SLOT_SHARE,
+    METRICS_DUMP_INTERVAL,
+    TEMPORAL_PROMETHEUS_ADDRESS,
+    WORKER_ACCOUNT_ACTIVITY_SLOTS,
+    WORKER_ACTIVITY_TASK_POLLERS,
+    WORKER_MAX_CACHED_WORKFLOWS,
+    WORKER_MAX_CONCURRENT_ACTIVITIES,
+    WORKER_MAX_CONCURRENT_WORKFLOW_TASKS,
+    WORKER_METRICS_FILE,
+    WORKER_METRICS_PORT,
+    WORKER_MIN_ACTIVITY_SLOTS,
+    WORKER_MIN_WORKFLOW_TASK_SLOTS,
+    WORKER_ROLE,
+    WORKER_SHUTDOWN_GRACE_SECONDS,
+    WORKER_TARGET_CPU_USAGE,
+    WORKER_TARGET_MEMORY_USAGE,
+    WORKER_TUNER,
+    WORKER_WORKFLOW_TASK_POLLERS,
+)
+from data_converter import build_data_converter
+from health import WorkerHealth
+from interceptors import RuntimeMetricsCollector, TimingInterceptor, report_metrics
+from metrics import start_metrics_server
+from shared import PRIORITY_BATCH, PRIORITY_INTERACTIVE, PRIORITY_TASK_QUEUES, activity_task_queue
+from structured_logging import configure_logging
+from tracing import configure_tracing, temporal_interceptors
+from workflow import (
+    AccountWorkflow,
+    BatchTransferWorkflow,
+    MoneyTransferWorkflowMod04,
+    NettingTransferWorkflow,
+)
+
+WORKFLOWS = [MoneyTransferWorkflowMod04, BatchTransferWorkflow, AccountWorkflow, NettingTransferWorkflow]
+ACTIVITIES = [
+    check_balance, withdraw, deposit, transfer, apply_account_operation, load_batch_transfers,
+    void_operation, void_account_operation,
+]
+# What AccountWorkflows run on ACCOUNT_ACTIVITY_TASK_QUEUE
+ACCOUNT_ACTIVITIES = [check_balance, withdraw, deposit, void_operation]
+
+# What a worker process can run (WORKER_ROLE)
+WORKER_ROLES = ("workflows", "activities", "both")
+
+
+def precompile_workflow_modules(workflow_classes):
+    """
+    Write the bytecode cache of the modules defining `workflow_classes`.
+    
+    The sandbox imports the workflow module again for every workflow
+    instance. Without a fresh .pyc - e.g. when PYTHONDONTWRITEBYTECODE is set,
+    as in many container images - it compiles the source every time, which
+    is most of the cost of a cold workflow task.
+    """
+    for path in {sys.modules[cls.__module__].__file__ for cls in workflow_classes}:
+        try:
+            py_compile.compile(path, doraise=True)
+        except (OSError, py_compile.PyCompileError) as e:
+            print(f"Could not write bytecode cache for {path}: {e}")
+
+
+def lane_slot_shares():
+    """
+    Share of the worker's slots reserved for each priority lane.
+    
+    Each lane gets its own pool, so the shares may add up to more than 1
+    (the process then runs more than the configured maximums).
+    """
+    return {
+        PRIORITY_INTERACTIVE: LANE_INTERACTIVE_SLOT_SHARE,
+        PRIORITY_BATCH: LANE_BATCH_SLOT_SHARE,
+    }
+
+
+def poller_behavior(pollers):
+    """A fixed number of pollers, or SDK autoscaling if `pollers` is 0."""
+    if pollers <= 0:
+        return PollerBehaviorAutoscaling()
+    return PollerBehaviorSimpleMaximum(pollers)
+
+
+def build_worker_tuner():
+    """
+    The slot tuner every lane's worker shares, or None for fixed slots.
+    
+    Returns:
+        A resource-based WorkerTuner if WORKER_TUNER is "resource-based", else None
+    
+    Raises:
+        ValueError: If WORKER_TUNER is unknown
+    """
+    if WORKER_TUNER == "fixed":
+        return None
+    
+    if WORKER_TUNER == "resource-based":
+        # Between the minimum and the maximum, slots are handed out only while
+        # CPU and memory stay under target - so the slot mix follows the load
+        # between CPU-heavy workflow tasks and I/O-heavy activities. One tuner
+        # for all lanes, since the targets are for the whole machine.
+        min_activities = min(WORKER_MAX_CONCURRENT_ACTIVITIES, WORKER_MIN_ACTIVITY_SLOTS)
+        min_workflow_tasks = min(WORKER_MAX_CONCURRENT_WORKFLOW_TASKS, WORKER_MIN_WORKFLOW_TASK_SLOTS)
+        return WorkerTuner.create_resource_based(
+            target_memory_usage=WORKER_TARGET_MEMORY_USAGE,
+            target_cpu_usage=WORKER_TARGET_CPU_USAGE,
+            workflow_config=ResourceBasedSlotConfig(
+                minimum_slots=min_workflow_tasks, maximum_slots=WORKER_MAX_CONCURRENT_WORKFLOW_TASKS
+            ),
+            activity_config=ResourceBasedSlotConfig(
+                minimum_slots=min_activities, maximum_slots=WORKER_MAX_CONCURRENT_ACTIVITIES
+            ),
+        )
+    
+    raise ValueError(f"Unknown worker tuner: {WORKER_TUNER}")
+
+
+def lane_worker_options(share, tuner=None):
+    """
+    Slot, poller and cache settings for the worker of a lane.
+    
+    Args:
+        share: Fraction of the process's slots and cache the lane gets
+        tuner: The tuner from build_worker_tuner(). If set, the lane uses it
+            instead of its share of the slots.
+    
+    Returns:
+        Keyword arguments for Worker(...), and a description for the startup log
+    """
+    options = {
+        "max_cached_workflows": max(1, int(WORKER_MAX_CACHED_WORKFLOWS * share)),
+        "workflow_task_poller_behavior": poller_behavior(WORKER_WORKFLOW_TASK_POLLERS),
+        "activity_task_poller_behavior": poller_behavior(WORKER_ACTIVITY_TASK_POLLERS),
+    }
+    
+    if tuner is not None:
+        options["tuner"] = tuner
+        return options, (
+            f"{WORKER_MIN_ACTIVITY_SLOTS}-{WORKER_MAX_CONCURRENT_ACTIVITIES} activity / "
+            f"{WORKER_MIN_WORKFLOW_TASK_SLOTS}-{WORKER_MAX_CONCURRENT_WORKFLOW_TASKS} workflow task slots, "
+            f"resource-based tuner shared by the lanes"
+        )
+    
+    max_activities = max(1, int(WORKER_MAX_CONCURRENT_ACTIVITIES * share))
+    max_workflow_tasks = max(1, int(WORKER_MAX_CONCURRENT_WORKFLOW_TASKS * share))
+    options["max_concurrent_activities"] = max_activities
+    options["max_concurrent_workflow_tasks"] = max_workflow_tasks
+    return options, f"{max_activities} activity / {max_workflow_tasks} workflow task slots"
+
+
+def lane_worker_roles(task_queue, role=WORKER_ROLE):
+    """
+    The workers a lane needs for `role`.
+    
+    With SEPARATE_ACTIVITY_TASK_QUEUES the lane's workflows and activities are
+    on different task queues, so "both" means two workers. Otherwise a single
+    worker on the lane's queue registers whatever the role runs - a
+    workflow-only and an activity-only worker can share a task queue.
+    
+    Returns:
+        List of (task queue, runs workflows, runs activities)
+    
+    Raises:
+        ValueError: If `role` is unknown
+    """
+    if role not in WORKER_ROLES:
+        raise ValueError(f"Unknown worker role: {role}")
+    runs_workflows = role in ("workflows", "both")
+    runs_activities = role in ("activities", "both")
+    activities_queue = activity_task_queue(task_queue)
+    if activities_queue == task_queue:
+        return [(task_queue, runs_workflows, runs_activities)]
+    roles = []
+    if runs_workflows:
+        roles.append((task_queue, True, False))
+    if runs_activities:
+        roles.append((activities_queue, False, True))
+    return roles
+
+
+async def run_until_signal(workers, on_stop=None):
+    """
+    Run `workers` until SIGINT or SIGTERM, then drain them.
+    
+    On a signal every worker stops polling for new tasks, gives in-flight
+    activities up to WORKER_SHUTDOWN_GRACE_SECONDS to finish (then cancels
+    them) and waits for in-flight workflow tasks. A rolling deploy then
+    doesn't leave activities behind to time out and be retried elsewhere.
+    
+    Args:
+        workers: Workers to run
+        on_stop: Called when the signal arrives, before draining starts
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    
+    running = asyncio.gather(*(worker.run() for worker in workers))
+    stopping = asyncio.create_task(stop.wait())
+    await asyncio.wait([running, stopping], return_when=asyncio.FIRST_COMPLETED)
+    stopping.cancel()
+    if stop.is_set():
+        if on_stop:
+            on_stop()
+        print(f"Shutting down: no new tasks, waiting up to {WORKER_SHUTDOWN_GRACE_SECONDS:g}s "
+              f"for in-flight activities...")
+        await asyncio.gather(*(worker.shutdown() for worker in workers))
+    # Raises if a worker failed
+    await running
+    print("Worker stopped")
 
 
 async def main():
     """Start a Temporal worker for the money transfer workflow."""
+    # Log through a background queue so log I/O never blocks the event loop
+    log_listener = configure_logging()
+    
+    if WORKER_ROLE != "activities":
+        precompile_workflow_modules(WORKFLOWS)
+    
+    # Buffer the runtime's metrics (workflow task latency, slots, ...) so we
+    # can fold them into our own histograms - or let the runtime serve them
+    if TEMPORAL_PROMETHEUS_ADDRESS:
+        collector = None
+        runtime = Runtime(telemetry=TelemetryConfig(
+            metrics=PrometheusConfig(bind_address=TEMPORAL_PROMETHEUS_ADDRESS)
+        ))
+        print(f"Temporal runtime metrics at http://{TEMPORAL_PROMETHEUS_ADDRESS}/metrics")
+    else:
+        metric_buffer = MetricBuffer(10000)
+        collector = RuntimeMetricsCollector(metric_buffer)
+        runtime = Runtime(telemetry=TelemetryConfig(metrics=metric_buffer))
+    
     # Connect to Temporal server
-    client = await Client.connect("localhost:7233")
-    
-    # Create worker
-    worker = Worker(
-        client,
-        task_queue="money-transfer-task-queue",
-        workflows=[MoneyTransferWorkflowMod04],
-        activities=[check_balance, withdraw, deposit],
+    # Tracing interceptors on the client are used by its workers too
+    configure_tracing("money-transfer-worker")
+    client = await Client.connect(
+        "localhost:7233",
+        data_converter=build_data_converter(),
+        runtime=runtime,
+        interceptors=temporal_interceptors(),
     )
     
-    print("Worker started, listening on task queue: money-transfer-task-queue")
+    # One worker per priority lane (and role). Each has its own slots, so a batch that
+    # fills the batch lane can't take the slots reserved for interactive transfers.
+    workers = []
+    max_cached_workflows = 0
+    max_activities = 0
+    tuner = build_worker_tuner()
+    for priority, share in lane_slot_shares().items():
+        options, slots = lane_worker_options(share, tuner)
+        for task_queue, runs_workflows, runs_activities in lane_worker_roles(PRIORITY_TASK_QUEUES[priority]):
+            workers.append(Worker(
+                client,
+                task_queue=task_queue,
+                workflows=WORKFLOWS if runs_workflows else [],
+                activities=ACTIVITIES if runs_activities else [],
+                interceptors=[TimingInterceptor()],
+                graceful_shutdown_timeout=timedelta(seconds=WORKER_SHUTDOWN_GRACE_SECONDS),
+                **options,
+            ))
+            if runs_workflows:
+                max_cached_workflows += options["max_cached_workflows"]
+            if runs_activities:
+                max_activities += options.get("max_concurrent_activities", WORKER_MAX_CONCURRENT_ACTIVITIES)
+            runs = " + ".join(
+                name for name, runs in (("workflows", runs_workflows), ("activities", runs_activities)) if runs
+            )
+            print(f"Worker started, listening on task queue: {task_queue} ({priority} lane, {runs}, {slots})")
+    
+    # AccountWorkflows' Account API calls get slots no lane can take: transfers
+    # waiting on an AccountWorkflow hold lane slots until those calls are done
+    if WORKER_ROLE != "workflows":
+        workers.append(Worker(
+            client,
+            task_queue=ACCOUNT_ACTIVITY_TASK_QUEUE,
+            activities=ACCOUNT_ACTIVITIES,
+            interceptors=[TimingInterceptor()],
+            graceful_shutdown_timeout=timedelta(seconds=WORKER_SHUTDOWN_GRACE_SECONDS),
+            max_concurrent_activities=WORKER_ACCOUNT_ACTIVITY_SLOTS,
+            activity_task_poller_behavior=poller_behavior(WORKER_ACTIVITY_TASK_POLLERS),
+        ))
+        max_activities += WORKER_ACCOUNT_ACTIVITY_SLOTS
+        print(f"Worker started, listening on task queue: {ACCOUNT_ACTIVITY_TASK_QUEUE} "
+              f"(account workflows' activities, {WORKER_ACCOUNT_ACTIVITY_SLOTS} activity slots)")
+    
+    # /health and /ready (load balancers, autoscalers) next to /metrics
+    health = WorkerHealth(
+        workers,
+        max_cached_workflows=max_cached_workflows,
+        max_activities=max_activities,
+    )
+    if WORKER_METRICS_PORT:
+        metrics_server = start_metrics_server(WORKER_METRICS_PORT, json_routes=health.routes())
+        print(f"Worker metrics at http://localhost:{WORKER_METRICS_PORT}/metrics, "
+              f"health at /health and /ready")
+    
     print("Waiting for workflows to execute...")
-    await worker.run()
+    metrics_task = asyncio.create_task(
+        report_metrics(collector, METRICS_DUMP_INTERVAL, snapshot_path=WORKER_METRICS_FILE or None)
+    )
+    health_task = asyncio.create_task(health.run_sampler())
+    try:
+        await run_until_signal(workers, on_stop=lambda: setattr(health, "draining", True))
+    finally:
+        metrics_task.cancel()
+        health_task.cancel()
+        if WORKER_METRICS_PORT:
+            metrics_server.shutdown()
+        log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -1,37 +1,55 @@
+import asyncio
 from datetime import timedelta
-from dataclasses import dataclass
 
 from temporalio import workflow
+from temporalio.common import RetryPolicy
+from temporalio.exceptions import ActivityError, ApplicationError, ChildWorkflowError
 
 with workflow.unsafe.imports_passed_through():
     from activities import (
         check_balance,
         withdraw,
         deposit,
+        transfer,
+        apply_account_operation,
+        load_batch_transfers,
+        void_operation,
+        void_account_operation,
         CheckBalanceInput,
         WithdrawInput,
         DepositInput,
+        TransferInput,
+        AccountOperation,
+        AccountOperationInput,
+        AccountOperationResult,
+        LoadBatchTransfersInput,
+        VoidAccountOperationInput,
+        VoidOperationInput,
+        ACCOUNT_OPERATION_FAILED,
+        ACCOUNT_WORKFLOW_DRAINING,
+        ATOMIC_TRANSFER_UNAVAILABLE,
+        INSUFFICIENT_FUNDS,
+        OPERATION_VOIDED,
     )
-
-
-@dataclass
-class MoneyTransferInput:
-    """Input for MoneyTransferWorkflowMod04."""
-    from_account: str
-    to_account: str
-    amount: float
-
-
-@dataclass
-class MoneyTransferResult:
-    """Result from MoneyTransferWorkflowMod04."""
-    success: bool
-    from_account: str
-    to_account: str
-    amount: float
-    from_account_starting_balance: float
-    to_account_starting_balance: float
-    error_message: str = ""
+    from config import ACCOUNT_ACTIVITY_TASK_QUEUE
+    from shared import (
+        AccountWorkflowInput,
+        BatchSummary,
+        BatchTransferInput,
+        MoneyTransferInput,
+        MoneyTransferResult,
+        NettingInput,
+        NettingResult,
+        WaitForProgressInput,
+        PRIORITY_BATCH,
+        PRIORITY_TASK_QUEUES,
+        TRANSFER_MODE_ACCOUNT_WORKFLOWS,
+        TRANSFER_MODE_FAST_PATH,
+        TRANSFER_MODE_SAGA,
+        TRANSFER_MODES,
+        activity_task_queue,
+    )
+    from structured_logging import log_error, log_success
 
 
 # Define the workflow steps as constants
@@ -42,6 +60,141 @@ WORKFLOW_STEPS = [
     "deposit"
 ]
 
+# Steps that must complete before each step can start. Steps whose
+# dependencies are all complete run concurrently.
+WORKFLOW_STEP_DEPENDENCIES = {
+    "check_balance_from": [],
+    "check_balance_to": [],
+    "withdraw": ["check_balance_from", "check_balance_to"],
+    "deposit": ["withdraw"],
+}
+
+# Steps when running in fast_path mode
+FAST_PATH_STEPS = ["transfer"]
+FAST_PATH_STEP_DEPENDENCIES = {"transfer": []}
+
+# Steps when running in account_workflows mode
+ACCOUNT_WORKFLOW_STEPS = ["debit", "credit"]
+ACCOUNT_WORKFLOW_STEP_DEPENDENCIES = {"debit": [], "credit": ["debit"]}
+
+# Heartbeat timeout of apply_account_operation, which waits on an
+# AccountWorkflow: a timed-out attempt learns it from its next heartbeat and
+# gives its slot back instead of holding it next to its retry
+ACCOUNT_OPERATION_HEARTBEAT_TIMEOUT = timedelta(seconds=5)
+
+# Milestones a caller can wait for with the wait_for_milestone update
+MILESTONE_WITHDRAWN = "withdrawn"
+MILESTONE_COMPLETED = "completed"
+MILESTONES = [MILESTONE_WITHDRAWN, MILESTONE_COMPLETED]
+
+# Longest a wait_for_progress update may block, in seconds
+MAX_PROGRESS_WAIT_SECONDS = 60
+
+
+def current_activity_task_queue():
+    """Task queue for the current workflow's activities (see SEPARATE_ACTIVITY_TASK_QUEUES)."""
+    return activity_task_queue(workflow.info().task_queue)
+
+# Steps after which the money has left the source account, per transfer mode
+WITHDRAWN_STEPS = ["withdraw", "transfer", "debit"]
+
+# Patch marker for running the balance checks concurrently. Workflows started
+# before this change keep running them one after the other on replay.
+PARALLEL_BALANCE_CHECKS_PATCH = "parallel-balance-checks"
+
+# Patch marker for voiding a failed step before compensating the earlier ones
+VOID_BEFORE_COMPENSATION_PATCH = "void-before-compensation"
+
+# Retry policy for steps that have a compensation registered before them:
+# give up eventually so the saga can undo the earlier steps
+COMPENSABLE_STEP_RETRY_POLICY = RetryPolicy(
+    initial_interval=timedelta(seconds=1),
+    backoff_coefficient=2.0,
+    maximum_interval=timedelta(seconds=30),
+    maximum_attempts=10,
+)
+
+# Retry policy for an AccountWorkflow's Account API calls: give up eventually,
+# so one failing call doesn't hold up every operation queued on the account
+ACCOUNT_API_RETRY_POLICY = RetryPolicy(
+    initial_interval=timedelta(seconds=1),
+    backoff_coefficient=2.0,
+    maximum_interval=timedelta(seconds=30),
+    maximum_attempts=10,
+    non_retryable_error_types=[INSUFFICIENT_FUNDS],
+)
+
+# Retry policy for compensations: keep trying, they must eventually succeed
+COMPENSATION_RETRY_POLICY = RetryPolicy(
+    initial_interval=timedelta(seconds=1),
+    backoff_coefficient=2.0,
+    maximum_interval=timedelta(minutes=1),
+)
+
+
+class Saga:
+    """
+    Compensations for the completed steps of a transfer.
+    
+    Register a compensation as soon as a step completes. If a later step
+    fails, `compensate()` runs all registered compensations concurrently (they
+    undo different steps, so they don't depend on each other) with their own
+    retry policy. Compensations must be idempotent - e.g. a deposit with an
+    idempotency key - because an activity can run more than once.
+    """
+    
+    def __init__(self, retry_policy=COMPENSATION_RETRY_POLICY, timeout=timedelta(seconds=10), on_change=None):
+        self._retry_policy = retry_policy
+        self._timeout = timeout
+        # Called whenever `progress` changes
+        self._on_change = on_change
+        self._compensations = []
+        # Compensation status per step: PENDING, RUNNING, COMPLETED or FAILED
+        self.progress = {}
+    
+    def _set_progress(self, step, status):
+        self.progress[step] = status
+        if self._on_change:
+            self._on_change()
+    
+    def add_compensation(self, step, activity_fn, arg, heartbeat_timeout=None):
+        """Register the activity that undoes `step`."""
+        self._compensations.append((step, activity_fn, arg, heartbeat_timeout))
+        self._set_progress(step, "PENDING")
+    
+    async def _compensate_step(self, step, activity_fn, arg, heartbeat_timeout):
+        self._set_progress(step, "RUNNING")
+        try:
+            await workflow.execute_activity(
+                activity_fn,
+                arg,
+                start_to_close_timeout=self._timeout,
+                heartbeat_timeout=heartbeat_timeout,
+                task_queue=current_activity_task_queue(),
+                retry_policy=self._retry_policy,
+            )
+        except ActivityError:
+            self._set_progress(step, "FAILED")
+            raise
+        self._set_progress(step, "COMPLETED")
+    
+    async def compensate(self):
+        """
+        Run every registered compensation concurrently.
+        
+        Returns:
+            List of (step, error) for compensations that failed
+        """
+        results = await asyncio.gather(
+            *(self._compensate_step(*compensation) for compensation in self._compensations),
+            return_exceptions=True,
+        )
+        return [
+            (step, result)
+            for (step, *_), result in zip(self._compensations, results)
+            if isinstance(result, BaseException)
+        ]
+
 
 @workflow.defn
 class MoneyTransferWorkflowMod04:
@@ -61,27 +214,327 @@ class MoneyTransferWorkflowMod04:
         self._from_account_starting_balance = None
         self._to_account_starting_balance = None
         # Step tracking
+        self._steps = WORKFLOW_STEPS
+        self._step_dependencies = WORKFLOW_STEP_DEPENDENCIES
         self._current_step = None
+        self._running_steps = []
         self._completed_steps = []
+        self._saga = Saga(on_change=self._state_changed)
+        # State snapshot, rebuilt whenever the state changes so queries are cheap
+        self._state_version = 0
+        self._state_snapshot = {}
+        # Version at which each key of the snapshot last changed
+        self._state_key_versions = {}
+        self._state_changed()
     
     @workflow.query
     def get_state(self) -> dict:
         """Query handler to get current workflow state."""
+        return self._state_snapshot
+    
+    @workflow.query
+    def get_state_since(self, version: int) -> dict:
+        """
+        Query handler that returns only what changed after `version`.
+        
+        Args:
+            version: The "version" of the last state the caller has seen
+            
+        Returns:
+            {"version": ..., "unchanged": True} if nothing changed, otherwise
+            {"version": ..., "changes": {...}} with every key that changed
+            (all keys if `version` is unknown)
+        """
+        if version == self._state_version:
+            return {"version": version, "unchanged": True}
+        if not 0 <= version < self._state_version:
+            return {"version": self._state_version, "changes": self._state_snapshot}
+        return {
+            "version": self._state_version,
+            "changes": {
+                key: self._state_snapshot[key]
+                for key, key_version in self._state_key_versions.items()
+                if key_version > version
+            },
+        }
+    
+    def _state_changed(self):
+        """Bump the state version and rebuild the snapshot. Call after every state change."""
+        self._state_version += 1
+        snapshot = self._build_state()
+        for key, value in snapshot.items():
+            if key not in self._state_snapshot or self._state_snapshot[key] != value:
+                self._state_key_versions[key] = self._state_version
+        snapshot["version"] = self._state_version
+        self._state_snapshot = snapshot
+    
+    def _build_state(self):
+        # Copy mutable containers so older snapshots don't change under us
         return {
             "input": {
                 "from_account": self._input.from_account if self._input else None,
                 "to_account": self._input.to_account if self._input else None,
                 "amount": self._input.amount if self._input else None,
+                "mode": self._input.mode if self._input else None,
+                "priority": self._input.priority if self._input else None,
             },
             "status": self._status,
             "result": self._result,
             "from_account_starting_balance": self._from_account_starting_balance,
             "to_account_starting_balance": self._to_account_starting_balance,
-            "steps": WORKFLOW_STEPS,
+            "steps": self._steps,
+            "step_dependencies": self._step_dependencies,
             "current_step": self._current_step,
-            "completed_steps": self._completed_steps,
+            "running_steps": list(self._running_steps),
+            "completed_steps": list(self._completed_steps),
+            "compensations": dict(self._saga.progress),
         }
     
+    @workflow.update
+    async def wait_for_milestone(self, milestone: str) -> dict:
+        """
+        Update handler that returns the workflow state once a milestone is reached.
+        
+        Sent together with the start (update-with-start) by callers that want
+        the outcome of the transfer without polling.
+        
+        Args:
+            milestone: "withdrawn" (money has left the source account) or "completed"
+        """
+        await workflow.wait_condition(lambda: self._milestone_reached(milestone))
+        return self.get_state()
+    
+    @wait_for_milestone.validator
+    def validate_milestone(self, milestone: str) -> None:
+        """Reject unknown milestones before they're written to history."""
+        if milestone not in MILESTONES:
+            raise ValueError(f"Milestone must be one of {MILESTONES}")
+    
+    @workflow.update
+    async def wait_for_progress(self, input: WaitForProgressInput) -> dict:
+        """
+        Update handler that blocks until the state changes after `after_version`.
+        
+        Lets watchers long-poll for progress: one call per change instead of
+        a stream of get_state queries.
+        
+        Returns:
+            Same as get_state_since - "unchanged" if the timeout expired first
+        """
+        try:
+            await workflow.wait_condition(
+                lambda: self._state_version != input.after_version,
+                timeout=input.timeout_seconds,
+            )
+        except asyncio.TimeoutError:
+            pass
+        return self.get_state_since(input.after_version)
+    
+    @wait_for_progress.validator
+    def validate_wait_for_progress(self, input: WaitForProgressInput) -> None:
+        """Reject waits that are too long before they're written to history."""
+        if not 0 < input.timeout_seconds <= MAX_PROGRESS_WAIT_SECONDS:
+            raise ValueError(f"timeout_seconds must be between 0 and {MAX_PROGRESS_WAIT_SECONDS}")
+    
+    def _milestone_reached(self, milestone):
+        if self._status == "COMPLETED":
+            return True
+        if milestone == MILESTONE_WITHDRAWN:
+            return any(step in self._completed_steps for step in WITHDRAWN_STEPS)
+        return False
+    
+    async def _run_step(self, step, activity_fn, arg, retry_policy=None, heartbeat_timeout=None):
+        """Run one step's activity, keeping step tracking accurate while steps overlap."""
+        self._running_steps.append(step)
+        self._update_current_step()
+        self._state_changed()
+        try:
+            result = await workflow.execute_activity(
+                activity_fn,
+                arg,
+                start_to_close_timeout=timedelta(seconds=10),
+                heartbeat_timeout=heartbeat_timeout,
+                task_queue=current_activity_task_queue(),
+                retry_policy=retry_policy,
+            )
+        except BaseException:
+            self._running_steps.remove(step)
+            self._state_changed()
+            raise
+        self._running_steps.remove(step)
+        self._completed_steps.append(step)
+        self._update_current_step()
+        self._state_changed()
+        return result
+    
+    async def _run_compensable_step(self, step, activity_fn, arg, void_activity, void_arg, heartbeat_timeout=None):
+        """
+        Run a step that comes after compensable steps.
+        
+        If it fails for good, void it so it can't be applied later (its last
+        attempt may only have timed out), then undo the earlier steps and fail
+        the transfer with a non-retryable error describing the outcome. If the
+        void finds the step was applied after all, its result is returned.
+        """
+        try:
+            return await self._run_step(
+                step, activity_fn, arg,
+                retry_policy=COMPENSABLE_STEP_RETRY_POLICY, heartbeat_timeout=heartbeat_timeout,
+            )
+        except ActivityError as e:
+            error = e.cause or e
+        
+        if workflow.patched(VOID_BEFORE_COMPENSATION_PATCH):
+            void = await workflow.execute_activity(
+                void_activity,
+                void_arg,
+                start_to_close_timeout=timedelta(seconds=10),
+                heartbeat_timeout=heartbeat_timeout,
+                task_queue=current_activity_task_queue(),
+                retry_policy=COMPENSATION_RETRY_POLICY,
+            )
+            if void.applied:
+                log_success(workflow.logger, "transfer.step_applied_after_failure", step=step, error=error)
+                # Same idempotency key, so this returns the original result
+                return await self._run_step(step, activity_fn, arg, heartbeat_timeout=heartbeat_timeout)
+        
+        self._status = "COMPENSATING"
+        self._state_changed()
+        log_error(workflow.logger, "transfer.compensating", step=step, error=error,
+                  compensations=list(self._saga.progress))
+        failures = await self._saga.compensate()
+        if failures:
+            self._status = "COMPENSATION_FAILED"
+            self._state_changed()
+            log_error(workflow.logger, "transfer.compensation_failed", step=step,
+                      failures=[f"{s}: {e.cause or e}" for s, e in failures])
+            raise ApplicationError(
+                f"Step {step} failed ({error}) and compensations failed for: "
+                f"{', '.join(s for s, _ in failures)}",
+                non_retryable=True,
+            )
+        self._status = "COMPENSATED"
+        self._state_changed()
+        log_success(workflow.logger, "transfer.compensated", step=step,
+                    compensations=list(self._saga.progress))
+        raise ApplicationError(
+            f"Step {step} failed ({error}); earlier steps were compensated",
+            non_retryable=True,
+        )
+    
+    def _update_current_step(self):
+        """Current step is the earliest running step (unchanged when nothing is running)."""
+        for step in self._steps:
+            if step in self._running_steps:
+                self._current_step = step
+                return
+    
+    async def _run_fast_path(self, input):
+        """
+        Run the whole transfer as one atomic activity.
+        
+        Returns the TransferResult, or None if the Account API doesn't support
+        atomic transfers and the saga should be used instead.
+        """
+        self._steps = FAST_PATH_STEPS
+        self._step_dependencies = FAST_PATH_STEP_DEPENDENCIES
+        self._state_changed()
+        try:
+            return await self._run_step(
+                "transfer",
+                transfer,
+                TransferInput(
+                    from_account=input.from_account,
+                    to_account=input.to_account,
+                    amount=input.amount,
+                    # A retry after a lost response must not move the money again
+                    idempotency_key=f"{workflow.info().workflow_id}-transfer",
+                ),
+            )
+        except ActivityError as e:
+            if not (isinstance(e.cause, ApplicationError) and e.cause.type == ATOMIC_TRANSFER_UNAVAILABLE):
+                raise
+        workflow.logger.warning("Atomic transfer unavailable, falling back to the multi-step saga")
+        self._steps = WORKFLOW_STEPS
+        self._step_dependencies = WORKFLOW_STEP_DEPENDENCIES
+        self._current_step = None
+        self._completed_steps = []
+        self._state_changed()
+        return None
+    
+    async def _run_via_account_workflows(self, input):
+        """Debit and credit through the accounts' AccountWorkflows."""
+        self._steps = ACCOUNT_WORKFLOW_STEPS
+        self._step_dependencies = ACCOUNT_WORKFLOW_STEP_DEPENDENCIES
+        self._state_changed()
+        workflow_id = workflow.info().workflow_id
+        debit_result = await self._run_step(
+            "debit",
+            apply_account_operation,
+            AccountOperationInput(
+                account_id=input.from_account,
+                kind="debit",
+                amount=input.amount,
+                operation_id=f"{workflow_id}-debit",
+            ),
+            heartbeat_timeout=ACCOUNT_OPERATION_HEARTBEAT_TIMEOUT,
+        )
+        self._saga.add_compensation(
+            "debit",
+            apply_account_operation,
+            AccountOperationInput(
+                account_id=input.from_account,
+                kind="credit",
+                amount=input.amount,
+                operation_id=f"{workflow_id}-debit-compensation",
+            ),
+            heartbeat_timeout=ACCOUNT_OPERATION_HEARTBEAT_TIMEOUT,
+        )
+        credit_result = await self._run_compensable_step(
+            "credit",
+            apply_account_operation,
+            AccountOperationInput(
+                account_id=input.to_account,
+                kind="credit",
+                amount=input.amount,
+                operation_id=f"{workflow_id}-credit",
+            ),
+            void_account_operation,
+            VoidAccountOperationInput(account_id=input.to_account, operation_id=f"{workflow_id}-credit"),
+            heartbeat_timeout=ACCOUNT_OPERATION_HEARTBEAT_TIMEOUT,
+        )
+        self._from_account_starting_balance = debit_result.balance + input.amount
+        self._to_account_starting_balance = credit_result.balance - input.amount
+        self._state_changed()
+        log_success(workflow.logger, "transfer.completed",
+                    from_account=input.from_account, to_account=input.to_account,
+                    amount=input.amount, mode=input.mode)
+        return await self._complete(MoneyTransferResult(
+            success=True,
+            from_account=input.from_account,
+            to_account=input.to_account,
+            amount=input.amount,
+            from_account_starting_balance=self._from_account_starting_balance,
+            to_account_starting_balance=self._to_account_starting_balance,
+        ))
+    
+    async def _complete(self, result):
+        """Record the final result in workflow state and return it."""
+        self._status = "COMPLETED"
+        self._result = {
+            'success': result.success,
+            'from_account': result.from_account,
+            'to_account': result.to_account,
+            'amount': result.amount,
+            'from_account_starting_balance': result.from_account_starting_balance,
+            'to_account_starting_balance': result.to_account_starting_balance,
+            'error_message': result.error_message
+        }
+        self._state_changed()
+        # Let wait_for_milestone callers get their answer before the workflow closes
+        await workflow.wait_condition(workflow.all_handlers_finished)
+        return result
+    
     @workflow.run
     async def run(self, input: MoneyTransferInput) -> MoneyTransferResult:
         """
@@ -95,6 +548,7 @@ class MoneyTransferWorkflowMod04:
         """
         # Store input for query access
         self._input = input
+        self._state_changed()
         
         # Set custom search attributes for from_account and to_account
         workflow.upsert_search_attributes({
@@ -102,24 +556,52 @@ class MoneyTransferWorkflowMod04:
             "to_account": [input.to_account]
         })
         
-        workflow.logger.info(
-            f"Starting money transfer: ${input.amount:.2f} from "
-            f"{input.from_account} to {input.to_account}"
-        )
+        log_success(workflow.logger, "transfer.started",
+                    from_account=input.from_account, to_account=input.to_account,
+                    amount=input.amount)
         
-        # Step 1: Check balance of source account
-        self._current_step = "check_balance_from"
-        workflow.logger.info(f"Step 1: Checking balance of {input.from_account}...")
-        from_balance_result = await workflow.execute_activity(
-            check_balance,
-            CheckBalanceInput(account_id=input.from_account),
-            start_to_close_timeout=timedelta(seconds=10),
+        if input.mode == TRANSFER_MODE_ACCOUNT_WORKFLOWS:
+            return await self._run_via_account_workflows(input)
+        
+        # Fast path: one atomic activity instead of one activity per step
+        if input.mode == TRANSFER_MODE_FAST_PATH:
+            transfer_result = await self._run_fast_path(input)
+            if transfer_result is not None:
+                self._from_account_starting_balance = transfer_result.from_account_previous_balance
+                self._to_account_starting_balance = transfer_result.to_account_previous_balance
+                self._state_changed()
+                log_success(workflow.logger, "transfer.completed",
+                            from_account=input.from_account, to_account=input.to_account,
+                            amount=input.amount, mode=input.mode)
+                return await self._complete(MoneyTransferResult(
+                    success=True,
+                    from_account=input.from_account,
+                    to_account=input.to_account,
+                    amount=input.amount,
+                    from_account_starting_balance=transfer_result.from_account_previous_balance,
+                    to_account_starting_balance=transfer_result.to_account_previous_balance,
+                ))
+        
+        # Steps 1 and 2: Check balances of source and destination accounts.
+        # They don't depend on each other, so run them at the same time.
+        check_from = self._run_step(
+            "check_balance_from", check_balance, CheckBalanceInput(account_id=input.from_account)
         )
-        self._from_account_starting_balance = from_balance_result.balance
-        self._completed_steps.append("check_balance_from")
-        workflow.logger.info(
-            f"Source account balance: ${from_balance_result.balance:.2f}"
+        check_to = self._run_step(
+            "check_balance_to", check_balance, CheckBalanceInput(account_id=input.to_account)
         )
+        if workflow.patched(PARALLEL_BALANCE_CHECKS_PATCH):
+            from_balance_result, to_balance_result = await asyncio.gather(check_from, check_to)
+        else:
+            from_balance_result = await check_from
+            to_balance_result = await check_to
+        self._from_account_starting_balance = from_balance_result.balance
+        self._to_account_starting_balance = to_balance_result.balance
+        self._state_changed()
+        log_success(workflow.logger, "step.completed", step="check_balance_from",
+                    account_id=input.from_account, balance=from_balance_result.balance)
+        log_success(workflow.logger, "step.completed", step="check_balance_to",
+                    account_id=input.to_account, balance=to_balance_result.balance)
         
         # Step 1.5: Log source account balance and keep it in state
         # calculate whole dollars - added by Jerry for ticket #24787   
@@ -131,72 +613,727 @@ class MoneyTransferWorkflowMod04:
             f"Source account balance: ${from_balance_result.balance:.2f}"
         )        
 
-        # Step 2: Check balance of destination account
-        self._current_step = "check_balance_to"
-        workflow.logger.info(f"Step 2: Checking balance of {input.to_account}...")
-        to_balance_result = await workflow.execute_activity(
-            check_balance,
-            CheckBalanceInput(account_id=input.to_account),
-            start_to_close_timeout=timedelta(seconds=10),
-        )
-        self._to_account_starting_balance = to_balance_result.balance
-        self._completed_steps.append("check_balance_to")
-        workflow.logger.info(
-            f"Destination account balance: ${to_balance_result.balance:.2f}"
-        )
-        
         # Step 3: Withdraw from source account
-        self._current_step = "withdraw"
-        workflow.logger.info(
-            f"Step 3: Withdrawing ${input.amount:.2f} from {input.from_account}..."
-        )
-        withdraw_result = await workflow.execute_activity(
-            withdraw,
-            WithdrawInput(account_id=input.from_account, amount=input.amount),
-            start_to_close_timeout=timedelta(seconds=10),
+        withdraw_result = await self._run_step(
+            "withdraw", withdraw, WithdrawInput(account_id=input.from_account, amount=input.amount)
         )
-        self._completed_steps.append("withdraw")
-        workflow.logger.info(
-            f"Withdrawal successful. New balance: ${withdraw_result.new_balance:.2f}"
+        log_success(workflow.logger, "step.completed", step="withdraw",
+                    account_id=input.from_account, new_balance=withdraw_result.new_balance)
+        # If the deposit fails for good, put the money back
+        self._saga.add_compensation(
+            "withdraw",
+            deposit,
+            DepositInput(
+                account_id=input.from_account,
+                amount=input.amount,
+                idempotency_key=f"{workflow.info().workflow_id}-withdraw-compensation",
+            ),
         )
         
         # Step 4: Deposit to destination account
-        self._current_step = "deposit"
-        workflow.logger.info(
-            f"Step 4: Depositing ${input.amount:.2f} to {input.to_account}..."
-        )
-        deposit_result = await workflow.execute_activity(
+        deposit_result = await self._run_compensable_step(
+            "deposit",
             deposit,
-            DepositInput(account_id=input.to_account, amount=input.amount),
-            start_to_close_timeout=timedelta(seconds=10),
-        )
-        self._completed_steps.append("deposit")
-        workflow.logger.info(
-            f"Deposit successful. New balance: ${deposit_result.new_balance:.2f}"
+            DepositInput(
+                account_id=input.to_account,
+                amount=input.amount,
+                # An attempt can time out after the deposit was made. Without the
+                # key a later attempt deposits again, or the saga refunds the source
+                idempotency_key=f"{workflow.info().workflow_id}-deposit",
+            ),
+            void_operation,
+            VoidOperationInput(idempotency_key=f"{workflow.info().workflow_id}-deposit"),
         )
+        log_success(workflow.logger, "step.completed", step="deposit",
+                    account_id=input.to_account, new_balance=deposit_result.new_balance)
         
-        workflow.logger.info("✓ Transfer complete!")
+        log_success(workflow.logger, "transfer.completed",
+                    from_account=input.from_account, to_account=input.to_account,
+                    amount=input.amount)
         
-        # Create result
-        result = MoneyTransferResult(
+        # Create result and update internal state
+        return await self._complete(MoneyTransferResult(
             success=True,
             from_account=input.from_account,
             to_account=input.to_account,
             amount=input.amount,
             from_account_starting_balance=from_balance_result.balance,
             to_account_starting_balance=to_balance_result.balance,
+        ))
+
+
+# Maximum number of failed transfers to keep details for in a batch summary
+MAX_BATCH_FAILURES_REPORTED = 100
+
+
+@workflow.defn
+class BatchTransferWorkflow:
+    """
+    Workflow that runs a whole batch of transfers as one durable unit.
+    
+    Each transfer runs as a MoneyTransferWorkflowMod04 child workflow, with at
+    most `max_concurrency` in flight. Results are aggregated as children
+    finish, and very large batches continue as new every `transfers_per_run`
+    transfers. The transfers themselves stay in the batch store: each run
+    loads its own slice with an activity.
+    """
+    
+    def __init__(self):
+        """Initialize workflow state."""
+        self._summary = BatchSummary()
+        self._status = "RUNNING"
+        self._in_flight = 0
+    
+    @workflow.query
+    def get_progress(self) -> dict:
+        """Query handler to get batch progress."""
+        return {
+            "status": self._status,
+            "total": self._summary.total,
+            "completed": self._summary.succeeded + self._summary.failed,
+            "succeeded": self._summary.succeeded,
+            "failed": self._summary.failed,
+            "in_flight": self._in_flight,
+            "amount_transferred": self._summary.amount_transferred,
+            "failures": self._summary.failures,
+        }
+    
+    async def _run_netted(self, offset, transfers):
+        """Settle a run's transfers with one NettingTransferWorkflow child and fold in the results."""
+        self._in_flight = len(transfers)
+        try:
+            netting_result = await workflow.execute_child_workflow(
+                NettingTransferWorkflow.run,
+                NettingInput(transfers=transfers),
+                id=f"{workflow.info().workflow_id}-netting-{offset}",
+                task_queue=PRIORITY_TASK_QUEUES[PRIORITY_BATCH],
+            )
+        finally:
+            self._in_flight = 0
+        for index, result in enumerate(netting_result.results, start=offset):
+            if result.success:
+                self._summary.succeeded += 1
+                self._summary.amount_transferred += result.amount
+            else:
+                self._summary.failed += 1
+                if len(self._summary.failures) < MAX_BATCH_FAILURES_REPORTED:
+                    self._summary.failures.append(f"{index}: {result.error_message}")
+    
+    async def _run_transfer(self, index, transfer_input, semaphore):
+        """Run one transfer as a child workflow and fold its outcome into the summary."""
+        async with semaphore:
+            self._in_flight += 1
+            try:
+                result = await workflow.execute_child_workflow(
+                    MoneyTransferWorkflowMod04.run,
+                    transfer_input,
+                    id=f"{workflow.info().workflow_id}-transfer-{index}",
+                    task_queue=PRIORITY_TASK_QUEUES[transfer_input.priority],
+                )
+                self._summary.succeeded += 1
+                self._summary.amount_transferred += result.amount
+            except ChildWorkflowError as e:
+                self._summary.failed += 1
+                if len(self._summary.failures) < MAX_BATCH_FAILURES_REPORTED:
+                    self._summary.failures.append(f"{index}: {e.cause or e}")
+            finally:
+                self._in_flight -= 1
+    
+    @workflow.run
+    async def run(self, input: BatchTransferInput) -> BatchSummary:
+        """
+        Execute the batch.
+        
+        Args:
+            input: BatchTransferInput with the batch ID and this run's offset
+            
+        Returns:
+            BatchSummary with totals for the whole batch
+        """
+        self._summary = input.summary or BatchSummary(total=input.total)
+        
+        this_run = await workflow.execute_activity(
+            load_batch_transfers,
+            LoadBatchTransfersInput(batch_id=input.batch_id, offset=input.offset, limit=input.transfers_per_run),
+            start_to_close_timeout=timedelta(seconds=30),
+            task_queue=current_activity_task_queue(),
         )
+        remaining = input.total - input.offset - len(this_run)
+        
+        log_success(workflow.logger, "batch.run_started",
+                    offset=input.offset, transfers=len(this_run), remaining=remaining)
+        
+        if input.netting:
+            await self._run_netted(input.offset, this_run)
+        else:
+            semaphore = asyncio.Semaphore(input.max_concurrency)
+            await asyncio.gather(*(
+                self._run_transfer(input.offset + i, transfer_input, semaphore)
+                for i, transfer_input in enumerate(this_run)
+            ))
+        
+        if remaining > 0 and this_run:
+            workflow.continue_as_new(BatchTransferInput(
+                batch_id=input.batch_id,
+                total=input.total,
+                max_concurrency=input.max_concurrency,
+                transfers_per_run=input.transfers_per_run,
+                offset=input.offset + len(this_run),
+                summary=self._summary,
+                netting=input.netting,
+            ))
         
-        # Update internal state
         self._status = "COMPLETED"
-        self._result = {
-            'success': result.success,
-            'from_account': result.from_account,
-            'to_account': result.to_account,
-            'amount': result.amount,
-            'from_account_starting_balance': result.from_account_starting_balance,
-            'to_account_starting_balance': result.to_account_starting_balance,
-            'error_message': result.error_message
+        log_success(workflow.logger, "batch.completed",
+                    total=self._summary.total, succeeded=self._summary.succeeded,
+                    failed=self._summary.failed)
+        return self._summary
+
+
+# Net positions smaller than this are treated as zero (float rounding)
+NETTING_EPSILON = 0.005
+
+
+@workflow.defn
+class NettingTransferWorkflow:
+    """
+    Workflow that settles many transfers with as few Account API calls as possible.
+    
+    Transfers are collected (given up front and/or submitted with the
+    `submit_transfer` update while the window is open), then reduced to one
+    net position per account. Flows that cancel out - A->B and B->A, or a
+    cycle A->B->C->A - never touch the Account API. Only net debits (first)
+    and net credits are applied, and every transfer still gets its own result.
+    """
+    
+    def __init__(self):
+        """Initialize workflow state."""
+        self._transfers = []
+        self._results = {}
+        self._window_closed = False
+        self._status = "COLLECTING"
+        self._net_positions = {}
+        self._account_mutations = 0
+        self._saga = Saga()
+    
+    @workflow.query
+    def get_state(self) -> dict:
+        """Query handler to get netting progress."""
+        return {
+            "status": self._status,
+            "transfers": len(self._transfers),
+            "settled": len(self._results),
+            "net_positions": self._net_positions,
+            "account_mutations": self._account_mutations,
+            "compensations": self._saga.progress,
         }
+    
+    @workflow.update
+    async def submit_transfer(self, transfer: MoneyTransferInput) -> MoneyTransferResult:
+        """Add a transfer to the current window and wait for it to be settled."""
+        if self._window_closed:
+            raise ApplicationError("Netting window is closed")
+        index = len(self._transfers)
+        self._transfers.append(transfer)
+        await workflow.wait_condition(lambda: index in self._results)
+        return self._results[index]
+    
+    @submit_transfer.validator
+    def validate_transfer(self, transfer: MoneyTransferInput) -> None:
+        """Reject transfers that can't be netted before they're written to history."""
+        if self._window_closed:
+            raise ValueError("Netting window is closed")
+        error_message = self._invalid_transfer_error(transfer)
+        if error_message:
+            raise ValueError(error_message)
+    
+    @staticmethod
+    def _invalid_transfer_error(transfer):
+        """Why a transfer can't be netted, or "" if it can."""
+        if transfer.amount <= 0:
+            return "Amount must be positive"
+        if transfer.from_account == transfer.to_account:
+            return "Cannot transfer to the same account"
+        return ""
+    
+    def _result(self, transfer, balances, error_message=""):
+        return MoneyTransferResult(
+            success=not error_message,
+            from_account=transfer.from_account,
+            to_account=transfer.to_account,
+            amount=transfer.amount,
+            from_account_starting_balance=balances.get(transfer.from_account, 0.0),
+            to_account_starting_balance=balances.get(transfer.to_account, 0.0),
+            error_message=error_message,
+        )
+    
+    @staticmethod
+    def _net_positions_of(transfers):
+        """Net change per account (credits minus debits)."""
+        positions = {}
+        for transfer in transfers:
+            positions[transfer.from_account] = positions.get(transfer.from_account, 0.0) - transfer.amount
+            positions[transfer.to_account] = positions.get(transfer.to_account, 0.0) + transfer.amount
+        return {account: round(net, 2) for account, net in positions.items()}
+    
+    async def _read_balances(self, accounts):
+        results = await asyncio.gather(*(
+            workflow.execute_activity(
+                check_balance,
+                CheckBalanceInput(account_id=account),
+                start_to_close_timeout=timedelta(seconds=10),
+                task_queue=current_activity_task_queue(),
+            )
+            for account in accounts
+        ))
+        return {result.account_id: result.balance for result in results}
+    
+    async def _apply(self, activity_fn, arg, retry_policy=None):
+        self._account_mutations += 1
+        return await workflow.execute_activity(
+            activity_fn,
+            arg,
+            start_to_close_timeout=timedelta(seconds=10),
+            task_queue=current_activity_task_queue(),
+            retry_policy=retry_policy,
+        )
+    
+    async def _settle(self):
+        """Net the collected transfers and apply the net debits and credits."""
+        transfers = list(self._transfers)
+        # Transfers rejected by run() already have their result
+        accepted = [i for i in range(len(transfers)) if i not in self._results]
+        accounts = sorted({transfers[i].from_account for i in accepted} | {transfers[i].to_account for i in accepted})
+        balances = await self._read_balances(accounts)
         
-        return result
+        # Drop the latest transfers out of any account that would end up
+        # negative until every net position is covered
+        while True:
+            positions = self._net_positions_of(transfers[i] for i in accepted)
+            underfunded = {a for a, net in positions.items() if net < 0 and balances[a] + net < 0}
+            if not underfunded:
+                break
+            rejected = next(i for i in reversed(accepted) if transfers[i].from_account in underfunded)
+            accepted.remove(rejected)
+            self._results[rejected] = self._result(
+                transfers[rejected], balances, "Insufficient funds after netting"
+            )
+        self._net_positions = positions
+        
+        # Keys are per run, so a later run with the same workflow ID isn't
+        # mistaken for a retry of this one
+        info = workflow.info()
+        key_prefix = f"{info.workflow_id}-{info.run_id}"
+        debits = [(a, -net) for a, net in positions.items() if net <= -NETTING_EPSILON]
+        credits = [(a, net) for a, net in positions.items() if net >= NETTING_EPSILON]
+        
+        # Debits first, so the money exists before it's credited anywhere
+        debit_results = await asyncio.gather(
+            *(
+                self._apply(
+                    withdraw,
+                    WithdrawInput(account_id=account, amount=amount, idempotency_key=f"{key_prefix}-{account}-debit"),
+                    retry_policy=COMPENSABLE_STEP_RETRY_POLICY,
+                )
+                for account, amount in debits
+            ),
+            return_exceptions=True,
+        )
+        for result in debit_results:
+            if isinstance(result, BaseException) and not isinstance(result, ActivityError):
+                raise result
+        
+        # A debit whose last attempt timed out may still be applied. Void the
+        # failed ones first, so a debit is either compensated or never applied.
+        failed = [i for i, result in enumerate(debit_results) if isinstance(result, ActivityError)]
+        if failed and workflow.patched(VOID_BEFORE_COMPENSATION_PATCH):
+            voids = await asyncio.gather(*(
+                workflow.execute_activity(
+                    void_operation,
+                    VoidOperationInput(idempotency_key=f"{key_prefix}-{debits[i][0]}-debit"),
+                    start_to_close_timeout=timedelta(seconds=10),
+                    task_queue=current_activity_task_queue(),
+                    retry_policy=COMPENSATION_RETRY_POLICY,
+                )
+                for i in failed
+            ))
+            for i, void in zip(failed, voids):
+                if void.applied:
+                    log_success(workflow.logger, "netting.debit_applied_after_failure",
+                                account=debits[i][0], error=debit_results[i].cause or debit_results[i])
+                    debit_results[i] = None
+        
+        failed_debits = []
+        for (account, amount), result in zip(debits, debit_results):
+            if isinstance(result, ActivityError):
+                failed_debits.append(f"{account}: {result.cause or result}")
+            else:
+                self._saga.add_compensation(
+                    f"withdraw:{account}",
+                    deposit,
+                    DepositInput(
+                        account_id=account,
+                        amount=amount,
+                        idempotency_key=f"{key_prefix}-{account}-compensation",
+                    ),
+                )
+        if failed_debits:
+            self._status = "COMPENSATING"
+            await self._saga.compensate()
+            error_message = f"Net debit failed ({'; '.join(failed_debits)}), nothing was transferred"
+            for i in accepted:
+                self._results[i] = self._result(transfers[i], balances, error_message)
+            return
+        
+        await asyncio.gather(*(
+            self._apply(
+                deposit,
+                DepositInput(account_id=account, amount=amount, idempotency_key=f"{key_prefix}-{account}-credit"),
+            )
+            for account, amount in credits
+        ))
+        for i in accepted:
+            self._results[i] = self._result(transfers[i], balances)
+    
+    @workflow.run
+    async def run(self, input: NettingInput) -> NettingResult:
+        """
+        Collect transfers for the window, then settle them together.
+        
+        Args:
+            input: NettingInput with the initial transfers and the window
+            
+        Returns:
+            NettingResult with one MoneyTransferResult per transfer
+        """
+        self._transfers.extend(input.transfers)
+        # Given up front, so they skipped validate_transfer
+        for i, transfer in enumerate(self._transfers):
+            error_message = self._invalid_transfer_error(transfer)
+            if error_message:
+                self._results[i] = self._result(transfer, {}, error_message)
+        if input.window_seconds > 0:
+            try:
+                await workflow.wait_condition(
+                    lambda: len(self._transfers) >= input.max_transfers,
+                    timeout=input.window_seconds,
+                )
+            except asyncio.TimeoutError:
+                pass
+        self._window_closed = True
+        
+        self._status = "SETTLING"
+        if self._transfers:
+            await self._settle()
+        self._status = "COMPLETED"
+        log_success(workflow.logger, "netting.completed",
+                    transfers=len(self._transfers), account_mutations=self._account_mutations,
+                    succeeded=sum(1 for r in self._results.values() if r.success))
+        
+        # Let submit_transfer callers get their results before the workflow closes
+        await workflow.wait_condition(workflow.all_handlers_finished)
+        return NettingResult(
+            results=[self._results[i] for i in range(len(self._transfers))],
+            account_mutations=self._account_mutations,
+        )
+
+
+def account_workflow_id(account_id):
+    """Workflow ID of the AccountWorkflow for an account."""
+    return f"account-{account_id}"
+
+
+# Applied operation IDs an AccountWorkflow remembers (and carries across
+# continue-as-new) to deduplicate retries. About 50 bytes each.
+MAX_REMEMBERED_OPERATIONS = 5000
+
+
+class _PendingOperation:
+    """An accepted operation waiting to be applied downstream."""
+    
+    def __init__(self, operation):
+        self.operation = operation
+        self.balance = None
+        self.error = None
+    
+    @property
+    def delta(self):
+        return self.operation.amount if self.operation.kind == "credit" else -self.operation.amount
+    
+    @property
+    def done(self):
+        return self.balance is not None or self.error is not None
+
+
+@workflow.defn
+class AccountWorkflow:
+    """
+    Long-lived workflow that owns all debits and credits for one account.
+    
+    Operations arrive as `apply_operation` updates and are applied strictly in
+    the order they were accepted. Debits are checked against a running balance
+    kept in workflow state, so they never race each other. Everything queued
+    while a downstream call is in flight is netted into a single deposit or
+    withdraw, so a hot account gets throughput from batching instead of
+    contention.
+    
+    Its own Account API calls run on ACCOUNT_ACTIVITY_TASK_QUEUE: the
+    apply_account_operation activities waiting on it hold slots on the lane's
+    task queue, and would otherwise take every slot those calls need.
+    
+    Operations are deduplicated by operation_id, across continue-as-new too.
+    When the history budget is used, the workflow rejects new operations
+    (senders retry them on the next run), applies the queued ones and
+    continues as new.
+    """
+    
+    def __init__(self):
+        """Initialize workflow state."""
+        self._input = None
+        # Balance confirmed by the Account API
+        self._balance = None
+        # Balance once every accepted operation is applied
+        self._projected_balance = None
+        self._pending = []
+        # Queued operations by operation_id, and balances after applied ones
+        self._pending_by_id = {}
+        self._applied = {}
+        # Voided operation IDs (a dict as an insertion-ordered set)
+        self._voided = {}
+        self._draining = False
+        self._operations_applied = 0
+        self._downstream_calls = 0
+        self._batches_sent = 0
+    
+    @workflow.query
+    def get_state(self) -> dict:
+        """Query handler to get current account state."""
+        return {
+            "account_id": self._input.account_id if self._input else None,
+            "balance": self._balance,
+            "projected_balance": self._projected_balance,
+            "pending_operations": len(self._pending),
+            "draining": self._draining,
+            "operations_applied": self._operations_applied,
+            "downstream_calls": self._downstream_calls,
+        }
+    
+    def _operation_result(self, operation, balance):
+        return AccountOperationResult(
+            account_id=self._input.account_id,
+            kind=operation.kind,
+            amount=operation.amount,
+            balance=balance,
+        )
+    
+    @workflow.update
+    async def apply_operation(self, operation: AccountOperation) -> AccountOperationResult:
+        """
+        Queue a debit or credit and wait until it's applied.
+        
+        A repeat of an applied operation_id returns the original result, and a
+        repeat of a queued one waits for it. Failed operations aren't
+        remembered, so a retry after the cause is fixed applies them.
+        """
+        await workflow.wait_condition(lambda: self._projected_balance is not None)
+        if operation.operation_id in self._applied:
+            return self._operation_result(operation, self._applied[operation.operation_id])
+        pending = self._pending_by_id.get(operation.operation_id)
+        if pending is None:
+            if operation.kind == "debit" and operation.amount > self._projected_balance:
+                raise ApplicationError(
+                    f"Insufficient funds: balance {self._projected_balance:.2f}, "
+                    f"requested {operation.amount:.2f}",
+                    type=INSUFFICIENT_FUNDS,
+                )
+            pending = _PendingOperation(operation)
+            self._projected_balance += pending.delta
+            self._pending.append(pending)
+            if operation.operation_id:
+                self._pending_by_id[operation.operation_id] = pending
+        
+        await workflow.wait_condition(lambda: pending.done)
+        if pending.error:
+            raise pending.error
+        return self._operation_result(operation, pending.balance)
+    
+    @apply_operation.validator
+    def validate_operation(self, operation: AccountOperation) -> None:
+        """Reject malformed operations, and new ones while draining, before they're written to history."""
+        if operation.kind not in ("debit", "credit"):
+            raise ValueError(f"Unknown operation kind: {operation.kind}")
+        if operation.amount <= 0:
+            raise ValueError("Amount must be positive")
+        if operation.operation_id in self._voided:
+            raise ApplicationError(f"Operation {operation.operation_id} was voided", type=OPERATION_VOIDED)
+        known = operation.operation_id in self._applied or operation.operation_id in self._pending_by_id
+        if self._draining and not known:
+            raise ApplicationError("Account workflow is continuing as new", type=ACCOUNT_WORKFLOW_DRAINING)
+    
+    @workflow.update
+    async def void_operation(self, operation_id: str) -> bool:
+        """
+        Make sure an operation is never applied, and return whether it already was.
+        
+        A queued operation is dropped (its sender gets OperationVoided) and one
+        in flight is waited for. If it wasn't applied, later sends of the ID
+        are rejected - so a transfer whose credit timed out can compensate
+        without the credit landing afterwards.
+        """
+        await workflow.wait_condition(lambda: self._projected_balance is not None)
+        pending = self._pending_by_id.get(operation_id)
+        if pending in self._pending:
+            self._pending.remove(pending)
+            self._projected_balance -= pending.delta
+            del self._pending_by_id[operation_id]
+            pending.error = ApplicationError(f"Operation {operation_id} was voided", type=OPERATION_VOIDED)
+        elif pending is not None:
+            await workflow.wait_condition(lambda: pending.done)
+        if operation_id in self._applied:
+            return True
+        if len(self._voided) >= MAX_REMEMBERED_OPERATIONS:
+            self._voided.pop(next(iter(self._voided)))
+        self._voided[operation_id] = None
+        return False
+    
+    def _remember(self, operation_id, balance):
+        if len(self._applied) >= MAX_REMEMBERED_OPERATIONS:
+            # Forget the oldest entry
+            self._applied.pop(next(iter(self._applied)))
+        self._applied[operation_id] = balance
+    
+    async def _send_batch(self, net, idempotency_key, retry_policy):
+        """Deposit or withdraw a batch's net amount."""
+        if net > 0:
+            activity_fn = deposit
+            arg = DepositInput(account_id=self._input.account_id, amount=net, idempotency_key=idempotency_key)
+        else:
+            activity_fn = withdraw
+            arg = WithdrawInput(account_id=self._input.account_id, amount=-net, idempotency_key=idempotency_key)
+        return await workflow.execute_activity(
+            activity_fn,
+            arg,
+            start_to_close_timeout=timedelta(seconds=10),
+            task_queue=ACCOUNT_ACTIVITY_TASK_QUEUE,
+            retry_policy=retry_policy,
+        )
+    
+    def _fail_batch(self, batch, error):
+        """Fail a batch's operations after its deposit or withdraw failed and was voided."""
+        insufficient_funds = isinstance(error.cause, ApplicationError) and error.cause.type == INSUFFICIENT_FUNDS
+        for pending in batch:
+            # Only debits can be short of funds - the credits netted with
+            # them are applied when their senders retry
+            error_type = (
+                INSUFFICIENT_FUNDS
+                if insufficient_funds and pending.operation.kind == "debit"
+                else ACCOUNT_OPERATION_FAILED
+            )
+            pending.error = ApplicationError(f"Failed to apply operation: {error.cause or error}", type=error_type)
+            self._pending_by_id.pop(pending.operation.operation_id, None)
+        # Rebuild the projection without the failed operations
+        self._projected_balance = self._balance + sum(p.delta for p in self._pending)
+    
+    async def _apply_batch(self, batch):
+        """Apply queued operations with (at most) one deposit or withdraw."""
+        net = sum(pending.delta for pending in batch)
+        self._batches_sent += 1
+        info = workflow.info()
+        # An attempt can time out after the Account API applied it
+        idempotency_key = f"{info.workflow_id}-{info.run_id}-batch-{self._batches_sent}"
+        try:
+            # Nothing to send downstream if everything cancels out
+            result = await self._send_batch(net, idempotency_key, ACCOUNT_API_RETRY_POLICY) if net else None
+        except ActivityError as e:
+            # The last attempt may only have timed out. Unless the call is
+            # voided first, it could still land after the operations failed -
+            # and be applied again when their senders retry.
+            void = await workflow.execute_activity(
+                void_operation,
+                VoidOperationInput(idempotency_key=idempotency_key),
+                start_to_close_timeout=timedelta(seconds=10),
+                task_queue=ACCOUNT_ACTIVITY_TASK_QUEUE,
+            )
+            if void.applied:
+                # Sent again with the same key, the Account API returns the original result
+                result = await self._send_batch(net, idempotency_key, None)
+            else:
+                self._fail_batch(batch, e)
+                return
+        
+        if result is not None:
+            self._downstream_calls += 1
+            # Trust the Account API's view of the balance before our operations
+            self._balance = result.previous_balance
+        running = self._balance
+        for pending in batch:
+            running += pending.delta
+            pending.balance = running
+            if pending.operation.operation_id:
+                self._pending_by_id.pop(pending.operation.operation_id, None)
+                self._remember(pending.operation.operation_id, running)
+        self._balance = running
+        self._projected_balance = self._balance + sum(p.delta for p in self._pending)
+        self._operations_applied += len(batch)
+    
+    def _history_budget_reached(self):
+        info = workflow.info()
+        return (
+            info.get_current_history_length() >= self._input.history_event_budget
+            or info.is_continue_as_new_suggested()
+        )
+    
+    @workflow.run
+    async def run(self, input: AccountWorkflowInput) -> None:
+        """
+        Apply operations until the history budget is used, then continue as new.
+        
+        Args:
+            input: AccountWorkflowInput with the account and (after continue-as-new)
+                its balance and recently applied operations
+        """
+        self._input = input
+        self._applied = dict(input.applied_operations)
+        self._voided = dict.fromkeys(input.voided_operations)
+        if input.balance is None:
+            balance_result = await workflow.execute_activity(
+                check_balance,
+                CheckBalanceInput(account_id=input.account_id),
+                start_to_close_timeout=timedelta(seconds=10),
+                task_queue=ACCOUNT_ACTIVITY_TASK_QUEUE,
+            )
+            self._balance = balance_result.balance
+        else:
+            self._balance = input.balance
+        self._projected_balance = self._balance
+        
+        while True:
+            await workflow.wait_condition(
+                lambda: bool(self._pending) or self._history_budget_reached()
+            )
+            # Checked on every batch, so a busy account drains too: stop taking
+            # new operations and apply the queued ones
+            if not self._draining and self._history_budget_reached():
+                self._draining = True
+            if self._pending:
+                batch = self._pending[:input.max_batch_size]
+                del self._pending[:len(batch)]
+                await self._apply_batch(batch)
+                continue
+            
+            # Nothing queued and out of history budget: let update handlers
+            # return their results, then hand over to a fresh run
+            await workflow.wait_condition(workflow.all_handlers_finished)
+            if self._pending:
+                continue
+            log_success(workflow.logger, "account.continue_as_new",
+                        account_id=input.account_id, balance=self._balance,
+                        operations_applied=self._operations_applied)
+            workflow.continue_as_new(AccountWorkflowInput(
+                account_id=input.account_id,
+                balance=self._balance,
+                history_event_budget=input.history_event_budget,
+                max_batch_size=input.max_batch_size,
+                applied_operations=self._applied,
+                voided_operations=list(self._voided),
+            ))